@@ -5,20 +5,24 @@ from sqlalchemy import pool
 
 from alembic import context
 
+from reflex_test.db.repository import database_url
+from reflex_test.db.schema import metadata
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# (unless run from the app, e.g. via `upgrade_schema`, which has its own logging setup)
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = metadata
+
+# Same database as the app unless a url was set explicitly
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", database_url())
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -43,6 +47,8 @@ def run_migrations_offline() -> None:
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
+        # SQLite can't ALTER most things, batch mode recreates the table instead
+        render_as_batch=True,
         dialect_opts={"paramstyle": "named"},
     )
 
@@ -64,7 +70,7 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
 
         with context.begin_transaction():
             context.run_migrations()
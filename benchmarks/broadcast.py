@@ -0,0 +1,242 @@
+"""Chatroom broadcast latency as the sessions are spread over more workers (connected by a `BroadcastTransport`).
+
+The workers are simulated in this process, each with its own `Broadcaster`, state manager and a fake socket.io
+namespace that encodes every update it sends once (like socket.io does for an emit to a room). Messages are sent one
+at a time from each worker in turn, and the latency is from the broadcast until the update was sent to each session.
+"shared" broadcasts the chatroom message event (one room emit per worker), "per_session" an event that is processed
+for each session. Since all workers share one event loop this shows the overhead of the transport and fan out rather
+than any speed up from running workers in parallel.
+
+Uses redis pub/sub with `--transport redis` (the server at REDIS_URL if set, otherwise in-process fakeredis).
+
+With `--slow-sessions N` that many sessions take `--slow-delay` seconds to receive each update (and are left out of
+the latencies), which holds up the broadcast for everyone unless updates go via send queues (`--queue-depth N`).
+
+Run with:
+    uv run python -m benchmarks.broadcast [--workers 1 2 4 8] [--sessions N] [--messages N] [--transport local|redis]
+        [--slow-sessions N] [--slow-delay SECONDS] [--queue-depth N] [--queue-policy drop_oldest|coalesce]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import importlib
+import json
+import statistics
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+
+import reflex as rx
+from reflex.istate.data import RouterData
+from reflex.state import StateManagerMemory
+
+from reflex_test.broadcast import Broadcaster, BroadcastTransport, LocalTransport, MemoryLog, RedisTransport
+
+importlib.import_module("reflex_test.pages.chatroom")
+# Note: `reflex_test.pages.chatroom` is shadowed by the page function of the same name
+chatroom = sys.modules["reflex_test.pages.chatroom"]
+ChatroomState = chatroom.ChatroomState
+
+
+@dataclasses.dataclass
+class BenchConfig:
+    workers: tuple[int, ...] = (1, 2, 4, 8)
+    sessions: int = 200
+    messages: int = 50
+    transport: str = "local"
+    slow_sessions: int = 0
+    slow_delay: float = 0.2
+    queue_depth: int | None = None
+    queue_policy: str = "drop_oldest"
+
+
+config = BenchConfig()
+
+
+class Deliveries:
+    """Records when each update reached a session"""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.sent = 0.0
+        self.expected = 0
+        self.done = asyncio.Event()
+
+    def start(self, expected: int) -> None:
+        self.sent, self.expected = time.perf_counter(), expected
+        self.done.clear()
+
+    def delivered(self, sessions: int) -> None:
+        now = time.perf_counter()
+        self.latencies.extend([now - self.sent] * sessions)
+        self.expected -= sessions
+        if self.expected <= 0:
+            self.done.set()
+
+
+class FakeNamespace:
+    # No socket.io server (backlog of the sockets)
+    server = None
+
+    def __init__(self, worker: Broadcaster, deliveries: Deliveries):
+        self.worker = worker
+        self.deliveries = deliveries
+
+    async def emit(self, event: str, update, to: str) -> None:
+        update.json()
+        sids = self.worker.sessions(to.split(":", 1)[1]).values()
+        fast = [sid for sid in sids if not is_slow(sid)]
+        self.deliveries.delivered(len(fast))
+        if len(fast) < len(sids):
+            # socket.io waits until the update was sent to every session in the room
+            await asyncio.sleep(config.slow_delay)
+
+    async def emit_update(self, update, sid: str) -> None:
+        update.json()
+        if is_slow(sid):
+            await asyncio.sleep(config.slow_delay)
+        else:
+            self.deliveries.delivered(1)
+
+    async def enter_room(self, sid: str, room: str) -> None:
+        pass
+
+    async def leave_room(self, sid: str, room: str) -> None:
+        pass
+
+
+def is_slow(sid: str) -> bool:
+    return int(sid.split("-")[1]) < config.slow_sessions
+
+
+def create_transport() -> BroadcastTransport:
+    if config.transport == "redis":
+        return RedisTransport(channel=f"bench-broadcast-{uuid.uuid4().hex}")
+    return LocalTransport()
+
+
+async def add_session(worker: Broadcaster, i: int) -> None:
+    token, sid = str(uuid.uuid4()), f"sid-{i}"
+    async with worker.app.state_manager.modify_state(token) as root:
+        root.router_data = {"token": token, "sid": sid}
+        root.router = RouterData(root.router_data)
+    await worker.join(chatroom.ROOM, token, sid)
+
+
+async def run_workers(worker_count: int) -> dict:
+    deliveries = Deliveries()
+    transport = create_transport()
+    workers = []
+    for _ in range(worker_count):
+        worker = Broadcaster(transport=transport)
+        if config.queue_depth is not None:
+            worker.use_send_queues(depth=config.queue_depth, policy=config.queue_policy)
+        worker.app = SimpleNamespace(
+            state_manager=StateManagerMemory(state=rx.State), event_namespace=FakeNamespace(worker, deliveries)
+        )
+        workers.append(worker)
+    listeners = [asyncio.create_task(worker.listen()) for worker in workers]
+    # Let the listeners subscribe
+    await asyncio.sleep(0.1)
+    for i in range(config.sessions):
+        await add_session(workers[i % worker_count], i)
+
+    events = {
+        "shared": lambda i: (
+            "incoming_message",
+            dict(message=chatroom.Message(username=f"user-{i}", sent=time.time(), message=f"Message {i}")),
+        ),
+        "per_session": lambda i: ("set_usernames", dict(usernames=[f"user-{i}"])),
+    }
+    results = {}
+    for mode, event in events.items():
+        deliveries.latencies = []
+        start = time.perf_counter()
+        for i in range(config.messages):
+            handler_name, payload = event(i)
+            if mode == "shared":
+                await chatroom.message_log.append(payload["message"])
+            deliveries.start(config.sessions - config.slow_sessions)
+            await workers[i % worker_count].broadcast_event(
+                chatroom.ROOM, f"{ChatroomState.get_full_name()}.{handler_name}", payload=payload
+            )
+            await asyncio.wait_for(deliveries.done.wait(), timeout=30)
+        seconds = time.perf_counter() - start
+        latencies = sorted(deliveries.latencies)
+        results[mode] = {
+            "messages_per_sec": config.messages / seconds,
+            "mean_ms": statistics.fmean(latencies) * 1e3,
+            "p50_ms": latencies[len(latencies) // 2] * 1e3,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] * 1e3,
+            "max_ms": latencies[-1] * 1e3,
+            "queues": sum_queue_stats(workers),
+        }
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+    return results
+
+
+def sum_queue_stats(workers: list[Broadcaster]) -> dict[str, int]:
+    stats: dict[str, int] = {}
+    for worker in workers:
+        if worker.send_queues is not None:
+            for name, value in worker.send_queues.stats().items():
+                stats[name] = max(stats.get(name, 0), value) if name == "max_depth" else stats.get(name, 0) + value
+    return stats
+
+
+async def run() -> dict:
+    chatroom.message_log = MemoryLog(max_entries=1000)
+    return {
+        "config": dataclasses.asdict(config),
+        "workers": {worker_count: await run_workers(worker_count) for worker_count in config.workers},
+    }
+
+
+def print_results(results: dict) -> None:
+    print(
+        f"{'workers':>7} {'mode':<12} {'msgs/sec':>9} {'mean (ms)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'max (ms)':>9}"
+    )
+    for worker_count, modes in results["workers"].items():
+        for mode, stats in modes.items():
+            print(
+                f"{worker_count:>7} {mode:<12} {stats['messages_per_sec']:>9.1f} {stats['mean_ms']:>10.3f} "
+                f"{stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['max_ms']:>9.3f}"
+            )
+            if stats["queues"]:
+                print(f"{'':>7} {'':<12} send queues: {stats['queues']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=list(config.workers), help="Worker counts to run")
+    parser.add_argument("--sessions", type=int, default=config.sessions, help="Sessions in the room (on all workers)")
+    parser.add_argument("--messages", type=int, default=config.messages, help="Messages broadcast per mode")
+    parser.add_argument("--transport", choices=["local", "redis"], default=config.transport)
+    parser.add_argument("--slow-sessions", type=int, default=config.slow_sessions)
+    parser.add_argument("--slow-delay", type=float, default=config.slow_delay, help="Seconds per update")
+    parser.add_argument("--queue-depth", type=int, help="Send updates via queues of this depth")
+    parser.add_argument("--queue-policy", choices=["drop_oldest", "coalesce"], default=config.queue_policy)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    config.workers, config.sessions, config.messages = tuple(args.workers), args.sessions, args.messages
+    config.transport = args.transport
+    config.slow_sessions, config.slow_delay = args.slow_sessions, args.slow_delay
+    config.queue_depth, config.queue_policy = args.queue_depth, args.queue_policy
+
+    results = asyncio.run(run())
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Id allocation: hi/lo blocks (`BlockIdAllocator`) against a round trip to the db sequence for every id.
+
+Concurrent tasks (spread over several simulated workers, each with its own allocator and connections to the same
+database) each create records, either one at a time or in bulk. A block size of 1 is per insert sequence allocation.
+For each block size this reports ids/sec, the number of reservations (db round trips for ids) and latency of getting
+an id, then checks that all the ids were unique.
+
+Run with:
+    uv run python -m benchmarks.id_allocation [--workers N] [--tasks N] [--ids N] [--block-sizes 1 10 100]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from reflex_test import db
+
+
+@dataclasses.dataclass
+class BenchConfig:
+    workers: int = 2
+    tasks: int = 50
+    ids: int = 20
+    bulk_size: int = 50
+    block_sizes: tuple[int, ...] = (1, 10, 100, 1000)
+
+
+config = BenchConfig()
+
+
+async def allocate_one_at_a_time(worker: db.SQLiteRepository, latencies: list[float]) -> list[int]:
+    ids = []
+    for _ in range(config.ids):
+        start = time.perf_counter()
+        ids.append(await worker.ids.allocate())
+        latencies.append(time.perf_counter() - start)
+    return ids
+
+
+async def allocate_in_bulk(worker: db.SQLiteRepository, latencies: list[float]) -> list[int]:
+    start = time.perf_counter()
+    ids = await worker.ids.allocate_many(config.bulk_size)
+    latencies.append(time.perf_counter() - start)
+    return ids
+
+
+async def run_block_size(path: Path, block_size: int) -> dict:
+    workers = [db.SQLiteRepository(path, id_block_size=block_size) for _ in range(config.workers)]
+    results = {}
+    for mode, allocate in [("single", allocate_one_at_a_time), ("bulk", allocate_in_bulk)]:
+        latencies: list[float] = []
+        reservations = sum(worker.ids.reservations for worker in workers)
+        start = time.perf_counter()
+        ids = await asyncio.gather(
+            *(allocate(workers[task % len(workers)], latencies) for task in range(config.tasks * len(workers)))
+        )
+        seconds = time.perf_counter() - start
+        all_ids = [new_id for task_ids in ids for new_id in task_ids]
+        if len(set(all_ids)) != len(all_ids):
+            raise AssertionError(f"Duplicate ids allocated with block size {block_size}")
+        results[mode] = {
+            "ids": len(all_ids),
+            "seconds": seconds,
+            "ids_per_sec": len(all_ids) / seconds,
+            "reservations": sum(worker.ids.reservations for worker in workers) - reservations,
+            "mean_ms": statistics.fmean(latencies) * 1e3,
+            "max_ms": max(latencies) * 1e3,
+        }
+    for worker in workers:
+        await worker.close()
+    return results
+
+
+async def run(path: Path) -> dict:
+    db.upgrade_schema(path)
+    return {
+        "config": dataclasses.asdict(config),
+        "block_sizes": {block_size: await run_block_size(path, block_size) for block_size in config.block_sizes},
+    }
+
+
+def print_results(results: dict) -> None:
+    print(
+        f"{'block size':>10} {'mode':<7} {'ids':>7} {'ids/sec':>10} {'reservations':>13} {'mean (ms)':>10} "
+        f"{'max (ms)':>10}"
+    )
+    for block_size, modes in results["block_sizes"].items():
+        for mode, stats in modes.items():
+            print(
+                f"{block_size:>10} {mode:<7} {stats['ids']:>7} {stats['ids_per_sec']:>10.0f} "
+                f"{stats['reservations']:>13} {stats['mean_ms']:>10.3f} {stats['max_ms']:>10.3f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=config.workers)
+    parser.add_argument("--tasks", type=int, default=config.tasks, help="Concurrent tasks per worker")
+    parser.add_argument("--ids", type=int, default=config.ids, help="Ids allocated one at a time per task")
+    parser.add_argument("--bulk-size", type=int, default=config.bulk_size, help="Ids allocated at once per task")
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=list(config.block_sizes))
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    config.workers, config.tasks, config.ids, config.bulk_size = args.workers, args.tasks, args.ids, args.bulk_size
+    config.block_sizes = tuple(args.block_sizes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(run(Path(directory) / "bench.db"))
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Persistence latency of the SQLite repository (as used by save_data/load_data) with concurrent sessions.
+
+Each session repeatedly saves a record and loads one of the records saved so far (by any session), then a single bulk
+save (`save_many`) of the same number of records is timed for comparison. Also reports how long the event loop was
+blocked at most (i.e. how late a 1ms timer fired), which should stay small since queries run on the pool threads.
+
+Run with:
+    uv run python -m benchmarks.repository [--sessions N] [--ops N] [--pool-size N] [--output FILE]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from reflex_test import db
+
+
+@dataclasses.dataclass
+class BenchConfig:
+    sessions: int = 50
+    ops: int = 20
+    pool_size: int = 4
+    seed: int = 0
+
+
+config = BenchConfig()
+
+
+class Record(BaseModel):
+    name: str
+    values: list[int]
+
+
+def new_record(rng: random.Random) -> Record:
+    return Record(name=f"record-{rng.random()}", values=[rng.randrange(1000) for _ in range(20)])
+
+
+async def run_session(repository: db.SQLiteRepository, rng: random.Random, saved_ids: list[int]) -> None:
+    for _ in range(config.ops):
+        saved_ids.append(await repository.save(new_record(rng)))
+        await repository.load(rng.choice(saved_ids))
+
+
+async def monitor_loop_lag(stop: asyncio.Event, interval: float = 0.001) -> float:
+    """Max delay (seconds) of a timer firing while the benchmark runs"""
+    loop = asyncio.get_running_loop()
+    max_lag = 0.0
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, loop.time() - start - interval)
+    return max_lag
+
+
+async def run(path: Path) -> dict:
+    db.upgrade_schema(path)
+    repository = db.SQLiteRepository(path, pool_size=config.pool_size)
+    rng = random.Random(config.seed)
+    saved_ids: list[int] = []
+    # Connect all the pool threads, not measured
+    await asyncio.gather(*(repository.load(0) for _ in range(config.pool_size)))
+    repository.reset_stats()
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(monitor_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(run_session(repository, random.Random(rng.random()), saved_ids) for _ in range(config.sessions))
+    )
+    seconds = time.perf_counter() - start
+
+    records = [new_record(rng) for _ in range(config.sessions * config.ops)]
+    bulk_start = time.perf_counter()
+    await repository.save_many(records)
+    bulk_seconds = time.perf_counter() - bulk_start
+    stop.set()
+    max_loop_lag = await lag
+    await repository.close()
+
+    total_ops = 2 * config.sessions * config.ops
+    return {
+        "config": dataclasses.asdict(config),
+        "ops": total_ops,
+        "seconds": seconds,
+        "ops_per_sec": total_ops / seconds,
+        "latency_by_operation": repository.stats(),
+        "bulk_save_records_per_sec": len(records) / bulk_seconds,
+        "single_save_records_per_sec": config.sessions * config.ops / seconds,
+        "max_loop_lag_ms": max_loop_lag * 1e3,
+    }
+
+
+def print_results(results: dict) -> None:
+    print(f"{results['ops']} ops in {results['seconds']:.2f}s: {results['ops_per_sec']:.0f} ops/sec")
+    print(
+        f"records/sec saved one at a time (interleaved with loads): {results['single_save_records_per_sec']:.0f}, "
+        f"with save_many: {results['bulk_save_records_per_sec']:.0f}"
+    )
+    print(f"max event loop lag: {results['max_loop_lag_ms']:.2f}ms")
+    print(f"{'operation':<10} {'count':>6} {'mean (ms)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'max (ms)':>10}")
+    for operation, stats in results["latency_by_operation"].items():
+        print(
+            f"{operation:<10} {stats['count']:>6} {stats['mean_ms']:>10.2f} {stats['p50_ms']:>10.2f} "
+            f"{stats['p95_ms']:>10.2f} {stats['max_ms']:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=config.sessions)
+    parser.add_argument("--ops", type=int, default=config.ops, help="Save/load pairs per session")
+    parser.add_argument("--pool-size", type=int, default=config.pool_size)
+    parser.add_argument("--seed", type=int, default=config.seed)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    config.sessions, config.ops, config.pool_size, config.seed = args.sessions, args.ops, args.pool_size, args.seed
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(run(Path(directory) / "bench.db"))
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Compare the StorageBase serializers (encode/decode time and payload size).
+
+Run with:
+    uv run python -m benchmarks.serialization [--repeat N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import sys
+import timeit
+
+import lorem
+from pydantic import BaseModel
+
+from reflex_test.storage import serialization
+
+importlib.import_module("reflex_test.pages.redis_mixin_testing")
+# Note: `reflex_test.pages.redis_mixin_testing` is shadowed by the page function of the same name
+redis_mixin_testing = sys.modules["reflex_test.pages.redis_mixin_testing"]
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+    tokens: int
+    metadata: dict[str, str]
+
+
+class RunInfo(BaseModel):
+    run_id: str
+    steps: list[str]
+    timings: list[float]
+
+
+class Conversation(BaseModel):
+    title: str
+    messages: list[Message]
+    runs: list[RunInfo]
+
+
+def large_conversation(num_messages: int = 500) -> Conversation:
+    return Conversation(
+        title=lorem.sentence(),
+        messages=[
+            Message(
+                role="user" if i % 2 else "assistant",
+                content=lorem.paragraph(),
+                tokens=i * 7,
+                metadata={"index": str(i), "model": "some-model"},
+            )
+            for i in range(num_messages)
+        ],
+        runs=[
+            RunInfo(run_id=f"run-{i}", steps=[lorem.sentence() for _ in range(5)], timings=[0.1 * j for j in range(5)])
+            for i in range(num_messages // 10)
+        ],
+    )
+
+
+def bench(value: BaseModel, serializer_name: str, repeat: int) -> dict[str, float]:
+    data = serialization.dumps(value, serializer_name)
+    assert serialization.loads(data) == value
+    encode = min(timeit.repeat(lambda: serialization.dumps(value, serializer_name), number=repeat, repeat=3)) / repeat
+    decode = min(timeit.repeat(lambda: serialization.loads(data), number=repeat, repeat=3)) / repeat
+    return {"encode_us": encode * 1e6, "decode_us": decode * 1e6, "bytes": len(data)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    values = {
+        "A": redis_mixin_testing.A(foo=1, bar=2, baz=3),
+        "B": redis_mixin_testing.B(fe="fum", fi="fo", fo="fi"),
+        "Conversation(50)": large_conversation(50),
+        "Conversation(500)": large_conversation(500),
+    }
+    print(f"{'value':<20} {'serializer':<10} {'encode (us)':>12} {'decode (us)':>12} {'bytes':>10}")
+    for value_name, value in values.items():
+        repeat = args.repeat if len(value.model_dump_json()) < 10_000 else max(args.repeat // 20, 1)
+        for serializer_name in serialization.serializers:
+            result = bench(value, serializer_name, repeat)
+            print(
+                f"{value_name:<20} {serializer_name:<10} {result['encode_us']:>12.1f} {result['decode_us']:>12.1f} "
+                f"{result['bytes']:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
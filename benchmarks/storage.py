@@ -0,0 +1,271 @@
+"""Simulate concurrent sessions using StorageBase (via the redis_mixin_testing page states) against fakeredis.
+
+Each session repeatedly runs one of the operations below (followed by resolving the delta, i.e. recomputing any
+storage_vars, like an event would):
+    handle_change_a  store a new A under a new key (async client)
+    update_b         load, modify and store B under the same key (async client)
+    recompute        mark the storage_vars dirty and recompute them (async prefetch)
+    sync_recompute   load_prefetched without a prefetch or cached value (sync client fallback)
+
+Reports ops/sec, latency percentiles, bytes sent to redis and the share of CPU time spent (de)serializing, and writes
+the results as json (to compare runs before/after a change).
+
+Note: The async fakeredis client polls for responses (every 10ms while a response isn't ready), so absolute latencies
+are not representative of a real redis server, compare runs with each other rather than with production numbers.
+
+Run with:
+    uv run python -m benchmarks.storage [--sessions N] [--ops N] [--storage-mode value|hash|content] [--output FILE]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import importlib
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import reflex as rx
+import redis.asyncio.connection
+import redis.connection
+from reflex.istate.data import RouterData
+from reflex.state import _resolve_delta
+
+from reflex_test.storage import backend, serialization, storage_cache
+
+importlib.import_module("reflex_test.pages.redis_mixin_testing")
+# Note: `reflex_test.pages.redis_mixin_testing` is shadowed by the page function of the same name
+redis_mixin_testing = sys.modules["reflex_test.pages.redis_mixin_testing"]
+
+OPERATIONS = ["handle_change_a", "update_b", "recompute", "sync_recompute"]
+
+
+@dataclasses.dataclass
+class BenchConfig:
+    sessions: int = 50
+    ops: int = 20
+    storage_mode: str = "value"
+    serializer: str = "json"
+    local_cache: bool = True
+    batch_loads: bool = True
+    seed: int = 0
+
+
+config = BenchConfig()
+
+
+class BenchStorage(redis_mixin_testing.ABStorageMixin, rx.State):
+    def serializer(self, attr: str) -> str:
+        return config.serializer
+
+    def storage_mode(self, attr: str) -> str:
+        return config.storage_mode
+
+
+class BenchA(redis_mixin_testing.DisplayA, BenchStorage):
+    pass
+
+
+class BenchB(redis_mixin_testing.DisplayB, BenchStorage):
+    pass
+
+
+class Counters:
+    """Bytes sent to redis (and how many times, i.e. round trips) and time spent (de)serializing"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.round_trips = 0
+        self.serialization_seconds = 0.0
+
+    @contextlib.contextmanager
+    def patched(self):
+        with contextlib.ExitStack() as stack:
+            for connection_class in (redis.asyncio.connection.AbstractConnection, redis.connection.AbstractConnection):
+                # A single command, or all the commands of a pipeline
+                for name in ("pack_command", "pack_commands"):
+                    stack.enter_context(self._count_sent(connection_class, name))
+            for name in ("dumps", "loads", "dump_fields", "load_hash"):
+                stack.enter_context(self._time_calls(serialization, name))
+            yield
+
+    @contextlib.contextmanager
+    def _count_sent(self, cls, name: str):
+        original = getattr(cls, name)
+
+        @functools.wraps(original)
+        def counting(connection, *args):
+            packed = original(connection, *args)
+            self.bytes_sent += sum(len(chunk) for chunk in packed)
+            self.round_trips += 1
+            return packed
+
+        setattr(cls, name, counting)
+        try:
+            yield
+        finally:
+            setattr(cls, name, original)
+
+    @contextlib.contextmanager
+    def _time_calls(self, module, name: str):
+        original = getattr(module, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.serialization_seconds += time.perf_counter() - start
+
+        setattr(module, name, timed)
+        try:
+            yield
+        finally:
+            setattr(module, name, original)
+
+
+def new_session() -> rx.State:
+    root = rx.State(_reflex_internal_init=True)
+    router_data = {"token": str(uuid.uuid4()), "sid": "sid"}
+    root.router_data = router_data
+    root.router = RouterData(router_data)
+    return root
+
+
+def substate(root: rx.State, state_cls: type[rx.State]) -> rx.State:
+    return root.get_substate(state_cls.get_full_name().split(".")[1:])
+
+
+async def resolve(root: rx.State) -> None:
+    await _resolve_delta(root.get_delta())
+    root._clean()
+
+
+async def run_operation(root: rx.State, operation: str) -> None:
+    bench_a, bench_b = substate(root, BenchA), substate(root, BenchB)
+    if operation == "handle_change_a":
+        await bench_a.handle_change_a()
+    elif operation == "update_b":
+        await bench_b.update_b()
+    elif operation == "recompute":
+        for state in (bench_a, bench_b):
+            for var_name in ("a", "b"):
+                state.computed_vars[var_name].mark_dirty(instance=state)
+                state.dirty_vars.add(var_name)
+            state._mark_dirty()
+    elif operation == "sync_recompute":
+        unique_key = bench_b._generate_key("key_b", bench_b.key_b)
+        storage_cache.invalidate(unique_key)
+        bench_b.load_prefetched("key_b", bench_b.key_b, redis_mixin_testing.B)
+    else:
+        raise ValueError(f"Unknown operation {operation}")
+    await resolve(root)
+
+
+async def run_session(root: rx.State, rng: random.Random, latencies: dict[str, list[float]]) -> None:
+    for _ in range(config.ops):
+        operation = rng.choice(OPERATIONS)
+        start = time.perf_counter()
+        await run_operation(root, operation)
+        latencies[operation].append(time.perf_counter() - start)
+
+
+def summarize(latencies: list[float]) -> dict[str, float]:
+    # quantiles needs at least two values
+    percentiles = statistics.quantiles(latencies * 2 if len(latencies) < 2 else latencies, n=100, method="inclusive")
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1e3,
+        "p50_ms": percentiles[49] * 1e3,
+        "p95_ms": percentiles[94] * 1e3,
+        "p99_ms": percentiles[98] * 1e3,
+    }
+
+
+async def run() -> dict:
+    backend.set_clients(*backend.create_clients())
+    storage_cache.clear()
+    storage_cache.reset_stats()
+    BenchStorage.local_cache = config.local_cache
+    BenchStorage.batch_loads = config.batch_loads
+    rng = random.Random(config.seed)
+
+    sessions = [new_session() for _ in range(config.sessions)]
+    # Initial values (and first render) for every session, not measured
+    for root in sessions:
+        await substate(root, BenchA).handle_change_both()
+        await resolve(root)
+
+    counters = Counters()
+    latencies: defaultdict[str, list[float]] = defaultdict(list)
+    with counters.patched():
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        await asyncio.gather(*(run_session(root, random.Random(rng.random()), latencies) for root in sessions))
+        cpu_seconds, wall_seconds = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    total_ops = sum(len(op_latencies) for op_latencies in latencies.values())
+    return {
+        "config": dataclasses.asdict(config),
+        "ops": total_ops,
+        "seconds": wall_seconds,
+        "ops_per_sec": total_ops / wall_seconds,
+        "latency": summarize([latency for op_latencies in latencies.values() for latency in op_latencies]),
+        "latency_by_operation": {operation: summarize(latencies[operation]) for operation in sorted(latencies)},
+        "bytes_sent": counters.bytes_sent,
+        "bytes_sent_per_op": counters.bytes_sent / total_ops,
+        "redis_round_trips": counters.round_trips,
+        "serialization_cpu_share": counters.serialization_seconds / cpu_seconds if cpu_seconds else 0.0,
+        "cache": storage_cache.stats(),
+    }
+
+
+def print_results(results: dict) -> None:
+    print(f"{results['ops']} ops in {results['seconds']:.2f}s: {results['ops_per_sec']:.0f} ops/sec")
+    print(
+        f"bytes sent: {results['bytes_sent']} ({results['bytes_sent_per_op']:.0f}/op), "
+        f"redis round trips: {results['redis_round_trips']}, "
+        f"serialization CPU share: {results['serialization_cpu_share']:.1%}"
+    )
+    print(f"{'operation':<16} {'count':>6} {'mean (ms)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+    for operation, stats in {"all": results["latency"], **results["latency_by_operation"]}.items():
+        print(
+            f"{operation:<16} {stats['count']:>6} {stats['mean_ms']:>10.2f} {stats['p50_ms']:>10.2f} "
+            f"{stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=config.sessions)
+    parser.add_argument("--ops", type=int, default=config.ops, help="Operations per session")
+    parser.add_argument("--storage-mode", choices=["value", "hash", "content"], default=config.storage_mode)
+    parser.add_argument("--serializer", choices=list(serialization.serializers), default=config.serializer)
+    parser.add_argument("--no-local-cache", action="store_true")
+    parser.add_argument("--no-batch-loads", action="store_true")
+    parser.add_argument("--seed", type=int, default=config.seed)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    config.sessions, config.ops, config.seed = args.sessions, args.ops, args.seed
+    config.storage_mode, config.serializer = args.storage_mode, args.serializer
+    config.local_cache, config.batch_loads = not args.no_local_cache, not args.no_batch_loads
+
+    results = asyncio.run(run())
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from .broadcaster import Broadcaster, broadcaster, enable_broadcast, is_shared, shared
+from .message_log import MemoryLog, MessageLog, RedisStreamLog
+from .presence import PresenceDiff, PresenceIndex
+from .send_queue import Outgoing, SendQueues, merge_updates
+from .transport import BroadcastMessage, BroadcastTransport, LocalTransport, RedisTransport
+
+__all__ = [
+    "BroadcastMessage",
+    "BroadcastTransport",
+    "Broadcaster",
+    "LocalTransport",
+    "MemoryLog",
+    "MessageLog",
+    "Outgoing",
+    "PresenceDiff",
+    "PresenceIndex",
+    "RedisStreamLog",
+    "RedisTransport",
+    "SendQueues",
+    "broadcaster",
+    "enable_broadcast",
+    "is_shared",
+    "merge_updates",
+    "shared",
+]
@@ -0,0 +1,374 @@
+"""Broadcast events to every session in a room (e.g. all tabs with the chatroom open).
+
+Events whose handler is marked `@shared` produce the same delta for every session (they only depend on their payload
+and on data shared by all sessions, not on per-session vars), so the handler is run once on an isolated instance of
+its state and the update is emitted to the socket.io room in a single call (socket.io encodes it once for all the
+recipients). Any other event falls back to being processed for each session in the room (via the state manager, so
+this also works with StateManagerRedis).
+
+With send queues (`enable_broadcast(app, queue_depth=...)`) updates are put in a bounded queue per session instead of
+being emitted directly, so that a slow client never holds up the broadcast for the others (see `SendQueues`).
+
+Broadcasts are also published to a `BroadcastTransport` (redis pub/sub by default), and every worker delivers the
+events published by the others to the sessions connected to it, so a room can span several backend workers.
+
+Enable with `enable_broadcast(app)`, then sessions join rooms with `broadcaster.join(room, token, sid)` (and are removed
+again when they disconnect).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import logging
+import uuid
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+import reflex as rx
+from engineio import packet as eio_packet
+from reflex.constants import SocketEvent
+from reflex.event import Event, EventHandler
+from reflex.state import BaseState, StateUpdate, _substate_key
+from socketio import packet as sio_packet
+
+from reflex_test.broadcast.send_queue import Outgoing, Policy, SendQueues
+from reflex_test.broadcast.transport import BroadcastMessage, BroadcastTransport, RedisTransport
+
+logger = logging.getLogger(__name__)
+
+Delta = dict[str, dict[str, Any]]
+
+# Called with the token of a session that left a room (i.e. disconnected)
+LeaveHandler = Callable[[str], Awaitable[None]]
+# Called when another worker starts listening for broadcasts
+WorkerStartedHandler = Callable[[], Awaitable[None]]
+
+
+def shared[F: Callable](fn: F) -> F:
+    """
+    Mark an event handler as producing the same delta for every session, i.e. it only uses its payload and data shared
+    by all sessions (the handler runs on an isolated instance of its state, without parent or substates)
+    """
+    fn._broadcast_shared = True
+    return fn
+
+
+def is_shared(handler: EventHandler) -> bool:
+    return getattr(handler.fn, "_broadcast_shared", False)
+
+
+class Broadcaster:
+    def __init__(
+        self, app: rx.App | None = None, room_prefix: str = "broadcast", transport: BroadcastTransport | None = None
+    ):
+        self.app = app
+        self.room_prefix = room_prefix
+        # Broadcasts only reach the sessions connected to this worker without a transport
+        self.transport = transport
+        # Updates are emitted directly (and the broadcast waits for them) without send queues
+        self.send_queues: SendQueues | None = None
+        self.worker_id = uuid.uuid4().hex
+        # room -> {token: sid} of the sessions connected to this worker that joined it
+        self._rooms: defaultdict[str, dict[str, str]] = defaultdict(dict)
+        self._leave_handlers: defaultdict[str, list[LeaveHandler]] = defaultdict(list)
+        self._worker_started_handlers: list[WorkerStartedHandler] = []
+        self._tasks: set[asyncio.Task] = set()
+        # room -> lock held while delivering a received broadcast (and the number of broadcasts waiting for it)
+        self._receiving: dict[str, tuple[asyncio.Lock, int]] = {}
+        self.shared_broadcasts = 0
+        self.per_session_broadcasts = 0
+        self.received = 0
+
+    def use_send_queues(self, depth: int = 100, policy: Policy = "drop_oldest", max_backlog: int = 16) -> SendQueues:
+        """Put updates in a bounded queue per session rather than emitting them directly"""
+        self.send_queues = SendQueues(
+            self._send_queued, depth=depth, policy=policy, backlog=self._socket_backlog, max_backlog=max_backlog
+        )
+        return self.send_queues
+
+    def room_name(self, room: str) -> str:
+        return f"{self.room_prefix}:{room}"
+
+    def sessions(self, room: str) -> dict[str, str]:
+        """{token: sid} of the sessions in the room (on this worker)"""
+        return dict(self._rooms.get(room, {}))
+
+    async def join(self, room: str, token: str, sid: str) -> None:
+        sessions = self._rooms[room]
+        if (previous_sid := sessions.get(token)) not in (None, sid):
+            # Same tab, new connection (e.g. after a reload)
+            await self.app.event_namespace.leave_room(previous_sid, self.room_name(room))
+        sessions[token] = sid
+        await self.app.event_namespace.enter_room(sid, self.room_name(room))
+
+    def on_leave(self, room: str, handler: LeaveHandler) -> None:
+        """Call handler (in a task) when a session leaves the room"""
+        self._leave_handlers[room].append(handler)
+
+    def disconnected(self, sid: str) -> list[str]:
+        """Forget the session in all rooms (socket.io removes it from its rooms itself), returns the rooms it was in"""
+        rooms = []
+        for room, sessions in list(self._rooms.items()):
+            for token, session_sid in list(sessions.items()):
+                if session_sid == sid:
+                    del sessions[token]
+                    rooms.append(room)
+                    self._left(room, token)
+            if not sessions:
+                del self._rooms[room]
+        if self.send_queues is not None:
+            self.send_queues.close(sid)
+        return rooms
+
+    def on_worker_started(self, handler: WorkerStartedHandler) -> None:
+        """Call handler when another worker starts listening (e.g. to send it the state of the rooms on this worker)"""
+        self._worker_started_handlers.append(handler)
+
+    def _left(self, room: str, token: str) -> None:
+        for handler in self._leave_handlers.get(room, ()):
+            self._run(handler(token))
+
+    def _run(self, coroutine: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def join_tasks(self) -> None:
+        """Wait until the tasks that were started (leave handlers, per session broadcasts etc.) have finished"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def listen(self) -> None:
+        """Deliver the broadcasts of the other workers (runs until cancelled)"""
+        await self.transport.listen(self.receive, on_ready=self._announce)
+
+    async def _announce(self) -> None:
+        await self.transport.publish(BroadcastMessage(origin=self.worker_id, room="", name="", kind="hello"))
+
+    async def receive(self, message: BroadcastMessage) -> None:
+        if message.origin == self.worker_id:
+            # Already delivered when it was broadcast
+            return
+        self.received += 1
+        if message.kind == "hello":
+            for handler in self._worker_started_handlers:
+                self._run(handler())
+        else:
+            # Even without sessions in the room here, shared events may update data shared by the sessions of this worker
+            async with self._receiving_room(message.room):
+                await self.deliver(message.room, message.name, message.payload)
+
+    @contextlib.asynccontextmanager
+    async def _receiving_room(self, room: str):
+        """
+        Deliver the received broadcasts of a room one at a time, in the order they were received (the transport handles
+        messages concurrently, so e.g. an older chat window read from the log could otherwise be emitted after a newer
+        one), while broadcasts to different rooms are still delivered concurrently.
+        """
+        lock, waiting = self._receiving.get(room) or (asyncio.Lock(), 0)
+        self._receiving[room] = (lock, waiting + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, waiting = self._receiving[room]
+            if waiting == 1:
+                del self._receiving[room]
+            else:
+                self._receiving[room] = (lock, waiting - 1)
+
+    async def emit_delta(self, room: str, delta: Delta) -> None:
+        """Send the same delta to every session in the room (one emit, encoded once, or the same update queued)"""
+        update = StateUpdate(delta=delta)
+        if self.send_queues is None:
+            await self.app.event_namespace.emit(str(SocketEvent.EVENT), update, to=self.room_name(room))
+            return
+        # Queued once for everyone, so it's still only encoded once
+        outgoing = Outgoing(update)
+        for sid in self._rooms.get(room, {}).values():
+            self.send_queues.put(sid, outgoing)
+
+    async def _send_update(self, sid: str, update: StateUpdate) -> None:
+        await self.app.event_namespace.emit_update(update=update, sid=sid)
+
+    # Sending the encoded packets as is and the socket backlog rely on private python-socketio/engineio attributes
+    # (the versions are pinned in pyproject.toml). Without them, updates are emitted normally (encoded per session) and
+    # there is no backpressure.
+
+    async def _send_queued(self, sid: str, outgoing: Outgoing) -> None:
+        namespace = self.app.event_namespace
+        server = getattr(namespace, "server", None)
+        send_eio_packet = getattr(server, "_send_eio_packet", None)
+        eio_sid = server.manager.eio_sid_from_sid(sid, namespace.namespace) if send_eio_packet is not None else None
+        if eio_sid is None:
+            await self._send_update(sid, outgoing.update)
+            return
+        # Like an emit to a room, the packets are encoded once and sent as is to each session
+        for eio_pkt in outgoing.encoded(self._encode_packets):
+            await send_eio_packet(eio_sid, eio_pkt)
+
+    def _encode_packets(self, update: StateUpdate) -> list[eio_packet.Packet]:
+        namespace = self.app.event_namespace
+        pkt = namespace.server.packet_class(
+            sio_packet.EVENT, namespace=namespace.namespace, data=[str(SocketEvent.EVENT), update]
+        )
+        encoded = pkt.encode()
+        return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in (encoded if isinstance(encoded, list) else [encoded])]
+
+    def _socket_backlog(self, sid: str) -> int:
+        """Packets engine.io hasn't written to the session's socket yet (0 if that can't be told)"""
+        namespace = self.app.event_namespace
+        server = getattr(namespace, "server", None)
+        sockets = getattr(getattr(server, "eio", None), "sockets", None)
+        if sockets is None:
+            return 0
+        eio_sid = server.manager.eio_sid_from_sid(sid, namespace.namespace)
+        queue = getattr(sockets.get(eio_sid), "queue", None) if eio_sid is not None else None
+        return queue.qsize() if queue is not None else 0
+
+    async def broadcast_event(
+        self, room: str, name: str, payload: dict[str, Any] | None = None, from_state: BaseState | None = None
+    ) -> None:
+        """
+        Process the event for every session in the room (on every worker)
+
+        Args:
+            room: The room to broadcast to
+            name: Full name of the event handler (i.e. `f"{State.get_full_name()}.handler_name"`)
+            payload: The event payload (json serializable, to be published to the other workers)
+            from_state: The state of the event that is broadcasting (if any), it is already locked by that event so is
+                processed directly (rather than via the state manager) if the event has to be processed per session,
+                and the other sessions are then processed in a task (after `broadcast_event` returns). Must be passed
+                when broadcasting from an event handler, i.e. while holding the lock of a session.
+        """
+        payload = payload or {}
+        if self.transport is not None:
+            await self.transport.publish(BroadcastMessage(origin=self.worker_id, room=room, name=name, payload=payload))
+        await self.deliver(room, name, payload, from_state=from_state)
+
+    async def deliver(self, room: str, name: str, payload: dict[str, Any], from_state: BaseState | None = None) -> None:
+        """Process the event for the sessions in the room that are connected to this worker"""
+        state_path, handler_name = name.rsplit(".", 1)
+        state_cls = rx.State.get_class_substate(state_path)
+        handler = state_cls.event_handlers[handler_name]
+        if is_shared(handler):
+            self.shared_broadcasts += 1
+            delta = await self.shared_delta(state_cls, handler, payload)
+            if delta:
+                await self.emit_delta(room, delta)
+        else:
+            self.per_session_broadcasts += 1
+            await self._broadcast_per_session(room, state_cls, name, payload, from_state)
+
+    def deliver_later(self, room: str, tokens: Iterable[str], name: str, payload: dict[str, Any] | None = None) -> None:
+        """Process the event (in a task) for the given sessions in the room that are connected to this worker, e.g. to
+        follow up a shared update with the changes that differ per session"""
+        tokens = set(tokens)
+        sessions = {token: sid for token, sid in self.sessions(room).items() if token in tokens}
+        if sessions:
+            state_cls = rx.State.get_class_substate(name.rsplit(".", 1)[0])
+            self._run(self._process_sessions(sessions, state_cls, name, payload or {}))
+
+    @staticmethod
+    async def shared_delta(state_cls: type[BaseState], handler: EventHandler, payload: dict[str, Any]) -> Delta:
+        """Run the (shared) handler once on an isolated instance of its state"""
+        state = state_cls(init_substates=False, _reflex_internal_init=True)
+        delta: Delta = {}
+        async for update in state._process_event(handler=handler, state=state, payload=payload):
+            for state_name, state_delta in update.delta.items():
+                delta.setdefault(state_name, {}).update(state_delta)
+        return delta
+
+    async def _broadcast_per_session(
+        self,
+        room: str,
+        state_cls: type[BaseState],
+        name: str,
+        payload: dict[str, Any],
+        from_state: BaseState | None,
+    ) -> None:
+        """Process the event for each session in the room (for handlers that use per-session data)"""
+        sessions = self.sessions(room)
+        if from_state is None:
+            await self._process_sessions(sessions, state_cls, name, payload)
+            return
+        from_token = from_state.router.session.client_token
+        if (from_sid := sessions.pop(from_token, None)) is not None:
+            root = from_state._get_root_state()
+            await self._send_updates(
+                [(from_sid, update) for update in await self._process(root, from_token, name, payload)]
+            )
+        # The other sessions are processed in a task, so that no session's lock is waited for while holding the lock of
+        # the broadcasting session (two sessions broadcasting at the same time would each wait for the other)
+        self._run(self._process_sessions(sessions, state_cls, name, payload))
+
+    async def _process_sessions(
+        self, sessions: dict[str, str], state_cls: type[BaseState], name: str, payload: dict[str, Any]
+    ) -> None:
+        """Process the event for each of the sessions (holding only one session's lock at a time)"""
+        updates: list[tuple[str, StateUpdate]] = []
+        for token, sid in sessions.items():
+            async with self.app.state_manager.modify_state(_substate_key(token, state_cls)) as root:
+                updates.extend((sid, update) for update in await self._process(root, token, name, payload))
+        await self._send_updates(updates)
+
+    async def _send_updates(self, updates: list[tuple[str, StateUpdate]]) -> None:
+        if self.send_queues is None:
+            await asyncio.gather(*(self._send_update(sid, update) for sid, update in updates))
+            return
+        for sid, update in updates:
+            self.send_queues.put(sid, update)
+
+    @staticmethod
+    async def _process(root: BaseState, token: str, name: str, payload: dict[str, Any]) -> list[StateUpdate]:
+        event = Event(token=token, name=name, router_data=root.router_data, payload=payload)
+        return [update async for update in root._process(event)]
+
+
+broadcaster = Broadcaster()
+
+
+def enable_broadcast(
+    app: rx.App,
+    transport: BroadcastTransport | None = None,
+    queue_depth: int | None = None,
+    queue_policy: Policy = "drop_oldest",
+) -> Broadcaster:
+    """
+    Use the app for `broadcaster` (and remove sessions from its rooms when they disconnect), and deliver the broadcasts
+    of the other workers via the transport (redis pub/sub by default). With a queue_depth, updates are sent via
+    bounded per session queues with the queue_policy (see `SendQueues`).
+
+    Examples:
+        app = rx.App()
+        enable_broadcast(app, queue_depth=100, queue_policy="coalesce")
+    """
+    broadcaster.app = app
+    broadcaster.transport = transport if transport is not None else RedisTransport()
+    if queue_depth is not None:
+        broadcaster.use_send_queues(depth=queue_depth, policy=queue_policy)
+
+    def wrap_on_disconnect():
+        # The event namespace only exists once the app has been set up, so wrap it when the server starts
+        namespace = app.event_namespace
+        if namespace is None:
+            logger.warning("App has no event namespace, not removing disconnected sessions from broadcast rooms")
+            return
+        on_disconnect = namespace.on_disconnect
+
+        @functools.wraps(on_disconnect)
+        def on_disconnect_and_leave_rooms(sid: str):
+            broadcaster.disconnected(sid)
+            return on_disconnect(sid)
+
+        namespace.on_disconnect = on_disconnect_and_leave_rooms
+
+    async def listen_for_broadcasts():
+        await broadcaster.listen()
+
+    app.register_lifespan_task(wrap_on_disconnect)
+    app.register_lifespan_task(listen_for_broadcasts)
+    return broadcaster
@@ -0,0 +1,100 @@
+"""Shared, bounded, append-only logs (e.g. of chat messages) that sessions read through a cursor.
+
+Entries get an id when appended, ids increase with every append and are opaque strings (only ever compared by the log
+itself), so a session only has to keep the id of the oldest entry it shows to page further back through the history.
+
+`MemoryLog` keeps the log in process memory (a single worker), `RedisStreamLog` keeps it in a redis stream (via the
+StorageBase redis client) so that it is shared by all workers.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+from collections import deque
+from collections.abc import Callable
+from typing import Protocol
+
+from reflex_test.storage.backend import get_redis
+
+logger = logging.getLogger(__name__)
+
+# (entry id, entry), oldest first
+type Entries[T] = list[tuple[str, T]]
+
+
+class MessageLog[T](Protocol):
+    async def append(self, entry: T) -> str:
+        """Add the entry (dropping the oldest entries once the log is full), returns its id"""
+        ...
+
+    async def latest(self, count: int, before: str | None = None) -> Entries[T]:
+        """Up to count of the newest entries (older than the entry with id before, if given)"""
+        ...
+
+    async def between(self, start: str, before: str | None = None) -> Entries[T]:
+        """The entries from the entry with id start (and older than the entry with id before, if given)"""
+        ...
+
+
+class MemoryLog[T]:
+    """Log in process memory, only shared by the sessions connected to this worker"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: deque[tuple[int, T]] = deque(maxlen=max_entries)
+        self._seq = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def append(self, entry: T) -> str:
+        seq = next(self._seq)
+        self._entries.append((seq, entry))
+        return str(seq)
+
+    async def latest(self, count: int, before: str | None = None) -> Entries[T]:
+        end = len(self._entries) if before is None else self._index(int(before))
+        return [(str(seq), entry) for seq, entry in itertools.islice(self._entries, max(end - count, 0), end)]
+
+    async def between(self, start: str, before: str | None = None) -> Entries[T]:
+        begin = self._index(int(start))
+        end = len(self._entries) if before is None else self._index(int(before))
+        return [(str(seq), entry) for seq, entry in itertools.islice(self._entries, begin, max(end, begin))]
+
+    def _index(self, seq: int) -> int:
+        """Index of the first entry with a seq >= seq (seqs are consecutive, but the oldest may have been dropped)"""
+        if not self._entries:
+            return 0
+        return min(max(seq - self._entries[0][0], 0), len(self._entries))
+
+
+class RedisStreamLog[T]:
+    """Log in a redis stream (trimmed to roughly max_entries), shared by all workers. Ids are the stream entry ids."""
+
+    def __init__(
+        self,
+        key: str,
+        encode: Callable[[T], bytes | str],
+        decode: Callable[[bytes], T],
+        max_entries: int = 1000,
+    ):
+        self.key = key
+        self.encode = encode
+        self.decode = decode
+        self.max_entries = max_entries
+
+    async def append(self, entry: T) -> str:
+        entry_id = await get_redis().xadd(self.key, {"data": self.encode(entry)}, maxlen=self.max_entries)
+        return entry_id.decode()
+
+    async def latest(self, count: int, before: str | None = None) -> Entries[T]:
+        max_id = "+" if before is None else f"({before}"
+        return self._decode(reversed(await get_redis().xrevrange(self.key, max_id, "-", count=count)))
+
+    async def between(self, start: str, before: str | None = None) -> Entries[T]:
+        max_id = "+" if before is None else f"({before}"
+        return self._decode(await get_redis().xrange(self.key, start, max_id))
+
+    def _decode(self, items) -> Entries[T]:
+        return [(entry_id.decode(), self.decode(fields[b"data"])) for entry_id, fields in items]
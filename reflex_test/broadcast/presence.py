@@ -0,0 +1,88 @@
+"""Incremental index of who is present in each room (by username), updated on join, rename and leave.
+
+Each update returns the `PresenceDiff` of usernames that appeared in or disappeared from the room, so only changes
+have to be broadcast (and nothing has to look at the state of every session to rebuild the list). Several sessions can
+use the same username, it is only removed once the last of them leaves or renames.
+
+The index tracks the sessions connected to this worker, and the usernames of the other workers are kept up to date
+by applying the diffs they broadcast (`apply`).
+"""
+
+from __future__ import annotations
+
+import dataclasses
+from collections import Counter, defaultdict
+
+
+@dataclasses.dataclass(frozen=True)
+class PresenceDiff:
+    added: tuple[str, ...] = ()
+    removed: tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+class PresenceIndex:
+    def __init__(self):
+        # room -> {token: username}
+        self._usernames: defaultdict[str, dict[str, str]] = defaultdict(dict)
+        # room -> number of sessions using each username
+        self._counts: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        # room -> {worker: usernames of the sessions connected to that worker}
+        self._remote: defaultdict[str, defaultdict[str, set[str]]] = defaultdict(lambda: defaultdict(set))
+
+    def usernames(self, room: str) -> list[str]:
+        """Usernames in the room (on all workers)"""
+        usernames = set(self._counts.get(room, ()))
+        for remote_usernames in self._remote.get(room, {}).values():
+            usernames |= remote_usernames
+        return sorted(usernames)
+
+    def local_usernames(self, room: str) -> list[str]:
+        """Usernames of the sessions in the room that are connected to this worker"""
+        return sorted(self._counts.get(room, ()))
+
+    def username(self, room: str, token: str) -> str | None:
+        return self._usernames.get(room, {}).get(token)
+
+    def join(self, room: str, token: str, username: str) -> PresenceDiff:
+        """Add the session (or update its username if it already joined), sessions without a username aren't listed"""
+        return self._diff(self._remove(room, token), self._add(room, token, username))
+
+    rename = join
+
+    def leave(self, room: str, token: str) -> PresenceDiff:
+        return self._diff(self._remove(room, token), None)
+
+    def apply(self, room: str, worker: str, diff: PresenceDiff) -> None:
+        """Apply the diff broadcast by another worker"""
+        remote_usernames = self._remote[room][worker]
+        remote_usernames.difference_update(diff.removed)
+        remote_usernames.update(diff.added)
+
+    def _add(self, room: str, token: str, username: str) -> str | None:
+        if not username:
+            return None
+        self._usernames[room][token] = username
+        self._counts[room][username] += 1
+        return username if self._counts[room][username] == 1 else None
+
+    def _remove(self, room: str, token: str) -> str | None:
+        username = self._usernames.get(room, {}).pop(token, None)
+        if username is None:
+            return None
+        counts = self._counts[room]
+        counts[username] -= 1
+        if counts[username]:
+            return None
+        del counts[username]
+        if not counts:
+            del self._counts[room], self._usernames[room]
+        return username
+
+    def _diff(self, removed: str | None, added: str | None) -> PresenceDiff:
+        if removed is not None and removed == added:
+            # Same username again
+            return PresenceDiff()
+        return PresenceDiff(added=(added,) if added else (), removed=(removed,) if removed else ())
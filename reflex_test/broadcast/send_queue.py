@@ -0,0 +1,165 @@
+"""Bounded outbound queues of state updates, one per session (socket.io sid).
+
+Broadcasts put their updates in the queue of each recipient and return straight away, while a sender task per
+session (only running while its queue isn't empty) emits them in order. A slow client only delays its own updates:
+its sender waits while the client's socket still has `max_backlog` packets it hasn't written (engine.io buffers
+outgoing packets per socket without a limit), so its queue fills up rather than memory elsewhere, and once the
+queue holds `depth` updates the policy decides what is dropped:
+
+- "drop_oldest": the oldest queued update is dropped
+- "coalesce": an update for the same states as the last queued update is merged into it (deltas replace whole
+  vars, so the client ends up with the same values), and the oldest update is only dropped otherwise
+
+The same `Outgoing` can be queued for many sessions (e.g. a shared update for everyone in a room), it is encoded at
+most once for all of them (like an emit to a socket.io room).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any, Literal
+
+from reflex.state import StateUpdate
+
+logger = logging.getLogger(__name__)
+
+Policy = Literal["drop_oldest", "coalesce"]
+
+# (sid, update) -> emitted
+Send = Callable[[str, "Outgoing"], Awaitable[None]]
+# sid -> packets the client's socket hasn't written yet
+Backlog = Callable[[str], int]
+
+
+class Outgoing:
+    """An update queued for one or more sessions"""
+
+    __slots__ = ("_encoded", "update")
+
+    def __init__(self, update: StateUpdate):
+        self.update = update
+        self._encoded: Any = None
+
+    def encoded(self, encode: Callable[[StateUpdate], Any]) -> Any:
+        """The update encoded for sending (only encoded by the first session it is sent to)"""
+        if self._encoded is None:
+            self._encoded = encode(self.update)
+        return self._encoded
+
+
+def merge_updates(update: StateUpdate, newer: StateUpdate) -> StateUpdate:
+    """A single update with the (newer) values of both"""
+    delta = {state_name: dict(state_delta) for state_name, state_delta in update.delta.items()}
+    for state_name, state_delta in newer.delta.items():
+        delta.setdefault(state_name, {}).update(state_delta)
+    return StateUpdate(delta=delta, events=[*update.events, *newer.events], final=newer.final)
+
+
+class SendQueues:
+    def __init__(
+        self,
+        send: Send,
+        depth: int = 100,
+        policy: Policy = "drop_oldest",
+        backlog: Backlog | None = None,
+        max_backlog: int = 16,
+        backlog_poll_interval: float = 0.05,
+    ):
+        """
+        Args:
+            send: Emits an update to the session
+            depth: Max number of updates queued per session
+            policy: What to do when a session's queue is full
+            backlog: Number of packets not yet written to the session's socket (no backpressure if None)
+            max_backlog: Don't send more updates to a session while its socket has this many unwritten packets
+            backlog_poll_interval: Seconds between checks of the backlog of a slow session
+        """
+        if depth < 1:
+            raise ValueError(f"depth must be at least 1, got {depth}")
+        if policy not in ("drop_oldest", "coalesce"):
+            raise ValueError(f"Unknown policy {policy!r}")
+        self.send = send
+        self.depth = depth
+        self.policy = policy
+        self.backlog = backlog
+        self.max_backlog = max_backlog
+        self.backlog_poll_interval = backlog_poll_interval
+        self._queues: dict[str, deque[Outgoing]] = {}
+        self._senders: dict[str, asyncio.Task] = {}
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.backlog_waits = 0
+
+    def depth_of(self, sid: str) -> int:
+        return len(self._queues.get(sid, ()))
+
+    def put(self, sid: str, update: StateUpdate | Outgoing) -> None:
+        """Queue the update for the session (never waits)"""
+        outgoing = update if isinstance(update, Outgoing) else Outgoing(update)
+        queue = self._queues.setdefault(sid, deque())
+        if len(queue) < self.depth:
+            queue.append(outgoing)
+        elif not (self.policy == "coalesce" and self._coalesce(queue, outgoing)):
+            queue.popleft()
+            self.dropped += 1
+            queue.append(outgoing)
+        self.max_depth = max(self.max_depth, len(queue))
+        if sid not in self._senders:
+            self._senders[sid] = asyncio.create_task(self._send_queued(sid))
+
+    def _coalesce(self, queue: deque[Outgoing], outgoing: Outgoing) -> bool:
+        # Only into the last update, merging into an earlier one would send the new values before the updates queued
+        # after it (which could then overwrite them with older values)
+        if not queue or queue[-1].update.delta.keys() != outgoing.update.delta.keys():
+            return False
+        queue[-1] = Outgoing(merge_updates(queue[-1].update, outgoing.update))
+        self.coalesced += 1
+        return True
+
+    def close(self, sid: str) -> None:
+        """Drop the session's queue (e.g. when it disconnected)"""
+        self._queues.pop(sid, None)
+        if (sender := self._senders.pop(sid, None)) is not None:
+            sender.cancel()
+
+    async def _send_queued(self, sid: str) -> None:
+        try:
+            while queue := self._queues.get(sid):
+                if self.backlog is not None and self.backlog(sid) >= self.max_backlog:
+                    # Slow consumer, leave the updates queued (where the policy applies) until it catches up
+                    self.backlog_waits += 1
+                    await asyncio.sleep(self.backlog_poll_interval)
+                    continue
+                update = queue.popleft()
+                try:
+                    await self.send(sid, update)
+                    self.sent += 1
+                except Exception:
+                    logger.exception(f"Failed to send update to {sid}, dropping its queue")
+                    self._queues.pop(sid, None)
+        finally:
+            if self._senders.get(sid) is asyncio.current_task():
+                del self._senders[sid]
+            if not self._queues.get(sid):
+                self._queues.pop(sid, None)
+
+    async def join(self) -> None:
+        """Wait until all queued updates have been sent"""
+        while self._senders:
+            await asyncio.gather(*self._senders.values(), return_exceptions=True)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "sessions": len(self._queues),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "backlog_waits": self.backlog_waits,
+        }
@@ -0,0 +1,118 @@
+"""Transports that carry broadcasts between workers.
+
+Every worker's `Broadcaster` publishes the events it broadcasts to the transport, and delivers the events published by
+the other workers to the sessions connected to it (a worker only has the sockets of its own sessions).
+
+`RedisTransport` uses redis pub/sub (via the StorageBase redis client), `LocalTransport` is an in-process stand-in
+that several broadcasters (i.e. simulated workers) can share, e.g. for tests.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any, Protocol
+
+from reflex.utils.format import json_dumps
+
+from reflex_test.storage.backend import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class BroadcastMessage:
+    # Worker that published the message (it already delivered it to its own sessions)
+    origin: str
+    room: str
+    # Full name of the event handler
+    name: str
+    payload: dict[str, Any] = dataclasses.field(default_factory=dict)
+    # "event" to deliver to the sessions in the room, or "hello" when a worker starts listening
+    kind: str = "event"
+
+    def encode(self) -> str:
+        # Uses reflex's json encoding so that payloads can contain models etc. (like event payloads from the frontend)
+        return json_dumps(dataclasses.asdict(self))
+
+    @classmethod
+    def decode(cls, data: bytes | str) -> BroadcastMessage:
+        return cls(**json.loads(data))
+
+
+MessageHandler = Callable[[BroadcastMessage], Awaitable[None]]
+ReadyCallback = Callable[[], Awaitable[None]]
+
+
+class BroadcastTransport(Protocol):
+    async def publish(self, message: BroadcastMessage) -> None: ...
+
+    async def listen(self, handler: MessageHandler, on_ready: ReadyCallback | None = None) -> None:
+        """Call handler for every published message (runs until cancelled), and on_ready once subscribed"""
+        ...
+
+
+class LocalTransport:
+    """In-memory stand-in shared by the broadcasters of a single process. Messages are encoded and handled in tasks,
+    like they would be via redis."""
+
+    def __init__(self):
+        self._handlers: list[MessageHandler] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    async def publish(self, message: BroadcastMessage) -> None:
+        data = message.encode()
+        for handler in self._handlers:
+            task = asyncio.create_task(handler(BroadcastMessage.decode(data)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def listen(self, handler: MessageHandler, on_ready: ReadyCallback | None = None) -> None:
+        self._handlers.append(handler)
+        if on_ready is not None:
+            await on_ready()
+
+    async def join(self) -> None:
+        """Wait until all published messages have been handled"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+class RedisTransport:
+    """Redis pub/sub, so broadcasts reach the sessions connected to all workers"""
+
+    def __init__(self, channel: str = "broadcast"):
+        self.channel = channel
+        self._tasks: set[asyncio.Task] = set()
+
+    async def publish(self, message: BroadcastMessage) -> None:
+        await get_redis().publish(self.channel, message.encode())
+
+    async def listen(self, handler: MessageHandler, on_ready: ReadyCallback | None = None) -> None:
+        async with get_redis().pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            if on_ready is not None:
+                await on_ready()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                # Handled in a task (like `LocalTransport`), so a broadcast that waits for state locks doesn't hold up
+                # the ones after it
+                task = asyncio.create_task(self._handle(handler, message["data"]))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _handle(handler: MessageHandler, data: bytes) -> None:
+        try:
+            await handler(BroadcastMessage.decode(data))
+        except Exception:
+            logger.exception(f"Failed to handle broadcast {data}")
+
+    async def join(self) -> None:
+        """Wait until all received messages have been handled"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
@@ -0,0 +1,23 @@
+from . import schema
+from .cache import RecordCache
+from .repository import (
+    SchemaMissingError,
+    SQLiteRepository,
+    database_path,
+    database_url,
+    get_repository,
+    set_repository,
+    upgrade_schema,
+)
+
+__all__ = [
+    "RecordCache",
+    "SQLiteRepository",
+    "SchemaMissingError",
+    "database_path",
+    "database_url",
+    "get_repository",
+    "schema",
+    "set_repository",
+    "upgrade_schema",
+]
@@ -0,0 +1,88 @@
+"""Read-through cache of repository records by id.
+
+Bounded (LRU) with a TTL, and also caches misses (for a shorter TTL) so that repeatedly reading an id that doesn't
+exist doesn't hit the db each time. Concurrent reads of an id that isn't cached share a single load.
+
+Writers should `invalidate` the ids they write. Invalidation only reaches this process, other workers see the change
+once their entry expires.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from reflex_test.storage.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Cached in place of a record that doesn't exist (LRUCache uses None for "not cached")
+_MISSING = object()
+
+
+class RecordCache:
+    def __init__(
+        self,
+        load: Callable[[int], Awaitable[Any | None]],
+        max_items: int = 1000,
+        ttl: float = 300,
+        negative_ttl: float = 30,
+    ):
+        """
+        Args:
+            load: Loads the record with the given id (None if it doesn't exist)
+            max_items: Max number of records (and misses) cached
+            ttl: Seconds to cache a record for
+            negative_ttl: Seconds to cache a miss for
+        """
+        self.load = load
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = LRUCache(max_items=max_items)
+        self._loads: dict[int, asyncio.Task] = {}
+        self.loads = 0
+        self.shared_loads = 0
+
+    async def get(self, record_id: int) -> Any | None:
+        """The record (None if it doesn't exist), loaded only if not already cached or being loaded"""
+        value = self._cache.get(str(record_id))
+        if value is not None:
+            return None if value is _MISSING else value
+        if (load := self._loads.get(record_id)) is None:
+            load = self._loads[record_id] = asyncio.ensure_future(self._load(record_id))
+        else:
+            self.shared_loads += 1
+        # Shielded so that one reader being cancelled doesn't cancel the load for the others
+        return await asyncio.shield(load)
+
+    async def _load(self, record_id: int) -> Any | None:
+        self.loads += 1
+        load = asyncio.current_task()
+        try:
+            value = await self.load(record_id)
+        except BaseException:
+            if self._loads.get(record_id) is load:
+                del self._loads[record_id]
+            raise
+        # Unless invalidated while loading (i.e. the value may already be stale)
+        if self._loads.get(record_id) is load:
+            del self._loads[record_id]
+            if value is None:
+                self._cache.put(str(record_id), _MISSING, version=0, nbytes=0, ttl=self.negative_ttl)
+            else:
+                self._cache.put(str(record_id), value, version=0, nbytes=0, ttl=self.ttl)
+        return value
+
+    def invalidate(self, record_id: int) -> None:
+        self._cache.invalidate(str(record_id))
+        # Readers still waiting get the result of the load that was in progress, but it isn't cached
+        self._loads.pop(record_id, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._loads.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {**self._cache.stats(), "loads": self.loads, "shared_loads": self.shared_loads}
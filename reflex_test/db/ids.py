@@ -0,0 +1,77 @@
+"""Hi/lo (block) id allocation.
+
+Each worker reserves a block of ids at a time from a persisted sequence (one write transaction per block, see
+`SQLiteRepository.reserve_ids`), then hands them out from memory. Ids are unique across tasks (allocation from the
+current block never awaits) and across workers/restarts (blocks are reserved atomically in the db and never handed out
+again), at the cost of gaps where a worker stopped before using its whole block.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# (sequence name, number of ids) -> first id of the reserved range
+ReserveIds = Callable[[str, int], Awaitable[int]]
+
+
+class BlockIdAllocator:
+    def __init__(self, reserve: ReserveIds, name: str = "records", block_size: int = 100):
+        """
+        Args:
+            reserve: Reserves a range of ids in the persisted sequence
+            name: Name of the sequence
+            block_size: Number of ids to reserve at a time (1 is equivalent to a round trip per id)
+        """
+        if block_size < 1:
+            raise ValueError(f"block_size must be at least 1, got {block_size}")
+        self.reserve = reserve
+        self.name = name
+        self.block_size = block_size
+        # Current block is [_next, _end)
+        self._next = 0
+        self._end = 0
+        self._reserving: asyncio.Future[None] | None = None
+        self.reservations = 0
+
+    @property
+    def available(self) -> int:
+        """Ids left in the current block"""
+        return self._end - self._next
+
+    async def allocate(self) -> int:
+        (new_id,) = await self.allocate_many(1)
+        return new_id
+
+    async def allocate_many(self, count: int) -> list[int]:
+        """Ids for count new records (reserving a single block big enough for the rest if the current one runs out)"""
+        ids: list[int] = []
+        while len(ids) < count:
+            if not self.available:
+                await self._reserve(max(self.block_size, count - len(ids)))
+                continue
+            take = min(count - len(ids), self.available)
+            ids.extend(range(self._next, self._next + take))
+            self._next += take
+        return ids
+
+    async def _reserve(self, size: int) -> None:
+        # Tasks that run out at the same time wait for the same reservation (then take from the new block in turn)
+        if self._reserving is None:
+            self._reserving = asyncio.ensure_future(self._reserve_block(size))
+        await asyncio.shield(self._reserving)
+
+    async def _reserve_block(self, size: int) -> None:
+        try:
+            start = await self.reserve(self.name, size)
+            self._next, self._end = start, start + size
+            self.reservations += 1
+            logger.debug(f"Reserved ids {start} to {start + size - 1} for {self.name}")
+        finally:
+            # Cleared as soon as the block is reserved (not in a done callback, which only runs later), so a task that
+            # runs out of ids before the waiting tasks wake up reserves another block rather than waiting on the
+            # finished reservation (which returns straight away, i.e. spins without yielding to the loop)
+            self._reserving = None
@@ -0,0 +1,281 @@
+"""Async repository for storing pydantic models in SQLite.
+
+The stdlib sqlite3 driver is blocking, so every query runs on a small thread pool (one connection per thread, i.e. the
+pool of threads is the connection pool) and the event loop only awaits the result. Connections use WAL mode so reads
+don't wait for the (single) writer, and writes are serialized between the threads rather than retried on
+SQLITE_BUSY. Statements are parameterized constants, so sqlite3's per connection statement cache prepares each one
+only once.
+
+Values are stored as `serialization.dumps` payloads (so they load back into the same model class). Ids are allocated
+in blocks (see `ids.BlockIdAllocator`), so saves (including bulk saves) don't wait for the db to assign an id.
+
+The schema is managed by alembic (`alembic upgrade head`, or `upgrade_schema()`), generated from `schema.metadata`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, TypeVar
+
+from reflex_test.db.ids import BlockIdAllocator
+from reflex_test.storage import serialization
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ALEMBIC_INI = Path(__file__).parents[2] / "alembic.ini"
+
+_INSERT = "INSERT INTO records (id, type, data) VALUES (?, ?, ?)"
+_SELECT = "SELECT data FROM records WHERE id = ?"
+_DELETE = "DELETE FROM records WHERE id = ?"
+# The sequence starts after any existing records (e.g. ones inserted before the sequence existed)
+_SEED_SEQUENCE = "INSERT OR IGNORE INTO id_blocks (name, next_id) SELECT ?, COALESCE(MAX(id), 0) + 1 FROM records"
+_RESERVE_IDS = "UPDATE id_blocks SET next_id = next_id + ? WHERE name = ? RETURNING next_id"
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER is 32766, stay well below it
+_MAX_IDS_PER_SELECT = 500
+
+
+def database_path() -> str:
+    """Path of the app database (DATABASE_PATH env var, defaults to reflex_test.db in the working directory)"""
+    return os.environ.get("DATABASE_PATH", "reflex_test.db")
+
+
+def database_url(path: str | os.PathLike | None = None) -> str:
+    return f"sqlite:///{path if path is not None else database_path()}"
+
+
+def upgrade_schema(path: str | os.PathLike | None = None, revision: str = "head") -> None:
+    """Run the alembic migrations against the database (blocking, same as `alembic upgrade head`)"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    config.set_main_option("sqlalchemy.url", database_url(path))
+    # Don't let alembic's logging config replace the app's
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+class SchemaMissingError(RuntimeError):
+    pass
+
+
+class SQLiteRepository:
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        pool_size: int = 4,
+        busy_timeout: float = 5.0,
+        serializer: str = "json",
+        statement_cache_size: int = 128,
+        id_block_size: int = 100,
+    ):
+        self.path = str(path)
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.serializer = serializer
+        self.statement_cache_size = statement_cache_size
+        self._executor: ThreadPoolExecutor | None = None
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # SQLite allows a single writer, waiting here is cheaper than waiting on the file lock (busy_timeout)
+        self._write_lock = threading.Lock()
+        self._schema_checked = False
+        self.ids = BlockIdAllocator(self.reserve_ids, name="records", block_size=id_block_size)
+        # operation -> seconds taken by the most recent calls (including waiting for a thread/the write lock)
+        self._latencies: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=10_000))
+
+    async def save(self, value: Any) -> int:
+        """Store the value, returns its (new) id"""
+        row = (await self.ids.allocate(), *self._row(value))
+        await self._run("save", functools.partial(self._insert, row), write=True)
+        return row[0]
+
+    async def save_many(self, values: Iterable[Any]) -> list[int]:
+        """Store all the values in a single transaction (executemany), returns their ids in the same order"""
+        rows = [self._row(value) for value in values]
+        if not rows:
+            return []
+        ids = await self.ids.allocate_many(len(rows))
+        await self._run(
+            "save_many",
+            functools.partial(self._insert_many, [(new_id, *row) for new_id, row in zip(ids, rows)]),
+            write=True,
+        )
+        return ids
+
+    async def load(self, record_id: int) -> Any | None:
+        """Load the value stored under record_id (None if there isn't one)"""
+        data = await self._run("load", functools.partial(self._select, record_id))
+        return serialization.loads(data) if data is not None else None
+
+    async def load_many(self, record_ids: Iterable[int]) -> dict[int, Any]:
+        """Load all the values that exist (keyed by id)"""
+        record_ids = list(dict.fromkeys(record_ids))
+        if not record_ids:
+            return {}
+        rows = await self._run("load_many", functools.partial(self._select_many, record_ids))
+        return {record_id: serialization.loads(data) for record_id, data in rows}
+
+    async def reserve_ids(self, name: str, count: int) -> int:
+        """Reserve the next count ids of the named sequence (for all workers), returns the first of them"""
+        return await self._run("reserve_ids", functools.partial(self._reserve_ids, name, count), write=True)
+
+    async def delete(self, record_id: int) -> bool:
+        return await self._run("delete", functools.partial(self._delete, record_id), write=True)
+
+    async def close(self) -> None:
+        """Close all connections (the repository can still be used afterward, it reconnects as needed)"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Latency of recent calls of each operation as seen by the caller (i.e. including waiting for a thread)"""
+        stats = {}
+        for operation, latencies in self._latencies.items():
+            # quantiles needs at least two values
+            percentiles = statistics.quantiles([*latencies] * 2 if len(latencies) < 2 else latencies, n=100)
+            stats[operation] = {
+                "count": len(latencies),
+                "mean_ms": statistics.fmean(latencies) * 1e3,
+                "p50_ms": percentiles[49] * 1e3,
+                "p95_ms": percentiles[94] * 1e3,
+                "max_ms": max(latencies) * 1e3,
+            }
+        return stats
+
+    def reset_stats(self) -> None:
+        self._latencies.clear()
+
+    def _row(self, value: Any) -> tuple[str, bytes]:
+        type_name = serialization.type_tag(type(value)) if serialization._can_use_model_serializer(value) else "dill"
+        return type_name, serialization.dumps(value, self.serializer)
+
+    async def _run(self, operation: str, fn: Callable[[sqlite3.Connection], T], write: bool = False) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="sqlite-repository")
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, write)
+        finally:
+            self._latencies[operation].append(time.perf_counter() - start)
+
+    def _call(self, fn: Callable[[sqlite3.Connection], T], write: bool) -> T:
+        """Runs on a pool thread"""
+        connection = self._connection()
+        if not write:
+            return fn(connection)
+        with self._write_lock, self._transaction(connection):
+            return fn(connection)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            # Only ever used from the thread that created it, but closed from another one
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            # Transactions are started explicitly (BEGIN IMMEDIATE for writes)
+            isolation_level=None,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Durable as of the last checkpoint, rather than fsync on every commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_checked:
+            exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'records'")
+            if exists.fetchone() is None:
+                connection.close()
+                raise SchemaMissingError(f"No records table in {self.path}, run `alembic upgrade head` first")
+            self._schema_checked = True
+        return connection
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(connection: sqlite3.Connection):
+        # IMMEDIATE takes the write lock up front (instead of upgrading from a read lock, which can fail with BUSY)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _insert(row: tuple[int, str, bytes], connection: sqlite3.Connection) -> None:
+        connection.execute(_INSERT, row)
+
+    @staticmethod
+    def _insert_many(rows: Sequence[tuple[int, str, bytes]], connection: sqlite3.Connection) -> None:
+        connection.executemany(_INSERT, rows)
+
+    @staticmethod
+    def _reserve_ids(name: str, count: int, connection: sqlite3.Connection) -> int:
+        connection.execute(_SEED_SEQUENCE, (name,))
+        (next_id,) = connection.execute(_RESERVE_IDS, (count, name)).fetchone()
+        return next_id - count
+
+    @staticmethod
+    def _select(record_id: int, connection: sqlite3.Connection) -> bytes | None:
+        row = connection.execute(_SELECT, (record_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    @staticmethod
+    def _select_many(record_ids: Sequence[int], connection: sqlite3.Connection) -> list[tuple[int, bytes]]:
+        rows = []
+        for start in range(0, len(record_ids), _MAX_IDS_PER_SELECT):
+            chunk = record_ids[start : start + _MAX_IDS_PER_SELECT]
+            # Only a handful of distinct chunk sizes in practice, so these stay in the statement cache too
+            query = f"SELECT id, data FROM records WHERE id IN ({', '.join('?' * len(chunk))})"
+            rows.extend(connection.execute(query, chunk).fetchall())
+        return rows
+
+    @staticmethod
+    def _delete(record_id: int, connection: sqlite3.Connection) -> bool:
+        return connection.execute(_DELETE, (record_id,)).rowcount > 0
+
+
+repository: SQLiteRepository
+
+
+def set_repository(new_repository: SQLiteRepository) -> None:
+    """Replace the repository used by the pages (e.g. for tests)"""
+    global repository
+    repository = new_repository
+
+
+def get_repository() -> SQLiteRepository:
+    return repository
+
+
+set_repository(SQLiteRepository(database_path()))
@@ -0,0 +1,28 @@
+"""Tables used by the repository (the migrations in `alembic/versions` are generated from this metadata)."""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+metadata = sa.MetaData()
+
+records = sa.Table(
+    "records",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True),
+    # Type tag of the stored model (module:qualname), also included in the payload
+    sa.Column("type", sa.String, nullable=False, index=True),
+    # Payload as created by `reflex_test.storage.serialization.dumps`
+    sa.Column("data", sa.LargeBinary, nullable=False),
+    sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.current_timestamp()),
+    # AUTOINCREMENT so that ids of deleted records are never handed out again
+    sqlite_autoincrement=True,
+)
+
+# Next id not yet reserved by any worker, per sequence (see `ids.BlockIdAllocator`)
+id_blocks = sa.Table(
+    "id_blocks",
+    metadata,
+    sa.Column("name", sa.String, primary_key=True),
+    sa.Column("next_id", sa.Integer, nullable=False),
+)
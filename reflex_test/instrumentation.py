@@ -0,0 +1,269 @@
+"""Instrumentation of state lock blocks (`async with state`, e.g. via `ControllerBase.with_self` or
+`OptionalSelfMixin.opt_self`).
+
+While a background task holds the lock of a state, every other event for that tab waits (i.e. the frontend appears
+frozen), so for each block this records:
+    - how long it waited to take the lock and how long it held it (histograms)
+    - how many `get_state` fetches happened within it
+    - where it was taken (call site), and which (controller) method it was taken in
+and logs a warning with those details for any hold longer than `slow_hold_threshold`.
+
+Public async methods of `ControllerBase` subclasses are timed too (see `LockMetrics.timed`).
+
+Everything can be exported as a dict (`lock_metrics.export()`) or logged as json (`lock_metrics.log_metrics()`, or
+periodically via the `export_lock_metrics` lifespan task). Log records also carry the data as `extra` attributes
+(`lock_block` or `lock_metrics`) for structured log handlers.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import inspect
+import json
+import logging
+import sys
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from typing import Any
+
+import reflex as rx
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets (plus one for anything longer)
+DEFAULT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Functions that only wrap the `async with state` (the call site is whoever called them)
+_WRAPPER_FUNCTIONS = {"with_self", "opt_self", "locked"}
+_WRAPPER_FILES = {contextlib.__file__, __file__}
+
+
+class Histogram:
+    def __init__(self, bounds: tuple[float, ...] = DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def export(self) -> dict[str, Any]:
+        labels = [f"<={bound * 1e3:g}ms" for bound in self.bounds] + [f">{self.bounds[-1] * 1e3:g}ms"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "max_ms": self.max * 1e3,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+@dataclasses.dataclass
+class LockBlock:
+    """A single `async with state` block (in progress until `hold` is set)"""
+
+    label: str
+    state: str
+    call_site: str
+    method: str | None = None
+    get_state_calls: int = 0
+    wait: float = 0.0
+    hold: float = 0.0
+
+    def export(self) -> dict[str, Any]:
+        return {
+            "label": self.label,
+            "state": self.state,
+            "call_site": self.call_site,
+            "method": self.method,
+            "get_state_calls": self.get_state_calls,
+            "wait_ms": self.wait * 1e3,
+            "hold_ms": self.hold * 1e3,
+        }
+
+
+@dataclasses.dataclass
+class BlockStats:
+    """Blocks aggregated by the method they were taken in (or their call site if not in a timed method)"""
+
+    count: int = 0
+    get_state_calls: int = 0
+    wait: Histogram = dataclasses.field(default_factory=Histogram)
+    hold: Histogram = dataclasses.field(default_factory=Histogram)
+
+    def export(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "get_state_calls": self.get_state_calls,
+            "wait": self.wait.export(),
+            "hold": self.hold.export(),
+        }
+
+
+_current_block: contextvars.ContextVar[LockBlock | None] = contextvars.ContextVar("lock_block", default=None)
+_current_method: contextvars.ContextVar[str | None] = contextvars.ContextVar("lock_method", default=None)
+
+
+class LockMetrics:
+    def __init__(self, slow_hold_threshold: float = 0.1):
+        """
+        Args:
+            slow_hold_threshold: Log a warning for any block that holds a state lock for longer than this (seconds)
+        """
+        self.enabled = True
+        self.slow_hold_threshold = slow_hold_threshold
+        self.reset()
+
+    def reset(self) -> None:
+        self.wait = Histogram()
+        self.hold = Histogram()
+        self.slow_holds = 0
+        self.blocks: defaultdict[str, BlockStats] = defaultdict(BlockStats)
+        self.methods: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.method_errors: defaultdict[str, int] = defaultdict(int)
+
+    @contextlib.asynccontextmanager
+    async def locked(self, state: rx.State, label: str) -> AsyncIterator[LockBlock | None]:
+        """`async with state`, recording the wait/hold times and `get_state` fetches (see `count_get_state`)"""
+        if not self.enabled:
+            async with state:
+                yield None
+            return
+        block = LockBlock(
+            label=label, state=state.get_full_name(), call_site=_call_site(), method=_current_method.get()
+        )
+        start = time.perf_counter()
+        acquired = None
+        try:
+            async with state:
+                acquired = time.perf_counter()
+                reset_token = _current_block.set(block)
+                try:
+                    yield block
+                finally:
+                    _current_block.reset(reset_token)
+        finally:
+            # Hold includes writing the state back on exit (the lock is held until then)
+            if acquired is not None:
+                block.wait, block.hold = acquired - start, time.perf_counter() - acquired
+                self._record(block)
+
+    def _record(self, block: LockBlock) -> None:
+        self.wait.observe(block.wait)
+        self.hold.observe(block.hold)
+        stats = self.blocks[block.method or block.call_site]
+        stats.count += 1
+        stats.get_state_calls += block.get_state_calls
+        stats.wait.observe(block.wait)
+        stats.hold.observe(block.hold)
+        if block.hold >= self.slow_hold_threshold:
+            self.slow_holds += 1
+            logger.warning(
+                f"Slow state lock hold: {block.hold * 1e3:.0f}ms on {block.state} at {block.call_site} "
+                f"({block.get_state_calls} get_state calls)",
+                extra={"lock_block": block.export()},
+            )
+
+    def timed(self, method):
+        """
+        Record the duration of each call of the (async or async generator) method, and attribute any lock blocks
+        within it to the method
+        """
+        name = method.__qualname__
+
+        if inspect.isasyncgenfunction(method):
+
+            @functools.wraps(method)
+            async def timed_generator(*args, **kwargs):
+                start = time.perf_counter()
+                generator = method(*args, **kwargs)
+                try:
+                    while True:
+                        # Only while the generator is running (not while the caller handles what it yielded)
+                        reset_token = _current_method.set(name)
+                        try:
+                            item = await anext(generator)
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current_method.reset(reset_token)
+                        yield item
+                except Exception:
+                    self.method_errors[name] += 1
+                    raise
+                finally:
+                    await generator.aclose()
+                    self.methods[name].observe(time.perf_counter() - start)
+
+            return timed_generator
+
+        @functools.wraps(method)
+        async def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            reset_token = _current_method.set(name)
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                self.method_errors[name] += 1
+                raise
+            finally:
+                _current_method.reset(reset_token)
+                self.methods[name].observe(time.perf_counter() - start)
+
+        return timed_method
+
+    def export(self) -> dict[str, Any]:
+        return {
+            "wait": self.wait.export(),
+            "hold": self.hold.export(),
+            "slow_holds": self.slow_holds,
+            "slow_hold_threshold_ms": self.slow_hold_threshold * 1e3,
+            "blocks": {key: stats.export() for key, stats in self.blocks.items()},
+            "methods": {
+                name: {**histogram.export(), "errors": self.method_errors[name]}
+                for name, histogram in self.methods.items()
+            },
+        }
+
+    def log_metrics(self, level: int = logging.INFO) -> None:
+        metrics = self.export()
+        logger.log(level, f"State lock metrics: {json.dumps(metrics)}", extra={"lock_metrics": metrics})
+
+
+def count_get_state(calls: int = 1) -> None:
+    """Count `get_state` fetches made within the current lock block (if any)"""
+    if (block := _current_block.get()) is not None:
+        block.get_state_calls += calls
+
+
+def _call_site() -> str:
+    """The first frame outside the lock wrappers (i.e. the code that asked for the lock)"""
+    frame = sys._getframe(1)
+    while frame is not None and (
+        frame.f_code.co_filename in _WRAPPER_FILES or frame.f_code.co_name in _WRAPPER_FUNCTIONS
+    ):
+        frame = frame.f_back
+    if frame is None:
+        return "<unknown>"
+    return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_qualname}"
+
+
+lock_metrics = LockMetrics()
+
+
+async def export_lock_metrics(interval: float = 60) -> None:
+    """Log the lock metrics every interval (e.g. as an app lifespan task, runs until cancelled)"""
+    while True:
+        await asyncio.sleep(interval)
+        if lock_metrics.hold.count:
+            lock_metrics.log_metrics()
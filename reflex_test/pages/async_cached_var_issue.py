@@ -5,6 +5,7 @@ import logging
 import reflex as rx
 from pydantic import BaseModel
 
+from reflex_test.db import RecordCache, get_repository
 from reflex_test.templates import template
 
 logger = logging.getLogger(__name__)
@@ -16,20 +17,27 @@ class Data(BaseModel):
     attr_b: str
 
 
-database: dict[int, Data] = {}
+async def _load_record(data_id: int) -> Data | None:
+    return await get_repository().load(data_id)
 
 
-def load_data(data_id: int) -> Data:
-    # Stand in for an async load from db function
-    return database.get(data_id, Data(attr_a="", attr_b=""))
+# Shared by all sessions, e.g. data_a_cached and data_b_cached of the same data_id only load it once
+record_cache = RecordCache(_load_record)
 
+EMPTY_DATA = Data(attr_a="", attr_b="")
 
-def process(input_a: str):
+
+async def load_data(data_id: int) -> Data:
+    data = await record_cache.get(data_id)
+    return data if data is not None else EMPTY_DATA
+
+
+async def process(input_a: str) -> int:
     # Stand in for an async processing function that stores result in db and returns only the id
     data = Data(attr_a=input_a.title(), attr_b=input_a.upper())
-    next_id = len(database)
-    database[next_id] = data
-    return next_id
+    data_id = await get_repository().save(data)
+    record_cache.invalidate(data_id)
+    return data_id
 
 
 class HandlerState(rx.State):
@@ -39,20 +47,20 @@ class HandlerState(rx.State):
 
     async def do_stuff_on_click(self):
         # Some process that stores result in redis/database
-        data_id = process(self.input_a)
+        data_id = await process(self.input_a)
         # Only store the id here to avoid storing whole object in state and serialization issues
         self.data_id = data_id
 
 
 class DisplayMixin(rx.State, mixin=True):
     @rx.var(cache=True)
-    def data_a_cached(self) -> str:
-        data = load_data(self.data_id)
+    async def data_a_cached(self) -> str:
+        data = await load_data(self.data_id)
         return data.attr_a
 
     @rx.var(cache=True)
-    def data_b_cached(self) -> str:
-        data = load_data(self.data_id)
+    async def data_b_cached(self) -> str:
+        data = await load_data(self.data_id)
         return data.attr_b
 
 
@@ -65,7 +73,7 @@ class AlternativeDisplayMixin(rx.State, mixin=True):
     data_attr_b: str = ""
 
     async def update_display_info(self):
-        data = load_data(self.data_id)
+        data = await load_data(self.data_id)
         self.data_attr_a = f"Attribute A: {data.attr_a}"
         self.data_attr_b = f"Attribute B: {data.attr_b}"
 
@@ -3,12 +3,15 @@
 import time
 import typing as t
 
-from reflex.state import BaseState
-
 import reflex as rx
 
+from reflex_test.broadcast import MessageLog, PresenceDiff, PresenceIndex, RedisStreamLog, broadcaster, shared
 from reflex_test.templates import template
 
+ROOM = "chatroom"
+# Number of the latest messages shown to every session (older messages are loaded per session with `load_older`)
+WINDOW = 20
+
 
 class Message(rx.Base):
     username: str
@@ -16,42 +19,110 @@ class Message(rx.Base):
     message: str
 
 
+# Shared by all sessions (on all workers), which only keep cursors into it
+message_log: MessageLog[Message] = RedisStreamLog(
+    "chatroom:messages", encode=Message.json, decode=Message.parse_raw, max_entries=1000
+)
+# Usernames of the sessions in the chatroom
+presence = PresenceIndex()
+# Tokens of the sessions (on this worker) that loaded older messages, and so have to add the messages that move out of
+# the live window to them (or there would be a gap between their older messages and the window)
+paging_tokens: t.Set[str] = set()
+
+
+async def latest_messages() -> t.Tuple[t.Optional[str], t.List[Message]]:
+    """Id of the oldest message in the live window (None if there are no messages), and the messages in it"""
+    entries = await message_log.latest(WINDOW)
+    return (entries[0][0] if entries else None), [message for _, message in entries]
+
+
 class ChatroomState(rx.State):
     current_username: t.Optional[str] = ""
     all_usernames: t.List[str] = []
+    # The live window (the same for every session)
     messages: t.List[Message] = []
+    # Messages from before the live window the session loaded with `load_older`
+    older_messages: t.List[Message] = []
     input_message: str = ""
+    # Id of the oldest message shown
+    _oldest_id: str = ""
+    # Id of the oldest message in the live window when the session last loaded messages
+    _window_start: str = ""
 
     def set_usernames(self, usernames: t.List[str]) -> None:
-        """Set the list of usernames (from broadcast_usernames)."""
-        print(f"Usernames: {usernames}")
+        """Set the list of usernames."""
         self.all_usernames = usernames
 
-    def incoming_message(self, message: Message) -> None:
-        """Append incoming message to current message list."""
-        self.messages.append(message)
+    @shared
+    def presence_changed(self, worker: str, added: t.List[str], removed: t.List[str]) -> None:
+        """Show the usernames in the chatroom after users joined, renamed or left (the same for every session)."""
+        if worker != broadcaster.worker_id:
+            presence.apply(ROOM, worker, PresenceDiff(added=tuple(added), removed=tuple(removed)))
+        self.all_usernames = presence.usernames(ROOM)
+
+    @shared
+    async def incoming_message(self, message: Message) -> None:
+        """Show the latest messages (the same for every session, so broadcast once to the whole room)."""
+        _, self.messages = await latest_messages()
+        broadcaster.deliver_later(ROOM, paging_tokens, f"{ChatroomState.get_full_name()}.catch_up")
+
+    async def catch_up(self) -> None:
+        """Show the latest messages, adding the ones that moved out of the live window to the older messages."""
+        window_start, self.messages = await latest_messages()
+        await self._extend_older(window_start)
+
+    async def _extend_older(self, window_start: t.Optional[str]) -> None:
+        """Add the messages that moved out of the live window since the session last loaded messages"""
+        if window_start is None:
+            return
+        if self._window_start:
+            gap = await message_log.between(self._window_start, before=window_start)
+            self.older_messages = self.older_messages + [message for _, message in gap]
+        self._window_start = window_start
+
+    async def join_chatroom(self) -> None:
+        """Join the chatroom broadcasts (on page load)."""
+        token = self.router.session.client_token
+        await broadcaster.join(ROOM, token, self.router.session.session_id)
+        await broadcast_presence(presence.join(ROOM, token, self.current_username))
+        self.all_usernames = presence.usernames(ROOM)
+        window_start, self.messages = await latest_messages()
+        self.older_messages = []
+        self._oldest_id = self._window_start = window_start or ""
+        paging_tokens.discard(token)
+
+    async def load_older(self, count: int = WINDOW) -> None:
+        """Show up to count more messages from before the oldest message shown."""
+        window_start, self.messages = await latest_messages()
+        if window_start is None:
+            return
+        await self._extend_older(window_start)
+        older = await message_log.latest(count, before=self._oldest_id or window_start)
+        self.older_messages = [message for _, message in older] + self.older_messages
+        self._oldest_id = older[0][0] if older else self._oldest_id or window_start
+        if self.older_messages:
+            paging_tokens.add(self.router.session.client_token)
 
     async def username_change(self, username: str) -> None:
         """Handle on_blur from username text input."""
         self.current_username = username
-        await broadcast_usernames()
+        await broadcast_presence(presence.rename(ROOM, self.router.session.client_token, username))
 
     async def send_message(self) -> None:
         """Broadcast chat message to other connected clients."""
         m = Message(username=self.current_username, sent=time.time(), message=self.input_message)
-        await broadcast_event("state.chatroom_state.incoming_message", payload=dict(message=m))
+        await message_log.append(m)
+        await broadcast_event(
+            f"{ChatroomState.get_full_name()}.incoming_message", payload=dict(message=m), from_state=self
+        )
         self.input_message = ""
 
-    @rx.var
-    def other_usernames(self) -> t.List[str]:
-        """Filter all_usernames list to exclude username from this instance."""
-        return [n for n in self.all_usernames if n != self.current_username]
-
 
 @template(
     route="/chatroom",
     title="Test Chatroom",
     description="Chatroom",
+    on_load=ChatroomState.join_chatroom,
 )
 def chatroom() -> rx.Component:
     return rx.vstack(
@@ -64,11 +135,20 @@ def chatroom() -> rx.Component:
                     on_blur=ChatroomState.username_change,
                 ),
                 rx.text("Other Users", font_weight="bold"),
-                rx.foreach(ChatroomState.other_usernames, rx.text),
+                # Other users (filtered on the client, so that the list is the same update for every session)
+                rx.foreach(
+                    ChatroomState.all_usernames,
+                    lambda n: rx.cond(n != ChatroomState.current_username, rx.text(n)),
+                ),
                 width="20vw",
                 align_items="left",
             ),
             rx.vstack(
+                rx.button("Load older messages", on_click=ChatroomState.load_older(WINDOW), variant="ghost"),
+                rx.foreach(
+                    ChatroomState.older_messages,
+                    lambda m: rx.text("<", m.username, "> ", m.message),
+                ),
                 rx.foreach(
                     ChatroomState.messages,
                     lambda m: rx.text("<", m.username, "> ", m.message),
@@ -92,38 +172,29 @@ def chatroom() -> rx.Component:
     )
 
 
-async def broadcast_event(name: str, payload: t.Dict[str, t.Any] = {}) -> None:
-    """Simulate frontend event with given name and payload from all clients."""
-    from reflex_test.reflex_test import app
+async def broadcast_event(name: str, payload: t.Dict[str, t.Any] = {}, from_state: t.Optional[rx.State] = None) -> None:
+    """Simulate frontend event with given name and payload from all clients in the chatroom."""
+    await broadcaster.broadcast_event(ROOM, name, payload, from_state=from_state)
+
+
+async def broadcast_presence(diff: PresenceDiff) -> None:
+    """Update the list of usernames of all clients in the chatroom (if any usernames were added or removed)."""
+    if diff:
+        await broadcast_event(
+            f"{ChatroomState.get_full_name()}.presence_changed",
+            payload=dict(worker=broadcaster.worker_id, added=list(diff.added), removed=list(diff.removed)),
+        )
+
+
+async def user_left(token: str) -> None:
+    paging_tokens.discard(token)
+    await broadcast_presence(presence.leave(ROOM, token))
 
-    responses = []
-    for state in app.state_manager.states.values():
-        state: BaseState
-        async for update in state._process(
-            event=rx.event.Event(
-                token=state.router.session.client_token,
-                name=name,
-                router_data=state.router_data,
-                payload=payload,
-            ),
-        ):
-            # Emit the event.
-            responses.append(
-                app.event_namespace.emit(
-                    str(rx.constants.SocketEvent.EVENT),
-                    update.json(),
-                    to=state.router.session.session_id,
-                ),
-            )
-    for response in responses:
-        await response
 
+async def announce_presence() -> None:
+    """Send the usernames of the sessions on this worker to a worker that just started."""
+    await broadcast_presence(PresenceDiff(added=tuple(presence.local_usernames(ROOM))))
 
-async def broadcast_usernames() -> None:
-    """Simulate State.set_usernames event with updated username list from all clients."""
-    from reflex_test.reflex_test import app
 
-    usernames = []
-    for state in app.state_manager.states.values():
-        usernames.append(state.get_substate(ChatroomState.get_full_name().split(".")).current_username)
-    await broadcast_event("state.chatroom_state.set_usernames", payload=dict(usernames=usernames))
+broadcaster.on_leave(ROOM, user_left)
+broadcaster.on_worker_started(announce_presence)
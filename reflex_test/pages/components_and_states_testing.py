@@ -6,6 +6,7 @@ from contextlib import asynccontextmanager
 from typing import cast
 
 import reflex as rx
+from ..instrumentation import count_get_state, lock_metrics
 from ..templates import template
 
 logging.basicConfig(level=logging.INFO)
@@ -58,11 +59,16 @@ class OptionalSelfMixin:
     @asynccontextmanager
     async def opt_self(self: rx.State, with_self: bool):
         if with_self:
-            async with self:
+            async with lock_metrics.locked(self, "OptionalSelfMixin.opt_self"):
                 yield
         else:
             yield
 
+    async def counted_get_state(self: rx.State, state_cls: type[rx.State]) -> rx.State:
+        """`get_state`, counted towards the current opt_self block (get_state itself can't be overridden)"""
+        count_get_state()
+        return await self.get_state(state_cls)
+
 
 class OtherState(rx.State):
     external_call_value: int = 0
@@ -107,13 +113,13 @@ class OtherState(rx.State):
         """
         for _ in range(10):
             async with external_state.opt_self(with_self):
-                current_state = cast(OtherState, await external_state.get_state(OtherState))
+                current_state = cast(OtherState, await external_state.counted_get_state(OtherState))
                 current_state.external_call_value += 1
             yield
             await asyncio.sleep(0.1)
 
         async with external_state.opt_self(with_self):
-            another_other_state = cast(AnotherOtherState, await external_state.get_state(AnotherOtherState))
+            another_other_state = cast(AnotherOtherState, await external_state.counted_get_state(AnotherOtherState))
             another_other_state.value += 1
 
     @classmethod
@@ -3,25 +3,17 @@ from __future__ import annotations
 import logging
 import random
 from textwrap import dedent
-from typing import TypeVar, Self
-
-import dill
-from fakeredis import FakeRedis
 
 import reflex as rx
 from pydantic import BaseModel
 
+from reflex_test.storage import StorageBase, storage_var
 from reflex_test.templates import template
 
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
 
-model_type = TypeVar("model_type", bound=BaseModel)
-
-redis = FakeRedis(decode_responses=False)
-
-
 class A(BaseModel):
     foo: int = 0
     bar: int = 10
@@ -34,65 +26,6 @@ class B(BaseModel):
     fo: str = "fo"
 
 
-class StorageBase(rx.State, mixin=True):
-    """
-    Base mixin for storing data in redis to be shared between states etc. Defaults to per tab storage, but with
-    a group_key provided will store data per that group (probably user_id or similar).
-
-    Defaults to storing with a timeout of an hour
-    """
-
-    def group_key(self, attr: str) -> str | None:
-        """
-        Override this method to return a key specific to user to make data available across tabs for that user
-        Otherwise will default to using the client_token (per tab)
-        """
-        return None
-
-    def timeout(self, attr: str) -> int:
-        """
-        Timeout for the data storage in redis. Override this method to set a different timeout
-        """
-        return 60 * 60 * 1
-
-    def store(self, attr: str, key: str | int, value: model_type):
-        """
-        Store new value in redis for the attribute and key provided:
-        Examples:
-            self.key_a = new_key  # To set in current state
-            self.store('key_a', self.key_a, a_inst)  # To store the actual value for retrieval by this or other states
-        """
-        unique_key = self._generate_key(attr, key)
-        logger.debug(f"Storing {value} as {unique_key}")
-        redis.set(unique_key, dill.dumps(value, byref=True), ex=self.timeout(attr))
-
-    def load(
-        self, attr: str, key: str | int, expected_type: type[model_type] = None, default: model_type | None = None
-    ) -> model_type | None:
-        """
-        Load value from redis for the attribute and key provided:
-        Examples:
-            a = self.load('key_a', self.key_a, A)  # Provide expected class for validation/type hinting
-        """
-        unique_key = self._generate_key(attr, key)
-        logger.debug(f"Loading {unique_key}")
-        data = redis.get(unique_key)
-        if data is not None:
-            loaded = dill.loads(data)
-            logger.debug(f"Loaded {loaded} as {unique_key}")
-            if expected_type:
-                if not isinstance(loaded, expected_type):
-                    raise ValueError(f"Expected {expected_type}, got {type(loaded)}")
-            return loaded
-        logger.debug(f'No data for key "{unique_key}"')
-        return default
-
-    def _generate_key(self: Self | rx.State, attr: str, key: str) -> str:
-        """Generates a unique key for the data storage in redis"""
-        group_key = self.group_key(attr) or self.router.session.client_token
-        return f"{group_key}:{self.get_full_name()}:{attr}:{key}"
-
-
 class ABStorageMixin(StorageBase, mixin=True):
     key_a: int = 0
     key_b: int = 0
@@ -101,7 +34,7 @@ class ABStorageMixin(StorageBase, mixin=True):
 
 
 class ProcessA(ABStorageMixin, mixin=True):
-    def handle_change_a(self):
+    async def handle_change_a(self):
         logger.debug("Changing A")
         # new_key = uuid.uuid4().hex[:4]
         new_key = self.key_a + 1
@@ -110,10 +43,10 @@ class ProcessA(ABStorageMixin, mixin=True):
             bar=random.randint(0, 100),
             baz=random.randint(0, 100),
         )
-        self.store("key_a", new_key, a)
+        await self.store("key_a", new_key, a)
         self.key_a = new_key
 
-    def handle_change_b(self):
+    async def handle_change_b(self):
         logger.debug("Changing B")
         # new_key = uuid.uuid4().hex[:4]
         new_key = self.key_b + 1
@@ -122,55 +55,64 @@ class ProcessA(ABStorageMixin, mixin=True):
             fi=random.choice(["fe", "fi", "fo", "fum"]),
             fo=random.choice(["fe", "fi", "fo", "fum"]),
         )
-        self.store("key_b", new_key, b)
+        await self.store("key_b", new_key, b)
         self.key_b = new_key
 
+    async def handle_change_both(self):
+        logger.debug("Changing A and B")
+        new_key_a, new_key_b = self.key_a + 1, self.key_b + 1
+        a = A(
+            foo=random.randint(0, 100),
+            bar=random.randint(0, 100),
+            baz=random.randint(0, 100),
+        )
+        b = B(
+            fe=random.choice(["fe", "fi", "fo", "fum"]),
+            fi=random.choice(["fe", "fi", "fo", "fum"]),
+            fo=random.choice(["fe", "fi", "fo", "fum"]),
+        )
+        # Single round trip for both
+        await self.store_many([("key_a", new_key_a, a), ("key_b", new_key_b, b)])
+        self.key_a, self.key_b = new_key_a, new_key_b
+
 
 class ProcessB(ABStorageMixin, mixin=True):
-    def update_a(self):
+    async def update_a(self):
         logger.debug("Updating A")
-        a = self.load("key_a", self.key_a, A)
+        a = await self.load("key_a", self.key_a, A)
         if a:
             a.foo += 10
             a.bar -= 10
             a.baz *= 2
-            self.store("key_a", self.key_a, a)
-            # Note: Might at some point be necessary to set a value on self here to trigger updates of cached_vars etc
+            await self.store("key_a", self.key_a, a)
+            # The key doesn't change, storage_vars showing it are refreshed via the invalidation bus
 
-    def update_b(self):
+    async def update_b(self):
         logger.debug("Updating B")
-        b = self.load("key_b", self.key_b, B)
+        b = await self.load("key_b", self.key_b, B)
         if b:
             b.fe = random.choice(["fe", "fi", "fo", "fum"])
             b.fi = random.choice(["fe", "fi", "fo", "fum"])
             b.fo = random.choice(["fe", "fi", "fo", "fum"])
-            self.store("key_b", self.key_b, b)
+            await self.store("key_b", self.key_b, b)
 
 
 class DisplayA(ProcessA, mixin=True):
     """Anything directly related to what will be displayed to user and user interaction (i.e. including setting the
     on_click for event handlers etc. (but can refer to methods in ProcessBase)"""
 
-    @rx.var(
-        cache=True,
-        deps=["key_a"],
-        auto_deps=False,
-    )
+    @storage_var(deps=["key_a"])
     def a(self) -> str:
         logger.debug("DispA: Getting A")
-        loaded = self.load("key_a", self.key_a, A)
+        loaded = self.load_prefetched("key_a", self.key_a, A)
         if loaded:
             return loaded.model_dump_json(indent=2)
         return "None"
 
-    @rx.var(
-        cache=True,
-        deps=["key_b"],
-        auto_deps=False,
-    )
+    @storage_var(deps=["key_b"])
     def b(self) -> str:
         logger.debug("DispA: Getting B")
-        loaded = self.load("key_b", self.key_b, B)
+        loaded = self.load_prefetched("key_b", self.key_b, B)
         if loaded:
             return loaded.model_dump_json(indent=2)
         return "None"
@@ -190,6 +132,7 @@ class DisplayA(ProcessA, mixin=True):
             rx.hstack(
                 rx.button("Change A", on_click=cls.handle_change_a),
                 rx.button("Change B", on_click=cls.handle_change_b),
+                rx.button("Change Both", on_click=cls.handle_change_both),
             ),
             rx.button("Logs Separator", color_scheme="purple", on_click=cls.log_separator),
         )
@@ -199,18 +142,18 @@ class DisplayA(ProcessA, mixin=True):
 
 
 class DisplayB(ProcessB, ProcessA, mixin=True):
-    @rx.var(cache=True)
+    @storage_var(deps=["key_a"])
     def a(self) -> str:
         logger.debug("DispB: Getting A")
-        loaded = self.load("key_a", self.key_a, A)
+        loaded = self.load_prefetched("key_a", self.key_a, A)
         if loaded:
             return loaded.model_dump_json(indent=2).upper()
         return "Different"
 
-    @rx.var(cache=True)
+    @storage_var(deps=["key_b"])
     def b(self) -> str:
         logger.debug("DispB: Getting B")
-        loaded = self.load("key_b", self.key_b, B)
+        loaded = self.load_prefetched("key_b", self.key_b, B)
         if loaded:
             return loaded.model_dump_json(indent=2) * 2
         return "Different"
@@ -282,8 +225,9 @@ def index() -> rx.Component:
             This worked well with sync redis, but with async it's not possible to use the cache_var decorator and then
             it becomes a bit less clear how to handle the display part without loosing all the benefits of only storing
             the keys in the states.
-            
-            I think there might be a better way to think about the problem...
+
+            Now the display vars use `storage_var`, which declares the keys it depends on (`deps`) and fetches those
+            values from async redis before the (still sync) var function runs.
             """)
             ),
             rx.divider(),
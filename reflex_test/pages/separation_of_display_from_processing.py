@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import inspect
+import json
 import logging
 import random
 from contextlib import asynccontextmanager
 from textwrap import dedent
-from typing import TYPE_CHECKING, ClassVar, Callable, TypeVar, Generic, cast
+from typing import TYPE_CHECKING, Any, Awaitable, ClassVar, Callable, TypeVar, Generic, cast
 
 import reflex as rx
 from pydantic import BaseModel
 
+from reflex_test.db import get_repository
+from reflex_test.instrumentation import count_get_state, lock_metrics
+from reflex_test.storage.backend import get_redis
 from reflex_test.templates import template
 
 logger = logging.getLogger(__name__)
@@ -24,21 +33,85 @@ else:
             validate_assignment = True
 
 
-database: dict[int, DataA] = {}
-
-
 async def save_data(data: BaseModel) -> int:
-    global database
-    # Stand in for an async save to db function
-    next_id = len(database)
-    database[next_id] = data
-    return next_id
+    return await get_repository().save(data)
 
 
 async def load_data(data_id: int) -> BaseModel | None:
-    global database
-    # Stand in for an async load from db function
-    return database.get(data_id, None)
+    return await get_repository().load(data_id)
+
+
+class IdentityMap:
+    """
+    Data loaded/stored by `BackendVars` within a single event (unit of work), by id. Loading the same id again (e.g. by
+    `ABController.refresh_frontend` after an update loaded or stored it) returns the same object without reading the db
+    again, and stored data is added as it is saved.
+
+    Only used within `IdentityMap.scope()` (e.g. via `event_scoped` controller methods), and discarded at the end of the
+    scope so that the next event sees changes made by other sessions.
+    """
+
+    _current: ClassVar[contextvars.ContextVar[IdentityMap | None]] = contextvars.ContextVar(
+        "identity_map", default=None
+    )
+
+    def __init__(self):
+        self._loaded: dict[int, BaseModel | None] = {}
+        self._pending: dict[int, asyncio.Future[BaseModel | None]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def current(cls) -> IdentityMap | None:
+        return cls._current.get()
+
+    @classmethod
+    @contextlib.contextmanager
+    def scope(cls):
+        """Use the current identity map if there is one (i.e. nested scopes share the outermost), otherwise a new one"""
+        if (identity_map := cls._current.get()) is not None:
+            yield identity_map
+            return
+        identity_map = cls()
+        reset_token = cls._current.set(identity_map)
+        try:
+            yield identity_map
+        finally:
+            cls._current.reset(reset_token)
+            logger.debug(f"Identity map closed: {identity_map.hits} hits, {identity_map.misses} loads")
+
+    async def load(
+        self, data_id: int, loader: Callable[[int], Awaitable[BaseModel | None]] | None = None
+    ) -> BaseModel | None:
+        """Load via loader (`load_data` by default, looked up when called so that it can be replaced)"""
+        loader = loader or load_data
+        if data_id in self._loaded:
+            self.hits += 1
+            return self._loaded[data_id]
+        if (pending := self._pending.get(data_id)) is not None:
+            # Already being loaded (concurrently), share the result
+            self.hits += 1
+        else:
+            self.misses += 1
+            pending = self._pending[data_id] = asyncio.ensure_future(loader(data_id))
+            pending.add_done_callback(lambda _: self._pending.pop(data_id, None))
+        data = await asyncio.shield(pending)
+        # Unless it was stored in the meantime
+        return self._loaded.setdefault(data_id, data)
+
+    def add(self, data_id: int, data: BaseModel) -> None:
+        self._loaded[data_id] = data
+
+
+def event_scoped(method):
+    """Run the (async controller) method within an `IdentityMap` scope, i.e. one per event"""
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        with IdentityMap.scope():
+            return await method(*args, **kwargs)
+
+    return wrapper
 
 
 class BackendVarsBase(Base):
@@ -49,26 +122,134 @@ class BackendVarsBase(Base):
         raise NotImplementedError
 
 
+@dataclasses.dataclass
+class UpdateCounts:
+    """Number of fields that were changed (and so will be sent to the frontend) or skipped as unchanged"""
+
+    applied: int = 0
+    skipped: int = 0
+
+    def __add__(self, other: UpdateCounts) -> UpdateCounts:
+        return UpdateCounts(applied=self.applied + other.applied, skipped=self.skipped + other.skipped)
+
+
 class FrontendVarsBase(Base):
-    def update(self, *args, **kwargs):
+    def update(self, *args, **kwargs) -> UpdateCounts:
+        """Set the fields provided, skipping any that are unchanged (so they aren't marked dirty and sent again)"""
+        counts = UpdateCounts()
         for key, value in kwargs.items():
             if key not in self.__fields__:
                 raise ValueError(f"Invalid key {key}")
-            setattr(self, key, value)
+            if self._is_unchanged(getattr(self, key), value):
+                counts.skipped += 1
+            else:
+                setattr(self, key, value)
+                counts.applied += 1
+        return counts
+
+    @staticmethod
+    def _is_unchanged(current, value) -> bool:
+        # Identity first (cheap), and only compare values of the same type (e.g. avoids 1 == True)
+        return current is value or (type(current) is type(value) and current == value)
 
 
 frontend_type = TypeVar("frontend_type", bound=FrontendVarsBase)
 backend_type = TypeVar("backend_type", bound=BackendVarsBase)
 
 
+class DependencyGraph:
+    """
+    Which (frontend) states depend on which other states, i.e. should receive the same updates.
+
+    Dependencies are transitive (a state that depends on a dependent state is updated too), and the states to update
+    for a given set of sources are worked out once (in topological order) and then reused until another dependency is
+    registered. Registering the same dependency again (e.g. each time a page is compiled) does nothing, and registering
+    one that would create a cycle raises a ValueError.
+    """
+
+    def __init__(self):
+        # Full name of state -> full names of the states directly dependent on it (dicts to keep registration order)
+        self._dependents: dict[str, dict[str, None]] = {}
+        self._classes: dict[str, type[rx.State]] = {}
+        self._plans: dict[tuple[str, ...], tuple[type[rx.State], ...]] = {}
+
+    def register(self, state: type[rx.State], dependent_state: type[rx.State]) -> bool:
+        """Returns False if the dependency was already registered"""
+        name, dependent_name = state.get_full_name(), dependent_state.get_full_name()
+        if dependent_name in self._dependents.get(name, {}):
+            return False
+        if (path := self._path(dependent_name, name)) is not None:
+            cycle = " -> ".join([name, *path])
+            raise ValueError(f"Dependency of {dependent_name} on {name} would create a cycle: {cycle}")
+        self._classes[name], self._classes[dependent_name] = state, dependent_state
+        self._dependents.setdefault(name, {})[dependent_name] = None
+        self._plans.clear()
+        return True
+
+    def plan(self, *states: type[rx.State]) -> tuple[type[rx.State], ...]:
+        """All states that depend (transitively) on any of the states, in the order to update them"""
+        sources = tuple(dict.fromkeys(state.get_full_name() for state in states))
+        if sources not in self._plans:
+            self._plans[sources] = tuple(self._classes[name] for name in self._topological_order(sources))
+        return self._plans[sources]
+
+    def _reachable(self, sources: tuple[str, ...]) -> dict[str, None]:
+        reachable, to_visit = {}, list(sources)
+        while to_visit:
+            for dependent_name in self._dependents.get(to_visit.pop(), {}):
+                if dependent_name not in reachable:
+                    reachable[dependent_name] = None
+                    to_visit.append(dependent_name)
+        return reachable
+
+    def _topological_order(self, sources: tuple[str, ...]) -> list[str]:
+        """The states reachable from sources, each after all the (reachable) states it depends on"""
+        reachable = self._reachable(sources)
+        nodes = {**dict.fromkeys(sources), **reachable}
+        in_degree = dict.fromkeys(reachable, 0)
+        for name in nodes:
+            for dependent_name in self._dependents.get(name, {}):
+                in_degree[dependent_name] += 1
+        for source in sources:
+            for dependent_name in self._dependents.get(source, {}):
+                in_degree[dependent_name] -= 1
+        ordered = [name for name, degree in in_degree.items() if degree == 0 and name not in sources]
+        for name in ordered:
+            for dependent_name in self._dependents.get(name, {}):
+                in_degree[dependent_name] -= 1
+                if in_degree[dependent_name] == 0 and dependent_name not in sources:
+                    ordered.append(dependent_name)
+        return ordered
+
+    def _path(self, start: str, end: str) -> list[str] | None:
+        """A path of dependencies from start to end (if there is one)"""
+        if start == end:
+            return [start]
+        for dependent_name in self._dependents.get(start, {}):
+            if (path := self._path(dependent_name, end)) is not None:
+                return [start, *path]
+        return None
+
+
+# Ids of the states whose lock the current task holds via `ControllerBase.with_self`
+_locked_states: contextvars.ContextVar[frozenset[int]] = contextvars.ContextVar("locked_states", default=frozenset())
+
+
 class ControllerBase(Generic[frontend_type, backend_type]):
-    linked_states: dict[str, set[FrontendVarsBase | type[rx.State]]] = {}
+    dependency_graph: ClassVar[DependencyGraph] = DependencyGraph()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Time the public methods of each controller (and attribute any lock blocks within them to the method)
+        for name, method in list(vars(cls).items()):
+            if not name.startswith("_") and (inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method)):
+                setattr(cls, name, lock_metrics.timed(method))
 
     @classmethod
     def register_dependent_state(
         cls, state: backend_type | frontend_type | type[rx.State], dependent_state: frontend_type | type[rx.State]
     ):
-        cls.linked_states.setdefault(cls.get_state_full_name(state), set()).add(dependent_state)
+        cls.dependency_graph.register(state, dependent_state)
 
     def __init__(
         self,
@@ -95,20 +276,25 @@ class ControllerBase(Generic[frontend_type, backend_type]):
         self.user = user
         self.background = background
 
-        self._in_self = False
-
     @asynccontextmanager
     async def with_self(self):
         """
         If running from a background task, this will apply the `async with self` block to allow access to the state.
         If not running from a background task, then it will just yield and do nothing.
         I.e. Always use async with self.with_self() whenever it *might* be called from a background task
+
+        Nested blocks (in the same task) don't take the lock again. Whether the lock is held is tracked per task (a
+        contextvar), so other tasks using the same controller (e.g. a trailing flush of `CoalescedUpdates`) still wait
+        for the lock.
         """
-        if self.background and not self._in_self:
-            async with self.self_state:
-                self._in_self = True
-                yield
-                self._in_self = False
+        held = _locked_states.get()
+        if self.background and id(self.self_state) not in held:
+            async with lock_metrics.locked(self.self_state, "ControllerBase.with_self"):
+                reset_token = _locked_states.set(held | {id(self.self_state)})
+                try:
+                    yield
+                finally:
+                    _locked_states.reset(reset_token)
         else:
             yield
 
@@ -116,6 +302,7 @@ class ControllerBase(Generic[frontend_type, backend_type]):
         if not state_class:
             raise ValueError("No state class provided")
         async with self.with_self():
+            count_get_state()
             # Note: reflex handles caching when possible
             loaded_state_vars = cast(backend_type | frontend_type, await self.self_state.get_state(state_class))
         return loaded_state_vars
@@ -132,26 +319,184 @@ class ControllerBase(Generic[frontend_type, backend_type]):
     def get_state_full_name(state: rx.State | type[rx.State]) -> str:
         return state.get_full_name()
 
-    async def update_frontend(self, update_dependent_states: bool = True, **kwargs):
+    def stop_signal_key(self, name: str) -> tuple[str, str]:
+        """Key for `stop_signals` that is the same for any controller of this type for the same tab and states"""
+        states = [
+            self.get_state_full_name(cls) for cls in [self._backend_state_class, self._frontend_state_class] if cls
+        ]
+        return self.self_state.router.session.client_token, ":".join([type(self).__name__, name, *states])
+
+    def dependent_state_classes(self) -> tuple[type[rx.State], ...]:
+        """The states registered as (transitively) dependent on the current backend or frontend state"""
+        return self.dependency_graph.plan(
+            *[state_class for state_class in [self._backend_state_class, self._frontend_state_class] if state_class]
+        )
+
+    async def _get_states(self, state_classes: list[type[rx.State]]) -> list[rx.State]:
+        """Get multiple states at once (fetched concurrently rather than waiting for each in turn)"""
+        async with self.with_self():
+            count_get_state(len(state_classes))
+            return list(await asyncio.gather(*(self.self_state.get_state(cls) for cls in state_classes)))
+
+    async def update_frontend(self, update_dependent_states: bool = True, **kwargs) -> UpdateCounts:
         """
         Update the frontend state(s) with provided kwargs (also updating any other frontend states that have been
         registered as dependent on the current backend or frontend state)
+
+        Returns:
+            The total number of fields changed/skipped as unchanged (across all the states updated)
         """
+        # If frontend_state provided in init, then directly update that
+        state_classes = [self._frontend_state_class] if self._frontend_state_class else []
+        if update_dependent_states:
+            state_classes.extend(cls for cls in self.dependent_state_classes() if cls not in state_classes)
         async with self.with_self():
-            # Update all in one block
+            # Load all first, then update all in one block (i.e. a single lock hold for background tasks)
+            counts = UpdateCounts()
+            for fvar_state in await self._get_states(state_classes):
+                counts += cast(FrontendVarsBase, fvar_state).update(**kwargs)
+        logger.debug(f"Updated frontend: {counts.applied} fields changed, {counts.skipped} unchanged skipped")
+        return counts
+
+
+class CoalescedUpdates:
+    """
+    Buffers `update_frontend` kwargs from a (background) controller, merging them by field (later values replace
+    earlier ones), and applies them at most once per frame interval (with a single lock hold). Updates that arrive
+    too soon after a flush are applied by a trailing flush at the end of the frame (so they show even if nothing else
+    is updated for a while), and any remaining updates are applied on exit. Flushes never overlap (one that is due
+    while another is still applying waits for it).
+
+    Examples:
+        async with CoalescedUpdates(controller, frame_interval=0.05) as updates:
+            for i, token in enumerate(stream):
+                await updates.update(count=i, text=...)  # Only sent every 50ms at most
+    """
 
-            if self._frontend_state_class:
-                # If frontend_state provided in init, then directly update that
-                fvar_state = await self.get_fvars()
-                fvar_state.update(**kwargs)
+    def __init__(
+        self,
+        controller: ControllerBase,
+        frame_interval: float = 0.05,
+        on_flush: Callable[[], Awaitable[None]] | None = None,
+    ):
+        """
+        Args:
+            controller: The controller to update the frontend with
+            frame_interval: Minimum time (seconds) between flushes
+            on_flush: Called after each flush while the state is still locked (e.g. to check other state vars)
+        """
+        self.controller = controller
+        self.frame_interval = frame_interval
+        self.on_flush = on_flush
+        self._pending: dict[str, Any] = {}
+        self._last_flush = float("-inf")
+        self._trailing_flush: asyncio.Task | None = None
+        self._flushing = asyncio.Lock()
+        self.counts = UpdateCounts()
+        self.flushes = 0
+
+    async def update(self, **kwargs) -> bool:
+        """Buffer the updates (flushing if a frame interval has passed since the last flush)
+
+        Returns:
+            Whether the updates were flushed
+        """
+        self._pending.update(kwargs)
+        next_flush = self._last_flush + self.frame_interval
+        loop = asyncio.get_running_loop()
+        if loop.time() >= next_flush:
+            await self.flush()
+            return True
+        if self._trailing_flush is None:
+            self._trailing_flush = asyncio.create_task(self._flush_at(next_flush))
+        return False
+
+    async def _flush_at(self, when: float) -> None:
+        await asyncio.sleep(when - asyncio.get_running_loop().time())
+        self._trailing_flush = None
+        await self.flush()
+
+    def _cancel_trailing_flush(self) -> None:
+        if self._trailing_flush is not None and self._trailing_flush is not asyncio.current_task():
+            self._trailing_flush.cancel()
+        self._trailing_flush = None
+
+    async def flush(self) -> None:
+        self._cancel_trailing_flush()
+        async with self._flushing:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = asyncio.get_running_loop().time()
+            async with self.controller.with_self():
+                self.counts += await self.controller.update_frontend(**pending)
+                if self.on_flush:
+                    await self.on_flush()
+            self.flushes += 1
+
+    async def __aenter__(self) -> CoalescedUpdates:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.flush()
+
+
+class StopSignals:
+    """
+    Stop signals for long running (background) controller loops, keyed by client token and name (see
+    `ControllerBase.stop_signal_key`), so that a loop can wait for a stop without polling (and locking) the state.
+
+    Signals are local `asyncio.Event`s, and are also relayed to other workers via redis pub/sub once `relay_via_redis`
+    is running (e.g. as an app lifespan task).
+    """
+
+    channel = "controller-stop-signals"
+
+    def __init__(self):
+        self._events: dict[tuple[str, str], asyncio.Event] = {}
+        # Number of loops using each event (several loops may run under the same key)
+        self._users: dict[tuple[str, str], int] = {}
+        self._relaying = False
+
+    def event(self, token: str, name: str) -> asyncio.Event:
+        """The event that is set when the loop should stop (created if necessary), `discard` it when the loop ends"""
+        key = (token, name)
+        self._users[key] = self._users.get(key, 0) + 1
+        return self._events.setdefault(key, asyncio.Event())
+
+    def discard(self, token: str, name: str) -> None:
+        """The loop has ended (the event is removed once no other loop is using it)"""
+        key = (token, name)
+        users = self._users.pop(key, 0) - 1
+        if users > 0:
+            self._users[key] = users
+        else:
+            self._events.pop(key, None)
 
-            if update_dependent_states:
-                for state_class in [self._backend_state_class, self._frontend_state_class]:
-                    if state_class:
-                        name = self.get_state_full_name(state_class)
-                        for dependent_class in self.linked_states.get(name, []):
-                            dep_state = cast(FrontendVarsBase, await self.self_state.get_state(dependent_class))
-                            dep_state.update(**kwargs)
+    async def stop(self, token: str, name: str) -> None:
+        """Signal the loop to stop (on whichever worker it is running)"""
+        self._set(token, name)
+        if self._relaying:
+            await get_redis().publish(self.channel, json.dumps([token, name]))
+
+    def _set(self, token: str, name: str) -> None:
+        if (event := self._events.get((token, name))) is not None:
+            event.set()
+
+    async def relay_via_redis(self) -> None:
+        """Send/receive stop signals to/from other workers (runs until cancelled)"""
+        async with get_redis().pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            self._relaying = True
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._set(*json.loads(message["data"]))
+            finally:
+                self._relaying = False
+
+
+stop_signals = StopSignals()
 
 
 NOT_SET = object()
@@ -178,17 +523,28 @@ class BackendVars(BackendVarsBase):
 
     async def store(self, data_a: DataA = NOT_SET, data_b: DataB = NOT_SET):
         if data_a is not NOT_SET:
-            self.a_id = await save_data(data_a)
+            self.a_id = await self._save(data_a)
         if data_b is not NOT_SET:
-            self.b_id = await save_data(data_b)
+            self.b_id = await self._save(data_b)
 
     async def load(self, data_type: type[DataType]) -> DataType | None:
         if data_type == DataA:
-            return await load_data(self.a_id)
+            data_id = self.a_id
         elif data_type == DataB:
-            return await load_data(self.b_id)
+            data_id = self.b_id
         else:
             raise ValueError(f"Invalid data type {data_type}")
+        if (identity_map := IdentityMap.current()) is not None:
+            return await identity_map.load(data_id)
+        return await load_data(data_id)
+
+    @staticmethod
+    async def _save(data: BaseModel) -> int:
+        data_id = await save_data(data)
+        # Write through, so a load later in the same event returns this object
+        if (identity_map := IdentityMap.current()) is not None:
+            identity_map.add(data_id, data)
+        return data_id
 
 
 class FrontendVarsA(FrontendVarsBase):
@@ -201,16 +557,16 @@ class FrontendVarsA(FrontendVarsBase):
 
     def update(
         self, data_a: DataA = NOT_SET, data_b: DataB = NOT_SET, a_id: int = NOT_SET, b_id: int = NOT_SET, **kwargs
-    ):
+    ) -> UpdateCounts:
         if data_a is not NOT_SET:
-            self.a_repr = str(data_a)
+            kwargs["a_repr"] = str(data_a)
         if data_b is not NOT_SET:
-            self.b_repr = str(data_b)
+            kwargs["b_repr"] = str(data_b)
         if a_id is not NOT_SET:
-            self.a_id_copy = a_id
+            kwargs["a_id_copy"] = a_id
         if b_id is not NOT_SET:
-            self.b_id_copy = b_id
-        super().update(**kwargs)
+            kwargs["b_id_copy"] = b_id
+        return super().update(**kwargs)
 
 
 def display_type_A(
@@ -248,16 +604,16 @@ class FrontendVarsB(FrontendVarsBase):
 
     def update(
         self, data_a: DataA = NOT_SET, data_b: DataB = NOT_SET, a_id: int = NOT_SET, b_id: int = NOT_SET, **kwargs
-    ):
+    ) -> UpdateCounts:
         if data_a is not NOT_SET:
-            self.combined_as = f"<{data_a.foo}, {data_a.bar}, {data_a.baz}>"
+            kwargs["combined_as"] = f"<{data_a.foo}, {data_a.bar}, {data_a.baz}>"
         if data_b is not NOT_SET:
-            self.combined_bs = f"<{data_b.fe}, {data_b.fi}, {data_b.fo}>"
+            kwargs["combined_bs"] = f"<{data_b.fe}, {data_b.fi}, {data_b.fo}>"
         if a_id is not NOT_SET:
-            self.a_id_copy = a_id
+            kwargs["a_id_copy"] = a_id
         if b_id is not NOT_SET:
-            self.b_id_copy = b_id
-        super().update(**kwargs)
+            kwargs["b_id_copy"] = b_id
+        return super().update(**kwargs)
 
 
 def display_type_B(
@@ -307,32 +663,69 @@ class ABController(ControllerBase[FrontendVarsA | FrontendVarsB, BackendVars]):
     # Handle processing related to BackedVars (Data A and B)
     # Note: This is a regular class, so no weird inheritance from reflex
 
+    @event_scoped
     async def change_a(self):
         new_a = DataA(foo=random.randint(0, 100), bar=random.randint(0, 100), baz=random.randint(0, 100))
         bvars = await self.get_bvars()
         await bvars.store(data_a=new_a)
         await self.update_frontend(data_a=new_a, a_id=bvars.a_id)
 
+    @event_scoped
     async def change_b(self):
         new_b = DataB(fe=str(random.randint(0, 100)), fi=str(random.randint(0, 100)), fo=str(random.randint(0, 100)))
         bvars = await self.get_bvars()
         await bvars.store(data_b=new_b)
         await self.update_frontend(data_b=new_b, b_id=bvars.b_id)
 
+    @event_scoped
+    async def update_a(self):
+        """Change one value of the stored A (and show the stored A and B)"""
+        bvars = await self.get_bvars()
+        data_a = await bvars.load(DataA) or DataA()
+        await bvars.store(data_a=data_a.model_copy(update=dict(foo=data_a.foo + 1)))
+        await self.refresh_frontend()
+
+    @event_scoped
+    async def update_b(self):
+        """Change one value of the stored B (and show the stored A and B)"""
+        bvars = await self.get_bvars()
+        data_b = await bvars.load(DataB) or DataB()
+        await bvars.store(data_b=data_b.model_copy(update=dict(fe=data_b.fe + "+")))
+        await self.refresh_frontend()
+
+    @event_scoped
+    async def refresh_frontend(self):
+        """Show the stored A and B (loaded again by id, from the identity map if already loaded/stored in this event)"""
+        bvars = await self.get_bvars()
+        data_a, data_b = await asyncio.gather(bvars.load(DataA), bvars.load(DataB))
+        await self.update_frontend(data_a=data_a or DataA(), data_b=data_b or DataB(), a_id=bvars.a_id, b_id=bvars.b_id)
+
+    @event_scoped
     async def change_background_color(self):
         new_color = random.choice(["red", "green", "blue", "yellow", "purple"])
         await self.update_frontend(background_color=new_color)
 
-    async def start_counting_background(self):
+    async def start_counting_background(self, step_interval: float = 1, frame_interval: float = 0.05):
+        stop_key = self.stop_signal_key("counting")
+        stop = stop_signals.event(*stop_key)
+        stop.clear()
         await self.update_frontend(counting=True)
-        i = 0
-        while (await self.get_fvars()).counting:
-            i += 1
-            await self.update_frontend(count=i)
-            await asyncio.sleep(1)
-            yield
-
+        try:
+            async with CoalescedUpdates(self, frame_interval=frame_interval) as updates:
+                i = 0
+                while not stop.is_set():
+                    i += 1
+                    if await updates.update(count=i):
+                        yield
+                    # Wait for the next step, or stop immediately if signalled (without touching the state)
+                    with contextlib.suppress(TimeoutError):
+                        await asyncio.wait_for(stop.wait(), timeout=step_interval)
+        finally:
+            stop_signals.discard(*stop_key)
+
+    @event_scoped
     async def stop_counting(self):
+        await stop_signals.stop(*self.stop_signal_key("counting"))
         await self.update_frontend(counting=False)
 
 
@@ -380,6 +773,12 @@ class FullB(rx.ComponentState):
     async def change_b(self):
         return await ABController(self_state=self, backend_state_class=self.backend_state).change_b()
 
+    async def update_a(self):
+        return await ABController(self_state=self, backend_state_class=self.backend_state).update_a()
+
+    async def update_b(self):
+        return await ABController(self_state=self, backend_state_class=self.backend_state).update_b()
+
     @rx.event(background=True)
     async def start_counting(self):
         async for event in ABController(
@@ -405,8 +804,8 @@ class FullB(rx.ComponentState):
             title=title,
             on_click_change_a=cls.change_a,
             on_click_change_b=cls.change_b,
-            on_click_update_a=cls.change_a,
-            on_click_update_b=cls.change_b,
+            on_click_update_a=cls.update_a,
+            on_click_update_b=cls.update_b,
             on_click_start_counting=cls.start_counting,
             on_click_stop_counting=cls.stop_counting,
         )
@@ -3,8 +3,17 @@ from reflex_test import styles
 # Import all the pages.
 from reflex_test.pages import *  # noqa: F403
 
+import asyncio
+import contextlib
+
 import reflex as rx
 
+from reflex_test.broadcast import enable_broadcast
+from reflex_test.db import upgrade_schema
+from reflex_test.instrumentation import export_lock_metrics
+from reflex_test.pages.separation_of_display_from_processing import stop_signals
+from reflex_test.storage import backend, invalidation, purge_tabs_on_disconnect
+
 text_area_auto_expand_script = rx.script("""
         const tx = document.getElementsByTagName("textarea");
         for (let i = 0; i < tx.length; i++) {
@@ -23,4 +32,28 @@ text_area_auto_expand_script = rx.script("""
 # app = rx.App(style=styles.base_style, head_components=[text_area_auto_expand_script])
 app = rx.App(style=styles.base_style, head_components=[])
 
+
+@contextlib.asynccontextmanager
+async def migrate_database():
+    # Awaited before the app starts serving (rather than a background task), so no event runs before the tables exist
+    await asyncio.to_thread(upgrade_schema)
+    yield
+
+
+app.register_lifespan_task(migrate_database)
+
+
+@contextlib.asynccontextmanager
+async def check_redis_version():
+    await backend.check_server_version()
+    yield
+
+
+app.register_lifespan_task(check_redis_version)
+purge_tabs_on_disconnect(app)
+invalidation.enable_invalidation(app)
+enable_broadcast(app, queue_depth=100, queue_policy="coalesce")
+app.register_lifespan_task(stop_signals.relay_via_redis)
+app.register_lifespan_task(export_lock_metrics)
+
 # app.add_page(audio_recorder_polyfill, route="/audio_recorder", title="Audio recorder example")
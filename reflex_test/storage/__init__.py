@@ -0,0 +1,16 @@
+from . import compression, invalidation, serialization
+from .cache import LRUCache, storage_cache
+from .storage_base import StorageBase, list_keys, purge_group, purge_tabs_on_disconnect, storage_var
+
+__all__ = [
+    "LRUCache",
+    "StorageBase",
+    "compression",
+    "invalidation",
+    "list_keys",
+    "purge_group",
+    "purge_tabs_on_disconnect",
+    "serialization",
+    "storage_cache",
+    "storage_var",
+]
@@ -0,0 +1,60 @@
+"""Redis clients used by StorageBase.
+
+Uses a real redis server if REDIS_URL is set, otherwise an in-process fakeredis server. The async client is the one
+that should be used from event handlers etc. The sync client shares the same server and is only there as a fallback
+for the (rare) cases where a value has to be read synchronously (e.g. a cached var recomputing during hydrate).
+
+A real server must be redis 7.0 or newer (StorageBase extends expiries with EXPIRE NX/GT), see `check_server_version`.
+"""
+
+from __future__ import annotations
+
+import os
+
+import redis as redis_py
+from fakeredis import FakeAsyncRedis, FakeRedis, FakeServer
+from redis import asyncio as redis_asyncio
+
+redis: redis_asyncio.Redis
+sync_redis: redis_py.Redis
+
+
+def create_clients(url: str | None = None) -> tuple[redis_asyncio.Redis, redis_py.Redis]:
+    """Create an (async, sync) pair of clients that talk to the same server"""
+    if url:
+        return redis_asyncio.Redis.from_url(url), redis_py.Redis.from_url(url)
+    server = FakeServer()
+    return FakeAsyncRedis(server=server, decode_responses=False), FakeRedis(server=server, decode_responses=False)
+
+
+# EXPIRE with the NX/GT options (used to only ever extend the expiry of group indexes and "content" blobs)
+MIN_SERVER_VERSION = (7, 0)
+
+
+async def check_server_version(client: redis_asyncio.Redis | None = None) -> None:
+    """Raise a RuntimeError if the redis server is older than MIN_SERVER_VERSION (e.g. at startup)"""
+    client = client if client is not None else get_redis()
+    if isinstance(client, FakeAsyncRedis):
+        # Implements the commands of recent versions (but not INFO)
+        return
+    version = (await client.info("server"))["redis_version"]
+    if tuple(int(part) for part in str(version).split(".")[:2]) < MIN_SERVER_VERSION:
+        required = ".".join(map(str, MIN_SERVER_VERSION))
+        raise RuntimeError(f"StorageBase needs redis {required} or newer, the server is {version}")
+
+
+def set_clients(async_client: redis_asyncio.Redis, sync_client: redis_py.Redis) -> None:
+    """Replace the clients used by StorageBase (e.g. for tests)"""
+    global redis, sync_redis
+    redis, sync_redis = async_client, sync_client
+
+
+def get_redis() -> redis_asyncio.Redis:
+    return redis
+
+
+def get_sync_redis() -> redis_py.Redis:
+    return sync_redis
+
+
+set_clients(*create_clients(os.environ.get("REDIS_URL")))
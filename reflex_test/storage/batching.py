@@ -0,0 +1,66 @@
+"""Coalescing of redis GETs that are requested in the same event loop iteration into a single MGET.
+
+When reflex calculates a delta, all of the async (storage) vars that need recomputing are started as tasks before any
+of them are awaited. So if each of them asks the `BatchLoader` for its keys, they all end up in the same MGET.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Sequence
+
+from reflex_test.storage.backend import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLoader:
+    def __init__(self):
+        # Keys waiting to be sent (per event loop) -> futures waiting for that key
+        self._pending: dict[asyncio.AbstractEventLoop, dict[str, list[asyncio.Future]]] = {}
+        self._sending: set[asyncio.Task] = set()
+        self.round_trips = 0
+
+    async def get_many(self, keys: Sequence[str]) -> list[bytes | None]:
+        """Get the raw values for keys (sent along with any other keys requested in the same loop iteration)"""
+        if not keys:
+            return []
+        loop = asyncio.get_running_loop()
+        if loop not in self._pending:
+            self._pending[loop] = {}
+            # call_soon runs after any tasks that are already scheduled get a chance to add their keys
+            loop.call_soon(self._flush, loop)
+        pending = self._pending[loop]
+        futures = []
+        for key in keys:
+            future = loop.create_future()
+            pending.setdefault(key, []).append(future)
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        task = loop.create_task(self._send(self._pending.pop(loop)))
+        # Keep a reference until done (the loop only holds weak references to tasks)
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, pending: dict[str, list[asyncio.Future]]) -> None:
+        keys = list(pending)
+        logger.debug(f"Sending batched MGET for {len(keys)} keys")
+        self.round_trips += 1
+        try:
+            values = await get_redis().mget(keys)
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for key, value in zip(keys, values):
+            for future in pending[key]:
+                if not future.done():
+                    future.set_result(value)
+
+
+batch_loader = BatchLoader()
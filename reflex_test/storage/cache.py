@@ -0,0 +1,100 @@
+"""In-process LRU cache of deserialized StorageBase values (keyed by the full redis key)."""
+
+from __future__ import annotations
+
+import dataclasses
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class _Entry:
+    value: Any
+    version: int
+    nbytes: int
+    expires_at: float
+
+
+class LRUCache:
+    """
+    Bounded (by number of items and by serialized size) LRU cache with an expiry per entry.
+
+    Each entry also records the version of the key it was read at (see StorageBase.store), so that a slow read can't
+    replace a newer value that was written in the meantime, and so that a value can be checked against the current
+    version in redis before it is used (another worker may have stored a newer one).
+    """
+
+    def __init__(self, max_items: int = 1000, max_bytes: int = 50 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, version: int | None = None) -> Any | None:
+        """Get the cached value (or None if not cached/expired, or if it isn't the given version)"""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic() or (version is not None and entry.version != version):
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key: str, value: Any, version: int, nbytes: int, ttl: float) -> None:
+        """Cache the value unless a newer version of the key is already cached"""
+        existing = self._entries.get(key)
+        if existing is not None:
+            if existing.version > version:
+                logger.debug(f"Not caching {key} v{version}, already have v{existing.version}")
+                return
+            self._remove(key)
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = _Entry(value=value, version=version, nbytes=nbytes, expires_at=time.monotonic() + ttl)
+        self.total_bytes += nbytes
+        while len(self._entries) > self.max_items or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def version(self, key: str) -> int | None:
+        """Version of the cached value (without counting as a hit/miss)"""
+        entry = self._entries.get(key)
+        return entry.version if entry is not None else None
+
+    def invalidate(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "items": len(self._entries),
+            "bytes": self.total_bytes,
+        }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.nbytes
+
+
+storage_cache = LRUCache()
@@ -0,0 +1,113 @@
+"""Optional compression of large StorageBase payloads.
+
+Compressed payloads start with a one byte codec header (distinct from the serializer codec ids), so `decompress` can
+tell whether a payload needs decompressing at all.
+"""
+
+from __future__ import annotations
+
+import logging
+import lzma
+import zlib
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+
+class Compressor(Protocol):
+    name: str
+    # First byte of every compressed payload (must not clash with serialization codec ids)
+    codec_id: bytes
+
+    def compress(self, data: bytes) -> bytes: ...
+
+    def decompress(self, data: bytes) -> bytes: ...
+
+
+class ZlibCompressor:
+    name = "zlib"
+    codec_id = b"\x01"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCompressor:
+    name = "lzma"
+    codec_id = b"\x02"
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+class ZstdCompressor:
+    name = "zstd"
+    codec_id = b"\x03"
+
+    def __init__(self, level: int = 3):
+        import zstandard
+
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+compressors: dict[str, Compressor] = {}
+_compressors_by_codec_id: dict[bytes, Compressor] = {}
+
+
+def register_compressor(compressor: Compressor) -> None:
+    if compressor.codec_id in _compressors_by_codec_id:
+        raise ValueError(
+            f"Codec id {compressor.codec_id!r} already used by {_compressors_by_codec_id[compressor.codec_id].name}"
+        )
+    compressors[compressor.name] = compressor
+    _compressors_by_codec_id[compressor.codec_id] = compressor
+
+
+register_compressor(ZlibCompressor())
+register_compressor(LzmaCompressor())
+try:
+    register_compressor(ZstdCompressor())
+except ImportError:
+    logger.debug("zstandard not installed, zstd compression not available")
+
+
+def compress(data: bytes, compressor_name: str | None, threshold: int) -> tuple[bytes, float | None]:
+    """
+    Compress data if it is at least threshold bytes (and compressing actually makes it smaller)
+
+    Returns:
+        The payload to store, and the compression ratio (original/compressed) or None if not compressed
+    """
+    if compressor_name is None or len(data) < threshold:
+        return data, None
+    compressor = compressors.get(compressor_name)
+    if compressor is None:
+        raise ValueError(f"Unknown compressor {compressor_name}, available: {list(compressors)}")
+    compressed = compressor.codec_id + compressor.compress(data)
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, len(data) / len(compressed)
+
+
+def decompress(payload: bytes) -> bytes:
+    """Decompress the payload if it has a compression header (otherwise returned as is)"""
+    compressor = _compressors_by_codec_id.get(payload[:1])
+    if compressor is None:
+        return payload
+    return compressor.decompress(payload[1:])
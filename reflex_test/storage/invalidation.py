@@ -0,0 +1,220 @@
+"""Invalidation of `storage_var`s when the values they display are stored again (by any session, on any worker).
+
+`StorageBase` publishes the keys (and new versions) of everything it stores to an `InvalidationBus`. Every worker
+listens to the bus, drops stale values from its local cache, and marks the `storage_var`s of its sessions that
+displayed those keys dirty (pushing the recomputed values to the client).
+
+Enable with `enable_invalidation(app)` (uses redis pub/sub, or pass `LocalBus()` for a single process).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import logging
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Iterable, Protocol
+
+import reflex as rx
+from reflex.state import StateUpdate, _resolve_delta, _substate_key
+
+from reflex_test.storage.backend import get_redis
+from reflex_test.storage.cache import storage_cache
+
+logger = logging.getLogger(__name__)
+
+# Identifies the messages published by this process
+WORKER_ID = uuid.uuid4().hex
+
+
+@dataclasses.dataclass(frozen=True)
+class Invalidation:
+    # New version of each key that was stored (None if deleted)
+    versions: dict[str, int | None]
+    origin: str = WORKER_ID
+
+    def encode(self) -> bytes:
+        return json.dumps({"versions": self.versions, "origin": self.origin}).encode()
+
+    @classmethod
+    def decode(cls, data: bytes | str) -> Invalidation:
+        return cls(**json.loads(data))
+
+
+InvalidationHandler = Callable[[Invalidation], Awaitable[None]]
+
+
+class InvalidationBus(Protocol):
+    async def publish(self, invalidation: Invalidation) -> None: ...
+
+    async def listen(self, handler: InvalidationHandler) -> None:
+        """Call handler for every published invalidation (runs until cancelled)"""
+        ...
+
+
+class LocalBus:
+    """In-memory stand-in for a single process (e.g. for tests). Handlers run as tasks, like they would via redis."""
+
+    def __init__(self):
+        self._handlers: list[InvalidationHandler] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    async def publish(self, invalidation: Invalidation) -> None:
+        for handler in self._handlers:
+            task = asyncio.create_task(handler(invalidation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def listen(self, handler: InvalidationHandler) -> None:
+        self._handlers.append(handler)
+
+    async def join(self) -> None:
+        """Wait until all published invalidations have been handled"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+class RedisBus:
+    """Redis pub/sub (via the StorageBase redis client), so invalidations reach all workers"""
+
+    def __init__(self, channel: str = "storage-invalidation"):
+        self.channel = channel
+        self._tasks: set[asyncio.Task] = set()
+
+    async def publish(self, invalidation: Invalidation) -> None:
+        await get_redis().publish(self.channel, invalidation.encode())
+
+    async def listen(self, handler: InvalidationHandler) -> None:
+        async with get_redis().pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                # Handled in a task (like `LocalBus`), so a slow refresh doesn't hold up reading further invalidations
+                task = asyncio.create_task(self._handle(handler, message["data"]))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _handle(handler: InvalidationHandler, data: bytes) -> None:
+        try:
+            await handler(Invalidation.decode(data))
+        except Exception:
+            logger.exception(f"Failed to handle invalidation {data}")
+
+    async def join(self) -> None:
+        """Wait until all received invalidations have been handled"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+class Invalidator:
+    """Tracks which keys the storage_vars of each session (on this worker) displayed, and refreshes them"""
+
+    def __init__(self):
+        self.app: rx.App | None = None
+        # (token, state name, var name) -> keys it was computed from
+        self._keys_by_watcher: dict[tuple[str, str, str], set[str]] = {}
+        self._watchers_by_key: defaultdict[str, set[tuple[str, str, str]]] = defaultdict(set)
+
+    @property
+    def enabled(self) -> bool:
+        return self.app is not None
+
+    def watch(self, token: str, state_name: str, var_name: str, unique_keys: Iterable[str]) -> None:
+        """Record the keys a var was (last) computed from"""
+        if not self.enabled:
+            return
+        watcher = (token, state_name, var_name)
+        self._unwatch(watcher)
+        self._keys_by_watcher[watcher] = set(unique_keys)
+        for unique_key in self._keys_by_watcher[watcher]:
+            self._watchers_by_key[unique_key].add(watcher)
+
+    def unwatch_token(self, token: str) -> None:
+        for watcher in [watcher for watcher in self._keys_by_watcher if watcher[0] == token]:
+            self._unwatch(watcher)
+
+    def watchers(self, unique_key: str) -> set[tuple[str, str, str]]:
+        return set(self._watchers_by_key.get(unique_key, ()))
+
+    def _unwatch(self, watcher: tuple[str, str, str]) -> None:
+        for unique_key in self._keys_by_watcher.pop(watcher, ()):
+            watchers = self._watchers_by_key[unique_key]
+            watchers.discard(watcher)
+            if not watchers:
+                del self._watchers_by_key[unique_key]
+
+    async def handle(self, invalidation: Invalidation) -> None:
+        vars_by_token: defaultdict[str, set[tuple[str, str]]] = defaultdict(set)
+        for unique_key, version in invalidation.versions.items():
+            cached_version = storage_cache.version(unique_key)
+            # Values stored by this worker are already up to date in the cache
+            if cached_version is not None and (version is None or cached_version < version):
+                storage_cache.invalidate(unique_key)
+            for token, state_name, var_name in self.watchers(unique_key):
+                vars_by_token[token].add((state_name, var_name))
+        await asyncio.gather(*(self._refresh(token, state_vars) for token, state_vars in vars_by_token.items()))
+
+    async def _refresh(self, token: str, state_vars: set[tuple[str, str]]) -> None:
+        """Recompute the vars for the session and send the delta (like `app.modify_state`, but resolving async vars)"""
+        if token not in self.app.event_namespace.token_to_sid:
+            logger.debug(f"{token} disconnected, no longer watching its keys")
+            self.unwatch_token(token)
+            return
+        first_state_name = next(iter(state_vars))[0]
+        async with self.app.state_manager.modify_state(_substate_key(token, first_state_name)) as root:
+            for state_name, var_name in state_vars:
+                substate = await root.get_state(root.get_class_substate(state_name))
+                substate.computed_vars[var_name].mark_dirty(instance=substate)
+                substate.dirty_vars.add(var_name)
+                substate._mark_dirty()
+            delta = await _resolve_delta(root.get_delta())
+            root._clean()
+            if delta:
+                await self.app.event_namespace.emit_update(
+                    update=StateUpdate(delta=delta), sid=root.router.session.session_id
+                )
+
+
+invalidator = Invalidator()
+_bus: InvalidationBus | None = None
+
+
+def get_bus() -> InvalidationBus | None:
+    return _bus
+
+
+async def publish(versions: dict[str, int | None]) -> None:
+    """Let all workers know that the keys were stored (no-op unless `enable_invalidation` was called)"""
+    if _bus is not None and versions:
+        await _bus.publish(Invalidation(versions))
+
+
+def enable_invalidation(app: rx.App, bus: InvalidationBus | None = None) -> InvalidationBus:
+    """
+    Refresh the storage_vars of all sessions (on all workers) when the values they display are stored again.
+
+    Examples:
+        app = rx.App()
+        enable_invalidation(app)
+    """
+    global _bus
+    _bus = bus if bus is not None else RedisBus()
+    invalidator.app = app
+
+    async def listen_for_invalidations():
+        await _bus.listen(invalidator.handle)
+
+    app.register_lifespan_task(listen_for_invalidations)
+    return _bus
+
+
+def disable_invalidation() -> None:
+    global _bus
+    _bus = None
+    invalidator.app = None
+    invalidator._keys_by_watcher.clear()
+    invalidator._watchers_by_key.clear()
@@ -0,0 +1,255 @@
+"""Serializers for values stored via StorageBase.
+
+Pydantic models are stored as `model_dump` output (json by default, or orjson/msgpack if installed) along with a
+type tag and schema version so they can be validated back into the right class. Anything else (and any model that
+can't be imported by name) falls back to dill.
+
+Payload format for the model serializers:
+    codec id (1 byte) | schema version (uint16) | type tag length (uint16) | type tag (module:qualname) | body
+
+Dill payloads start with the pickle PROTO opcode (0x80), so payloads stored before the registry existed are still
+detected as dill.
+
+Models can define `schema_version: ClassVar[int]` (defaults to 0) and optionally a
+`migrate_schema(cls, data: dict, from_version: int) -> dict` classmethod which is called with the dumped data when a
+payload was stored with a different schema version.
+
+Models can also be encoded per field (for storing as a redis hash, see `dump_fields`/`load_hash`), each field is the
+json of its `model_dump(mode="json")` value, plus the type tag and schema version in reserved fields.
+"""
+
+from __future__ import annotations
+
+import functools
+import importlib
+import json
+import logging
+import struct
+from typing import Any, Iterable, Mapping, Protocol
+
+import dill
+import pydantic_core
+from pydantic import BaseModel, TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">cHH")
+
+
+class Serializer(Protocol):
+    name: str
+    # First byte of every payload (must be unique)
+    codec_id: bytes
+
+    def dumps(self, value: Any) -> bytes: ...
+
+    def loads(self, data: bytes) -> Any: ...
+
+
+class DillSerializer:
+    name = "dill"
+    codec_id = b"\x80"  # Pickle PROTO opcode
+
+    def dumps(self, value: Any) -> bytes:
+        return dill.dumps(value, byref=True)
+
+    def loads(self, data: bytes) -> Any:
+        return dill.loads(data)
+
+
+class ModelSerializer:
+    """Base for serializers that store `model_dump` output with a type tag and schema version"""
+
+    name: str
+    codec_id: bytes
+
+    def dump_body(self, value: BaseModel) -> bytes:
+        raise NotImplementedError
+
+    def load_body(self, model_class: type[BaseModel], body: bytes, same_version: bool) -> Any:
+        """Return the validated model, or the plain data (for migration) if not same_version"""
+        raise NotImplementedError
+
+    def dumps(self, value: BaseModel) -> bytes:
+        tag = type_tag(type(value)).encode()
+        header = _HEADER.pack(self.codec_id, schema_version(type(value)), len(tag))
+        return header + tag + self.dump_body(value)
+
+    def loads(self, data: bytes) -> BaseModel:
+        _, stored_version, tag_length = _HEADER.unpack_from(data)
+        tag_end = _HEADER.size + tag_length
+        model_class = resolve_type_tag(data[_HEADER.size : tag_end].decode())
+        body = data[tag_end:]
+        current_version = schema_version(model_class)
+        if stored_version == current_version:
+            return self.load_body(model_class, body, same_version=True)
+
+        logger.debug(f"Migrating {model_class.__name__} from schema v{stored_version} to v{current_version}")
+        loaded = self.load_body(model_class, body, same_version=False)
+        if hasattr(model_class, "migrate_schema"):
+            loaded = model_class.migrate_schema(loaded, stored_version)
+        return model_class.model_validate(loaded)
+
+
+class JsonSerializer(ModelSerializer):
+    """Uses pydantic's own (rust) json encoding/validation, so is always available"""
+
+    name = "json"
+    codec_id = b"J"
+
+    def dump_body(self, value: BaseModel) -> bytes:
+        return value.model_dump_json().encode()
+
+    def load_body(self, model_class: type[BaseModel], body: bytes, same_version: bool) -> Any:
+        if same_version:
+            return model_class.model_validate_json(body)
+        return json.loads(body)
+
+
+class OrjsonSerializer(ModelSerializer):
+    name = "orjson"
+    codec_id = b"O"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def dump_body(self, value: BaseModel) -> bytes:
+        return self._orjson.dumps(value.model_dump(mode="json"))
+
+    def load_body(self, model_class: type[BaseModel], body: bytes, same_version: bool) -> Any:
+        data = self._orjson.loads(body)
+        return model_class.model_validate(data) if same_version else data
+
+
+class MsgpackSerializer(ModelSerializer):
+    name = "msgpack"
+    codec_id = b"M"
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dump_body(self, value: BaseModel) -> bytes:
+        return self._msgpack.packb(value.model_dump(mode="json"))
+
+    def load_body(self, model_class: type[BaseModel], body: bytes, same_version: bool) -> Any:
+        data = self._msgpack.unpackb(body)
+        return model_class.model_validate(data) if same_version else data
+
+
+serializers: dict[str, Serializer] = {}
+_serializers_by_codec_id: dict[bytes, Serializer] = {}
+
+
+def register_serializer(serializer: Serializer) -> None:
+    if serializer.codec_id in _serializers_by_codec_id:
+        raise ValueError(
+            f"Codec id {serializer.codec_id!r} already used by {_serializers_by_codec_id[serializer.codec_id].name}"
+        )
+    serializers[serializer.name] = serializer
+    _serializers_by_codec_id[serializer.codec_id] = serializer
+
+
+register_serializer(DillSerializer())
+register_serializer(JsonSerializer())
+for _optional_serializer in (OrjsonSerializer, MsgpackSerializer):
+    try:
+        register_serializer(_optional_serializer())
+    except ImportError:
+        logger.debug(f"{_optional_serializer.name} not installed, serializer not available")
+
+
+def type_tag(model_class: type[BaseModel]) -> str:
+    return f"{model_class.__module__}:{model_class.__qualname__}"
+
+
+@functools.cache
+def resolve_type_tag(tag: str) -> type[BaseModel]:
+    module_name, qualname = tag.split(":")
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def schema_version(model_class: type[BaseModel]) -> int:
+    return getattr(model_class, "schema_version", 0)
+
+
+def _can_use_model_serializer(value: Any) -> bool:
+    # Classes defined in functions can't be found again by name
+    return isinstance(value, BaseModel) and "<locals>" not in type(value).__qualname__
+
+
+def dumps(value: Any, serializer_name: str = "json") -> bytes:
+    """Serialize with the named serializer (falls back to dill for values that the serializer can't handle)"""
+    serializer = serializers.get(serializer_name)
+    if serializer is None:
+        raise ValueError(f"Unknown serializer {serializer_name}, available: {list(serializers)}")
+    if isinstance(serializer, ModelSerializer) and not _can_use_model_serializer(value):
+        serializer = serializers["dill"]
+    return serializer.dumps(value)
+
+
+def loads(data: bytes) -> Any:
+    """Deserialize with whichever serializer was used to create data"""
+    serializer = _serializers_by_codec_id.get(data[:1])
+    if serializer is None:
+        raise ValueError(f"Unknown codec id {data[:1]!r}")
+    return serializer.loads(data)
+
+
+TYPE_FIELD = "__type__"
+SCHEMA_FIELD = "__schema__"
+
+
+def dump_fields(value: BaseModel) -> dict[str, bytes]:
+    """Encode each field of the model separately (along with its type tag and schema version)"""
+    if not _can_use_model_serializer(value):
+        raise ValueError(
+            f"Only pydantic models that can be imported by name can be stored per field, got {type(value)}"
+        )
+    encoded = encode_fields(value.model_dump(mode="json"))
+    encoded[TYPE_FIELD] = type_tag(type(value)).encode()
+    encoded[SCHEMA_FIELD] = str(schema_version(type(value))).encode()
+    return encoded
+
+
+def encode_fields(changes: Mapping[str, Any]) -> dict[str, bytes]:
+    return {name: pydantic_core.to_json(field_value) for name, field_value in changes.items()}
+
+
+def load_hash(mapping: Mapping[bytes | str, bytes]) -> BaseModel | None:
+    """Model from all the fields created by `dump_fields` (None if the type field is missing)"""
+    fields = {_str(name): field_value for name, field_value in mapping.items()}
+    tag = fields.pop(TYPE_FIELD, None)
+    if tag is None:
+        return None
+    model_class = resolve_type_tag(_str(tag))
+    stored_version = int(fields.pop(SCHEMA_FIELD, 0))
+    data = {name: json.loads(field_value) for name, field_value in fields.items()}
+    if stored_version != schema_version(model_class) and hasattr(model_class, "migrate_schema"):
+        data = model_class.migrate_schema(data, stored_version)
+    return model_class.model_validate(data)
+
+
+def load_field_values(tag: bytes | str, names: Iterable[str], values: Iterable[bytes | None]) -> dict[str, Any]:
+    """Validated values of some fields of a model stored with `dump_fields` (missing fields are left out)"""
+    model_class = resolve_type_tag(_str(tag))
+    return {
+        name: _field_adapter(model_class, name).validate_json(field_value)
+        for name, field_value in zip(names, values)
+        if field_value is not None
+    }
+
+
+@functools.cache
+def _field_adapter(model_class: type[BaseModel], name: str) -> TypeAdapter:
+    return TypeAdapter(model_class.model_fields[name].annotation)
+
+
+def _str(value: bytes | str) -> str:
+    return value.decode() if isinstance(value, bytes) else value
@@ -0,0 +1,713 @@
+"""StorageBase mixin for keeping (potentially large) pydantic models in redis and only storing the keys in the state."""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import functools
+import hashlib
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, ClassVar, Iterable, Literal, Self, TypeVar
+
+import reflex as rx
+from pydantic import BaseModel
+
+from redis.exceptions import WatchError
+
+from reflex_test.storage import compression, invalidation, serialization
+from reflex_test.storage.backend import get_redis, get_sync_redis
+from reflex_test.storage.batching import batch_loader
+from reflex_test.storage.cache import storage_cache
+
+logger = logging.getLogger(__name__)
+# logger.setLevel(logging.DEBUG)
+
+
+model_type = TypeVar("model_type", bound=BaseModel)
+
+# Values fetched (asynchronously) by a `storage_var` right before its sync function runs
+_prefetched: ContextVar[dict[str, BaseModel | None] | None] = ContextVar("storage_prefetched", default=None)
+
+
+def _version_key(unique_key: str) -> str:
+    """Counter that is incremented every time a new value is stored under unique_key"""
+    return f"{unique_key}:version"
+
+
+def _compression_key(unique_key: str) -> str:
+    """Compression ratio of the value stored under unique_key (only set if compressed)"""
+    return f"{unique_key}:compression"
+
+
+def _index_key(group: str) -> str:
+    """Sorted set of all keys stored for group (scored by when they expire)"""
+    return f"storage-index:{group}"
+
+
+def _connects_key(client_token: str) -> str:
+    """Number of times the tab connected (to any worker), recently"""
+    return f"tab-connects:{client_token}"
+
+
+# Stored (instead of the payload) under the keys of attrs with storage_mode "content", followed by the blob digest
+_POINTER = b"\x00blob:"
+
+
+def _blob_key(digest: str) -> str:
+    """Payload stored once for all keys with storage_mode "content" that have the same value"""
+    return f"storage-blob:{digest}"
+
+
+def _refs_key(digest: str) -> str:
+    """Number of keys pointing to the blob"""
+    return f"storage-blob:{digest}:refs"
+
+
+def _pointer_digest(data: bytes | None) -> str | None:
+    if data is not None and data.startswith(_POINTER):
+        return data[len(_POINTER) :].decode()
+    return None
+
+
+def _payload_size(data: bytes | dict[bytes | str, bytes] | None) -> int:
+    if isinstance(data, dict):
+        return sum(len(name) + len(field_value) for name, field_value in data.items())
+    return len(data) if data else 0
+
+
+class StorageBase(rx.State, mixin=True):
+    """
+    Base mixin for storing data in redis to be shared between states etc. Defaults to per tab storage, but with
+    a group_key provided will store data per that group (probably user_id or similar).
+
+    Defaults to storing with a timeout of an hour
+
+    `store`/`load` are async (use them from event handlers). For displaying, use `storage_var` instead of
+    `rx.var(cache=True)`, the key vars declared in `deps` are fetched asynchronously before the (sync) var function
+    runs so that `load_prefetched` doesn't block the event loop.
+
+    Use `store_many`/`load_many` to send multiple values in a single round trip. With `batch_loads` enabled, the
+    prefetches for all `storage_var`s that recompute in the same event are also sent together as a single MGET.
+
+    With `local_cache` enabled, loaded values are kept deserialized in an in-process LRU cache so that displaying the
+    same value again only needs the (small) version of the key rather than the value and unpickling it. Each `store`
+    bumps a version counter for the key, so a read that started before a store can't overwrite the newer value in the
+    cache, and a cached value is only used while it is still the current version in redis (e.g. not replaced by
+    another worker).
+
+    Values are serialized per attr with `serializer`, and compressed with `compression` if they are larger than
+    `compression_threshold` (decompressed transparently on load).
+
+    Every stored key is also added to an index for its group (the `group_key`, or the client_token for per tab data),
+    so all data for a user or tab can be listed with `list_keys` and removed with `purge_group` without scanning the
+    keyspace (see also `purge_tabs_on_disconnect`).
+
+    Stored keys are published to the invalidation bus (if enabled, see `invalidation.enable_invalidation`), so that
+    `storage_var`s showing them in other tabs or on other workers are refreshed too.
+
+    With `storage_mode` "hash", values are stored as a redis hash of their fields instead, so that `update_fields` and
+    `load_fields` can write/read only some fields of large models. With "content", identical values are only stored
+    once (the keys just point to them).
+    """
+
+    # Collect prefetches from all storage vars recomputing at the same time into one MGET
+    batch_loads: ClassVar[bool] = True
+    # Keep deserialized values in an in-process LRU cache (expires after `timeout`, checked against the version in redis)
+    local_cache: ClassVar[bool] = True
+    # Serialized values at least this big are compressed (see `compression`)
+    compression_threshold: ClassVar[int] = 16 * 1024
+
+    def group_key(self, attr: str) -> str | None:
+        """
+        Override this method to return a key specific to user to make data available across tabs for that user
+        Otherwise will default to using the client_token (per tab)
+        """
+        return None
+
+    def timeout(self, attr: str) -> int:
+        """
+        Timeout for the data storage in redis. Override this method to set a different timeout
+        """
+        return 60 * 60 * 1
+
+    def serializer(self, attr: str) -> str:
+        """
+        Name of the serializer to store values of attr with (see `serialization.serializers`). Override this method to
+        use a different serializer (e.g. "dill" for values that don't round trip through `model_dump`).
+        Values that aren't pydantic models are always stored with dill.
+        """
+        return "json"
+
+    def compression(self, attr: str) -> str | None:
+        """
+        Name of the compressor to use for values of attr that are larger than `compression_threshold` (see
+        `compression.compressors`). Override this method to use a different compressor, or None to disable.
+        """
+        return "zlib"
+
+    def storage_mode(self, attr: str) -> Literal["value", "hash", "content"]:
+        """
+        How values of attr are stored. "value" stores the whole serialized (and maybe compressed) value, "hash" stores
+        each field of the model separately (values must be pydantic models) so that `update_fields`/`load_fields` only
+        need to send the fields involved. Override this method to use "hash" for large models that are often only
+        partially updated/displayed.
+
+        "content" stores the serialized value once under its hash (with a reference count) and only a pointer to it
+        under the key. Use it for values that are often identical across sessions/keys (e.g. defaults). A blob expires
+        with the longest lived pointer to it (each store extends its expiry to the pointer's), and is deleted earlier
+        once all pointers to it were replaced or purged. Pointers that expire by themselves don't decrement the
+        reference count, so the blob then stays until its own expiry.
+        """
+        return "value"
+
+    async def store(self, attr: str, key: str | int, value: model_type):
+        """
+        Store new value in redis for the attribute and key provided:
+        Examples:
+            self.key_a = new_key  # To set in current state
+            await self.store('key_a', self.key_a, a_inst)  # To store the actual value for retrieval by this or other states
+
+        Note: The value is also put in the local cache, so it shouldn't be modified after storing.
+        """
+        await self.store_many([(attr, key, value)])
+
+    async def load(
+        self, attr: str, key: str | int, expected_type: type[model_type] = None, default: model_type | None = None
+    ) -> model_type | None:
+        """
+        Load value from redis for the attribute and key provided:
+        Examples:
+            a = await self.load('key_a', self.key_a, A)  # Provide expected class for validation/type hinting
+
+        Returns a copy that is safe to modify (and then `store` again).
+        """
+        (loaded,) = await self.load_many([(attr, key)], expected_type, default)
+        return loaded
+
+    async def store_many(self, items: Iterable[tuple[str, str | int, model_type]]):
+        """
+        Store multiple values in a single round trip (pipelined)
+        Examples:
+            await self.store_many([('key_a', new_key_a, a_inst), ('key_b', new_key_b, b_inst)])
+        """
+        written = []
+        uncompressed_keys = []
+        # Digest of each blob stored, and the position of the previous value of its pointer key in the results
+        pointers: list[tuple[str, int]] = []
+        # Longest timeout per group index
+        index_timeouts: dict[str, int] = {}
+        now = time.time()
+        # Transaction so that the version and group index are always updated along with the value
+        async with get_redis().pipeline(transaction=True) as pipe:
+            for attr, key, value in items:
+                unique_key = self._generate_key(attr, key)
+                logger.debug(f"Storing {value} as {unique_key}")
+                timeout = self.timeout(attr)
+                storage_mode = self.storage_mode(attr)
+                if storage_mode == "hash":
+                    fields = serialization.dump_fields(value)
+                    nbytes, ratio = _payload_size(fields), None
+                    # Replace any fields of the previous value
+                    pipe.delete(unique_key)
+                    pipe.hset(unique_key, mapping=fields)
+                    pipe.expire(unique_key, timeout)
+                elif storage_mode == "content":
+                    data = serialization.dumps(value, self.serializer(attr))
+                    payload, ratio = compression.compress(data, self.compression(attr), self.compression_threshold)
+                    nbytes = len(data)
+                    digest = hashlib.sha256(payload).hexdigest()
+                    pipe.set(_blob_key(digest), payload, nx=True)
+                    pipe.incr(_refs_key(digest))
+                    # Blobs live as long as the longest lived pointer to them
+                    for blob_key in (_blob_key(digest), _refs_key(digest)):
+                        pipe.expire(blob_key, timeout, nx=True)
+                        pipe.expire(blob_key, timeout, gt=True)
+                    pointers.append((digest, len(pipe)))
+                    pipe.set(unique_key, _POINTER + digest.encode(), ex=timeout, get=True)
+                else:
+                    data = serialization.dumps(value, self.serializer(attr))
+                    payload, ratio = compression.compress(data, self.compression(attr), self.compression_threshold)
+                    nbytes = len(data)
+                    pipe.set(unique_key, payload, ex=timeout)
+                version_position = len(pipe)
+                pipe.incr(_version_key(unique_key))
+                pipe.expire(_version_key(unique_key), timeout)
+                if ratio is not None:
+                    logger.debug(f"Compressed {unique_key} from {nbytes} to {len(payload)} bytes")
+                    pipe.set(_compression_key(unique_key), f"{ratio:.3f}", ex=timeout)
+                else:
+                    uncompressed_keys.append(_compression_key(unique_key))
+                index = _index_key(self._group(attr))
+                pipe.zadd(index, {unique_key: now + timeout})
+                index_timeouts[index] = max(timeout, index_timeouts.get(index, 0))
+                written.append((unique_key, value, nbytes, timeout, version_position))
+            if uncompressed_keys:
+                # Clear any ratios from previous (compressed) values
+                pipe.delete(*uncompressed_keys)
+            for index, timeout in index_timeouts.items():
+                # The index lives as long as the longest lived key in it (NX sets a first expiry, GT only extends it)
+                pipe.expire(index, timeout, nx=True)
+                pipe.expire(index, timeout, gt=True)
+            results = await pipe.execute()
+        # Release the blobs that the replaced pointers pointed to
+        await _release_blobs(
+            [
+                old_digest
+                for digest, old_position in pointers
+                if (old_digest := _pointer_digest(results[old_position])) is not None
+            ]
+        )
+        if self.local_cache:
+            for unique_key, value, nbytes, timeout, version_position in written:
+                storage_cache.put(unique_key, value, version=results[version_position], nbytes=nbytes, ttl=timeout)
+        await invalidation.publish(
+            {unique_key: results[version_position] for unique_key, *_, version_position in written}
+        )
+
+    async def load_many(
+        self,
+        attr_keys: Iterable[tuple[str, str | int]],
+        expected_type: type[model_type] = None,
+        default: model_type | None = None,
+    ) -> list[model_type | None]:
+        """
+        Load multiple values in a single round trip (MGET)
+        Examples:
+            a, b = await self.load_many([('key_a', self.key_a), ('key_b', self.key_b)])
+
+        Returns copies that are safe to modify (and then `store` again).
+        """
+        attr_unique_keys = [(attr, self._generate_key(attr, key)) for attr, key in attr_keys]
+        loaded = await self._read_many(attr_unique_keys, batch=False)
+        return [
+            self._checked(unique_key, copy.deepcopy(loaded[unique_key]), expected_type, default)
+            for _, unique_key in attr_unique_keys
+        ]
+
+    async def update_fields(self, attr: str, key: str | int, **changes: Any) -> bool:
+        """
+        Update some fields of a value stored with `storage_mode` "hash" (only the changed fields are sent):
+        Examples:
+            await self.update_fields('key_a', self.key_a, foo=a.foo + 10, bar=a.bar - 10)
+
+        Note: The changes are not validated until the value is loaded again.
+
+        Returns:
+            False if there was no value to update
+        """
+        if self.storage_mode(attr) != "hash":
+            raise ValueError(f'update_fields needs storage_mode "hash" for {attr}')
+        unique_key = self._generate_key(attr, key)
+        timeout = self.timeout(attr)
+        index = _index_key(self._group(attr))
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hexists(unique_key, serialization.TYPE_FIELD)
+            pipe.hset(unique_key, mapping=serialization.encode_fields(changes))
+            pipe.expire(unique_key, timeout)
+            pipe.incr(_version_key(unique_key))
+            pipe.expire(_version_key(unique_key), timeout)
+            pipe.zadd(index, {unique_key: time.time() + timeout}, xx=True)
+            pipe.expire(index, timeout, nx=True)
+            pipe.expire(index, timeout, gt=True)
+            existed, _, _, version, *_ = await pipe.execute()
+        if not existed:
+            # The partial hash without a type is treated as missing (and expires after timeout)
+            logger.debug(f"No value to update for {unique_key}")
+            storage_cache.invalidate(unique_key)
+            return False
+        if self.local_cache:
+            cached = storage_cache.get(unique_key)
+            if cached is not None and storage_cache.version(unique_key) == version - 1:
+                # Cached value is the one that was updated, so can apply the same changes
+                updated = type(cached).model_validate({**cached.model_dump(), **changes})
+                storage_cache.put(
+                    unique_key, updated, version=version, nbytes=len(updated.model_dump_json()), ttl=timeout
+                )
+            else:
+                storage_cache.invalidate(unique_key)
+        await invalidation.publish({unique_key: version})
+        return True
+
+    async def load_fields(self, attr: str, key: str | int, fields: Iterable[str]) -> dict[str, Any]:
+        """
+        Load only some fields of a value (only those fields are sent if stored with `storage_mode` "hash"):
+        Examples:
+            foo = (await self.load_fields('key_a', self.key_a, ['foo']))['foo']
+
+        Returns:
+            The validated field values (empty if there is no value stored)
+        """
+        fields = list(fields)
+        unique_key = self._generate_key(attr, key)
+        cached = self.local_cache and storage_cache.version(unique_key) is not None
+        if not cached and self.storage_mode(attr) == "hash":
+            tag, *field_values = await get_redis().hmget(unique_key, [serialization.TYPE_FIELD, *fields])
+            if tag is None:
+                return {}
+            return serialization.load_field_values(tag, fields, field_values)
+        # The cached value if it is still current
+        loaded = await self.load(attr, key)
+        if loaded is None:
+            return {}
+        return {name: copy.deepcopy(getattr(loaded, name)) for name in fields}
+
+    async def compression_ratio(self, attr: str, key: str | int) -> float | None:
+        """Compression ratio (original/compressed size) of the stored value, or None if it isn't compressed"""
+        ratio = await get_redis().get(_compression_key(self._generate_key(attr, key)))
+        return float(ratio) if ratio is not None else None
+
+    def load_prefetched(
+        self, attr: str, key: str | int, expected_type: type[model_type] = None, default: model_type | None = None
+    ) -> model_type | None:
+        """
+        Sync version of `load` for use in a `storage_var` (the attr must be one of the declared deps of the var):
+        Examples:
+            @storage_var(deps=["key_a"])
+            def a(self) -> str:
+                a = self.load_prefetched('key_a', self.key_a, A)
+
+        Falls back to a blocking read if the value was not prefetched.
+        Note: The value may be shared with the local cache, so should not be modified.
+        """
+        unique_key = self._generate_key(attr, key)
+        prefetched = _prefetched.get()
+        if prefetched is not None and unique_key in prefetched:
+            loaded = prefetched[unique_key]
+        elif self.local_cache and (cached := self._cached_if_current(unique_key)) is not None:
+            loaded = cached
+        else:
+            logger.debug(f"Prefetch miss for {unique_key}, falling back to blocking load")
+            if self.storage_mode(attr) == "hash":
+                with get_sync_redis().pipeline(transaction=False) as pipe:
+                    pipe.hgetall(unique_key)
+                    pipe.get(_version_key(unique_key))
+                    data, version = pipe.execute()
+            else:
+                data, version = get_sync_redis().mget([unique_key, _version_key(unique_key)])
+                if (digest := _pointer_digest(data)) is not None:
+                    data = get_sync_redis().get(_blob_key(digest))
+                data = compression.decompress(data) if data is not None else None
+            loaded = self._deserialize(unique_key, data)
+            self._cache_loaded(attr, unique_key, loaded, data, version)
+        return self._checked(unique_key, loaded, expected_type, default)
+
+    @staticmethod
+    def _cached_if_current(unique_key: str) -> model_type | None:
+        """The locally cached value if it is still the current version in redis (blocking read of the version)"""
+        if storage_cache.version(unique_key) is None:
+            return None
+        return storage_cache.get(unique_key, version=int(get_sync_redis().get(_version_key(unique_key)) or 0))
+
+    async def _read_many(self, attr_unique_keys: list[tuple[str, str]], batch: bool) -> dict[str, model_type | None]:
+        """
+        Read from the local cache where the cached value is still the current version, and redis otherwise (the
+        versions of the cached values are fetched concurrently with the other values, in the same MGET when batched, so
+        there is only a second round trip if some cached values turn out to be stale)
+        """
+        cached, misses = [], []
+        for attr, unique_key in attr_unique_keys:
+            if self.local_cache and storage_cache.version(unique_key) is not None:
+                cached.append((attr, unique_key))
+            else:
+                misses.append((attr, unique_key))
+        versions, loaded = await asyncio.gather(
+            self._fetch_versions([unique_key for _, unique_key in cached], batch),
+            self._read_from_redis(misses, batch),
+        )
+        stale = []
+        for (attr, unique_key), version in zip(cached, versions):
+            value = storage_cache.get(unique_key, version=int(version or 0))
+            if value is not None:
+                loaded[unique_key] = value
+            else:
+                logger.debug(f"Cached {unique_key} is not the current version, loading it again")
+                stale.append((attr, unique_key))
+        if stale:
+            loaded.update(await self._read_from_redis(stale, batch))
+        return loaded
+
+    @staticmethod
+    async def _fetch_versions(unique_keys: list[str], batch: bool) -> list[bytes | None]:
+        if not unique_keys:
+            return []
+        version_keys = [_version_key(unique_key) for unique_key in unique_keys]
+        if batch:
+            return await batch_loader.get_many(version_keys)
+        return await get_redis().mget(version_keys)
+
+    async def _read_from_redis(self, misses: list[tuple[str, str]], batch: bool) -> dict[str, model_type | None]:
+        loaded = {}
+        if not misses:
+            return loaded
+        value_misses = [miss for miss in misses if self.storage_mode(miss[0]) != "hash"]
+        hash_misses = [miss for miss in misses if self.storage_mode(miss[0]) == "hash"]
+        # Values and hashes are fetched concurrently (so still only one round trip of waiting)
+        raw_values, raw_hashes = await asyncio.gather(
+            self._fetch_values([unique_key for _, unique_key in value_misses], batch),
+            self._fetch_hashes([unique_key for _, unique_key in hash_misses]),
+        )
+        for (attr, unique_key), (data, version) in zip(value_misses + hash_misses, raw_values + raw_hashes):
+            loaded[unique_key] = self._deserialize(unique_key, data)
+            self._cache_loaded(attr, unique_key, loaded[unique_key], data, version)
+        return loaded
+
+    @staticmethod
+    async def _fetch_values(unique_keys: list[str], batch: bool) -> list[tuple[bytes | None, bytes | None]]:
+        """(decompressed) payload and version of each key"""
+        if not unique_keys:
+            return []
+        # Fetch the versions along with the values so the cache knows which version it has
+        fetch_keys = [k for unique_key in unique_keys for k in (unique_key, _version_key(unique_key))]
+        logger.debug(f"Loading {fetch_keys}")
+        if batch:
+            raw = await batch_loader.get_many(fetch_keys)
+        else:
+            raw = await get_redis().mget(fetch_keys)
+        payloads = await _resolve_pointers(raw[::2])
+        return [
+            (compression.decompress(data) if data is not None else None, version)
+            for data, version in zip(payloads, raw[1::2])
+        ]
+
+    @staticmethod
+    async def _fetch_hashes(unique_keys: list[str]) -> list[tuple[dict[bytes, bytes], bytes | None]]:
+        """All fields and version of each key stored as a hash (pipelined)"""
+        if not unique_keys:
+            return []
+        logger.debug(f"Loading hashes {unique_keys}")
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for unique_key in unique_keys:
+                pipe.hgetall(unique_key)
+                pipe.get(_version_key(unique_key))
+            raw = await pipe.execute()
+        return list(zip(raw[::2], raw[1::2]))
+
+    def _cache_loaded(
+        self,
+        attr: str,
+        unique_key: str,
+        loaded: model_type | None,
+        data: bytes | dict[bytes, bytes] | None,
+        version: bytes | None,
+    ) -> None:
+        if self.local_cache and loaded is not None:
+            storage_cache.put(
+                unique_key, loaded, version=int(version or 0), nbytes=_payload_size(data), ttl=self.timeout(attr)
+            )
+
+    @staticmethod
+    def _deserialize(unique_key: str, data: bytes | dict[bytes, bytes] | None) -> model_type | None:
+        """Deserialize a payload (or the fields of a hash, empty if the key doesn't exist)"""
+        if not data:
+            logger.debug(f'No data for key "{unique_key}"')
+            return None
+        loaded = serialization.load_hash(data) if isinstance(data, dict) else serialization.loads(data)
+        logger.debug(f"Loaded {loaded} as {unique_key}")
+        return loaded
+
+    @staticmethod
+    def _checked(
+        unique_key: str, loaded: model_type | None, expected_type: type[model_type] | None, default: model_type | None
+    ) -> model_type | None:
+        if loaded is None:
+            return default
+        if expected_type:
+            if not isinstance(loaded, expected_type):
+                raise ValueError(f"Expected {expected_type}, got {type(loaded)} for {unique_key}")
+        return loaded
+
+    def _group(self: Self | rx.State, attr: str) -> str:
+        """The group_key for attr, or the client_token if data for attr is per tab"""
+        return self.group_key(attr) or self.router.session.client_token
+
+    def _generate_key(self: Self | rx.State, attr: str, key: str) -> str:
+        """Generates a unique key for the data storage in redis"""
+        return f"{self._group(attr)}:{self.get_full_name()}:{attr}:{key}"
+
+    async def prefetch(self, *attrs: str) -> dict[str, model_type | None]:
+        """Fetch the values for the current keys of the given key attrs (i.e. key is `getattr(self, attr)`)"""
+        attr_unique_keys = [(attr, self._generate_key(attr, getattr(self, attr))) for attr in attrs]
+        logger.debug(f"Prefetching {attr_unique_keys}")
+        return await self._read_many(attr_unique_keys, batch=self.batch_loads)
+
+
+def storage_var(deps: list[str], **kwargs) -> Callable[[Callable[[StorageBase], model_type]], rx.vars.ComputedVar]:
+    """
+    Cached var for displaying data stored via StorageBase. The values for the key vars in `deps` are fetched (async)
+    before the wrapped function runs, so it can use `self.load_prefetched(...)` without blocking.
+
+    Examples:
+        @storage_var(deps=["key_a"])
+        def a(self) -> str:
+            loaded = self.load_prefetched("key_a", self.key_a, A)
+    """
+
+    def decorator(fget: Callable[[StorageBase], model_type]):
+        @functools.wraps(fget)
+        async def prefetching_fget(self: StorageBase):
+            prefetched = await self.prefetch(*deps)
+            # So the var is refreshed if any of the values are stored again (see `invalidation`)
+            invalidation.invalidator.watch(
+                self.router.session.client_token, self.get_full_name(), fget.__name__, prefetched
+            )
+            token = _prefetched.set(prefetched)
+            try:
+                return fget(self)
+            finally:
+                _prefetched.reset(token)
+
+        return rx.var(cache=True, deps=deps, auto_deps=False, **kwargs)(prefetching_fget)
+
+    return decorator
+
+
+async def _resolve_pointers(payloads: list[bytes | None]) -> list[bytes | None]:
+    """Replace the pointers (of storage_mode "content" keys) with the blobs they point to (in one round trip)"""
+    digests = {digest for data in payloads if (digest := _pointer_digest(data)) is not None}
+    if not digests:
+        return payloads
+    digests = list(digests)
+    blobs = dict(zip(digests, await get_redis().mget([_blob_key(digest) for digest in digests])))
+    return [blobs[digest] if (digest := _pointer_digest(data)) is not None else data for data in payloads]
+
+
+async def _release_blobs(digests: list[str]) -> None:
+    """Decrement the reference counts of the blobs, deleting any that are no longer referenced"""
+    if not digests:
+        return
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for digest in digests:
+            pipe.decr(_refs_key(digest))
+        counts = await pipe.execute()
+    for digest, count in zip(digests, counts):
+        if count > 0:
+            continue
+        async with get_redis().pipeline(transaction=True) as pipe:
+            try:
+                # Unless it was referenced again in the meantime
+                await pipe.watch(_refs_key(digest))
+                if int(await pipe.get(_refs_key(digest)) or 0) <= 0:
+                    pipe.multi()
+                    pipe.delete(_blob_key(digest), _refs_key(digest))
+                    await pipe.execute()
+                    logger.debug(f"Deleted unreferenced blob {digest}")
+            except WatchError:
+                logger.debug(f"Blob {digest} referenced again, not deleting")
+
+
+async def list_keys(group_key: str) -> list[str]:
+    """All (unexpired) keys stored for the group (a `group_key`, or a client_token for per tab data)"""
+    index = _index_key(group_key)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        # Drop index entries for values that have expired by themselves
+        pipe.zremrangebyscore(index, "-inf", time.time())
+        pipe.zrange(index, 0, -1)
+        _, keys = await pipe.execute()
+    return [key.decode() if isinstance(key, bytes) else key for key in keys]
+
+
+async def purge_group(group_key: str, chunk_size: int = 500) -> int:
+    """
+    Delete all data stored for the group (a `group_key`, or a client_token for per tab data)
+
+    Returns:
+        The number of values deleted
+    """
+    index = _index_key(group_key)
+    members = await get_redis().zrange(index, 0, -1)
+    if not members:
+        return 0
+    keys = [key.decode() if isinstance(key, bytes) else key for key in members]
+    # Blobs pointed to by storage_mode "content" keys (MGET returns None for hashes)
+    digests = [
+        digest
+        for start in range(0, len(keys), chunk_size)
+        for data in await get_redis().mget(keys[start : start + chunk_size])
+        if (digest := _pointer_digest(data)) is not None
+    ]
+    async with get_redis().pipeline(transaction=True) as pipe:
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start : start + chunk_size]
+            pipe.delete(*chunk)
+            pipe.delete(*[_version_key(key) for key in chunk], *[_compression_key(key) for key in chunk])
+            # Only remove the purged members (anything stored in the meantime stays indexed)
+            pipe.zrem(index, *chunk)
+        results = await pipe.execute()
+    for key in keys:
+        storage_cache.invalidate(key)
+    await invalidation.publish(dict.fromkeys(keys))
+    await _release_blobs(digests)
+    deleted = sum(results[::3])
+    logger.debug(f"Purged {deleted} values for {group_key}")
+    return deleted
+
+
+_purge_tasks: set[asyncio.Task] = set()
+
+
+def purge_tabs_on_disconnect(app: rx.App, grace_period: float = 30) -> None:
+    """
+    Delete the per tab data of a client once it disconnects (instead of waiting for it to expire).
+
+    A tab keeps its client_token across page reloads, so the data is only purged if the client hasn't reconnected
+    within grace_period seconds. It may reconnect to another worker, so every connection (its first event, when the
+    client_token is known) increments a counter in redis, and the data is only purged if the counter hasn't changed
+    since the disconnected connection incremented it.
+
+    Examples:
+        app = rx.App()
+        purge_tabs_on_disconnect(app)
+    """
+
+    # Expiry of the counters (refreshed on every connect). If a connection outlasts it, the data of the tab isn't
+    # purged (a missing counter counts as a reconnect), it just expires by itself.
+    connects_ttl = 24 * 3600
+    # sid -> the value of the counter when it connected (on this worker)
+    connected_as: dict[str, int] = {}
+
+    async def purge_if_not_reconnected(namespace, token: str, connects: int | None):
+        await asyncio.sleep(grace_period)
+        if token in namespace.token_to_sid:
+            return
+        # No longer connected to this worker, so its storage_vars don't need refreshing here
+        invalidation.invalidator.unwatch_token(token)
+        current = await get_redis().get(_connects_key(token))
+        if (int(current) if current is not None else None) != connects:
+            logger.debug(f"Tab {token} reconnected (on another worker), not purging its data")
+            return
+        await purge_group(token)
+
+    def wrap_on_disconnect():
+        # The event namespace only exists once the app has been set up, so wrap it when the server starts
+        namespace = app.event_namespace
+        if namespace is None:
+            logger.warning("App has no event namespace, not purging tab data on disconnect")
+            return
+        on_disconnect, on_event = namespace.on_disconnect, namespace.on_event
+
+        @functools.wraps(on_event)
+        async def on_event_and_count_connect(sid: str, data):
+            if sid not in connected_as and isinstance(data, dict) and (token := data.get("token")):
+                async with get_redis().pipeline(transaction=True) as pipe:
+                    pipe.incr(_connects_key(token))
+                    pipe.expire(_connects_key(token), connects_ttl)
+                    connected_as[sid], _ = await pipe.execute()
+            return await on_event(sid, data)
+
+        @functools.wraps(on_disconnect)
+        def on_disconnect_and_purge(sid: str):
+            token = namespace.sid_to_token.get(sid)
+            connects = connected_as.pop(sid, None)
+            result = on_disconnect(sid)
+            if token:
+                task = asyncio.get_running_loop().create_task(purge_if_not_reconnected(namespace, token, connects))
+                _purge_tasks.add(task)
+                task.add_done_callback(_purge_tasks.discard)
+            return result
+
+        namespace.on_event = on_event_and_count_connect
+        namespace.on_disconnect = on_disconnect_and_purge
+
+    app.register_lifespan_task(wrap_on_disconnect)
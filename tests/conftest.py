@@ -21,3 +21,17 @@ def pytest_collection_modifyitems(config, items):
     for item in items:
         if "slow" in item.keywords:
             item.add_marker(skip_slow)
+
+
+@pytest.fixture
+async def repository(tmp_path):
+    """A migrated SQLite repository (in a temporary file) used by the pages for the duration of the test"""
+    from reflex_test import db
+
+    db.upgrade_schema(tmp_path / "test.db")
+    previous = db.get_repository()
+    repository = db.SQLiteRepository(tmp_path / "test.db")
+    db.set_repository(repository)
+    yield repository
+    db.set_repository(previous)
+    await repository.close()
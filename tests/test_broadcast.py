@@ -0,0 +1,573 @@
+import asyncio
+import importlib
+import json
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import reflex as rx
+import socketio
+from reflex.istate.data import RouterData
+from reflex.state import StateManagerMemory, StateUpdate
+from reflex.utils.format import json_dumps
+
+from reflex_test.broadcast import (
+    Broadcaster,
+    BroadcastMessage,
+    LocalTransport,
+    MemoryLog,
+    Outgoing,
+    PresenceDiff,
+    PresenceIndex,
+    RedisStreamLog,
+    RedisTransport,
+    SendQueues,
+    broadcaster,
+)
+from reflex_test.storage import backend
+
+importlib.import_module("reflex_test.pages.chatroom")
+# Note: `reflex_test.pages.chatroom` is shadowed by the page function of the same name
+chatroom = sys.modules["reflex_test.pages.chatroom"]
+ChatroomState = chatroom.ChatroomState
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = SimpleNamespace(
+        state_manager=StateManagerMemory(state=rx.State),
+        event_namespace=mock.AsyncMock(),
+    )
+    monkeypatch.setattr(broadcaster, "app", app)
+    monkeypatch.setattr(broadcaster, "_rooms", Broadcaster()._rooms)
+    monkeypatch.setattr(chatroom, "message_log", MemoryLog(max_entries=100))
+    monkeypatch.setattr(chatroom, "presence", PresenceIndex())
+    monkeypatch.setattr(chatroom, "paging_tokens", set())
+    return app
+
+
+def chat_substate(root: rx.State) -> rx.State:
+    return root.get_substate(ChatroomState.get_full_name().split(".")[1:])
+
+
+async def join_sessions(app, count: int) -> list[str]:
+    tokens = []
+    for i in range(count):
+        token = str(uuid.uuid4())
+        async with app.state_manager.modify_state(token) as root:
+            router_data = {"token": token, "sid": f"sid-{i}"}
+            root.router_data = router_data
+            root.router = RouterData(router_data)
+            await chat_substate(root).join_chatroom()
+        tokens.append(token)
+    return tokens
+
+
+async def test_shared_event_emitted_once_to_room(app):
+    await join_sessions(app, 3)
+    assert app.event_namespace.enter_room.await_count == 3
+    message = chatroom.Message(username="a", sent=time.time(), message="hi")
+    await chatroom.message_log.append(message)
+
+    await chatroom.broadcast_event(f"{ChatroomState.get_full_name()}.incoming_message", payload=dict(message=message))
+
+    app.event_namespace.emit.assert_awaited_once()
+    assert app.event_namespace.emit.call_args.kwargs["to"] == broadcaster.room_name(chatroom.ROOM)
+    update = app.event_namespace.emit.call_args.args[1]
+    assert update.delta[ChatroomState.get_full_name()]["messages"] == [message]
+    # No per-session processing
+    app.event_namespace.emit_update.assert_not_awaited()
+    assert broadcaster.shared_broadcasts == 1
+
+
+async def test_per_session_fallback(app):
+    tokens = await join_sessions(app, 3)
+    await chatroom.broadcast_event(f"{ChatroomState.get_full_name()}.set_usernames", payload=dict(usernames=["a"]))
+
+    app.event_namespace.emit.assert_not_awaited()
+    assert app.event_namespace.emit_update.await_count == 3
+    assert {call.kwargs["sid"] for call in app.event_namespace.emit_update.call_args_list} == {
+        "sid-0",
+        "sid-1",
+        "sid-2",
+    }
+    for token in tokens:
+        root = await app.state_manager.get_state(token)
+        assert chat_substate(root).all_usernames == ["a"]
+
+
+async def test_per_session_fallback_from_locked_state(app):
+    (token,) = await join_sessions(app, 1)
+    async with app.state_manager.modify_state(token) as root:
+        chat_state = chat_substate(root)
+        # Would deadlock if it waited for the lock held here
+        await chatroom.broadcast_event(
+            f"{ChatroomState.get_full_name()}.set_usernames", payload=dict(usernames=["b"]), from_state=chat_state
+        )
+        assert chat_state.all_usernames == ["b"]
+    app.event_namespace.emit_update.assert_awaited_once()
+
+
+async def test_concurrent_per_session_broadcasts(app):
+    tokens = await join_sessions(app, 2)
+    both_locked = asyncio.Barrier(2)
+
+    async def broadcast_from(token: str, username: str):
+        async with app.state_manager.modify_state(token) as root:
+            await both_locked.wait()
+            await chatroom.broadcast_event(
+                f"{ChatroomState.get_full_name()}.set_usernames",
+                payload=dict(usernames=[username]),
+                from_state=chat_substate(root),
+            )
+
+    # Each holds its own lock while broadcasting, so neither may wait for the other's
+    await asyncio.wait_for(asyncio.gather(broadcast_from(tokens[0], "a"), broadcast_from(tokens[1], "b")), timeout=5)
+    await asyncio.wait_for(broadcaster.join_tasks(), timeout=5)
+    assert app.event_namespace.emit_update.await_count == 4
+    for token in tokens:
+        root = await app.state_manager.get_state(token)
+        assert chat_substate(root).all_usernames in (["a"], ["b"])
+
+
+async def test_disconnected_sessions_leave_rooms(app):
+    await join_sessions(app, 2)
+    assert broadcaster.disconnected("sid-0") == [chatroom.ROOM]
+    assert list(broadcaster.sessions(chatroom.ROOM).values()) == ["sid-1"]
+    assert broadcaster.disconnected("sid-0") == []
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def message_log(request, monkeypatch):
+    if request.param == "memory":
+        return MemoryLog(max_entries=10)
+    monkeypatch.setattr(backend, "redis", backend.create_clients()[0])
+    return RedisStreamLog("test-log", encode=str.encode, decode=bytes.decode, max_entries=10)
+
+
+async def test_message_log(message_log):
+    ids = [await message_log.append(str(i)) for i in range(15)]
+    # Only the newest entries are kept
+    assert [entry for _, entry in await message_log.latest(100)] == [str(i) for i in range(5, 15)]
+    assert await message_log.latest(2) == [(ids[13], "13"), (ids[14], "14")]
+    assert [entry for _, entry in await message_log.latest(3, before=ids[10])] == ["7", "8", "9"]
+    assert [entry for _, entry in await message_log.latest(3, before=ids[6])] == ["5"]
+    assert [entry for _, entry in await message_log.between(ids[12])] == ["12", "13", "14"]
+    assert [entry for _, entry in await message_log.between(ids[8], before=ids[10])] == ["8", "9"]
+    assert [entry for _, entry in await message_log.between(ids[0], before=ids[7])] == ["5", "6"]
+
+
+async def send(app, token: str, text: str) -> None:
+    async with app.state_manager.modify_state(token) as root:
+        chat_state = chat_substate(root)
+        chat_state.current_username = "user"
+        chat_state.input_message = text
+        await chat_state.send_message()
+
+
+async def test_live_window_and_load_older(app, monkeypatch):
+    monkeypatch.setattr(chatroom, "WINDOW", 3)
+    (sender,) = await join_sessions(app, 1)
+    for i in range(5):
+        await send(app, sender, str(i))
+    (token,) = await join_sessions(app, 1)
+
+    # Every message is one emit of the (bounded) live window
+    assert app.event_namespace.emit.await_count == 5
+    window = app.event_namespace.emit.call_args.args[1].delta[ChatroomState.get_full_name()]["messages"]
+    assert [m.message for m in window] == ["2", "3", "4"]
+
+    root = await app.state_manager.get_state(token)
+    chat_state = chat_substate(root)
+    assert [m.message for m in chat_state.messages] == ["2", "3", "4"]
+    await chat_state.load_older(1)
+    assert [m.message for m in chat_state.older_messages] == ["1"]
+
+    # Messages that move out of the live window are added to the older messages of the sessions that loaded them
+    await send(app, sender, "5")
+    await send(app, sender, "6")
+    await broadcaster.join_tasks()
+    assert [m.message for m in chat_state.older_messages] == ["1", "2", "3"]
+    assert [m.message for m in chat_state.messages] == ["4", "5", "6"]
+    await chat_state.load_older(5)
+    assert [m.message for m in chat_state.older_messages] == ["0", "1", "2", "3"]
+    assert [m.message for m in chat_state.messages] == ["4", "5", "6"]
+    await chat_state.load_older(5)
+    assert [m.message for m in chat_state.older_messages] == ["0", "1", "2", "3"]
+
+    # Sessions that only show the live window aren't processed again
+    assert app.event_namespace.emit_update.await_count == 2
+    (later,) = await join_sessions(app, 1)
+    await send(app, sender, "7")
+    await send(app, sender, "8")
+    await broadcaster.join_tasks()
+    later_state = chat_substate(await app.state_manager.get_state(later))
+    assert later_state.older_messages == []
+    # Loading older messages later still includes the ones that moved out of the window since the session joined
+    await later_state.load_older(1)
+    assert [m.message for m in later_state.older_messages] == ["3", "4", "5"]
+    assert [m.message for m in later_state.messages] == ["6", "7", "8"]
+
+
+def test_presence_index():
+    presence = PresenceIndex()
+    assert presence.join("room", "t1", "") == PresenceDiff()
+    assert presence.rename("room", "t1", "a") == PresenceDiff(added=("a",))
+    assert presence.join("room", "t2", "a") == PresenceDiff()
+    assert presence.rename("room", "t2", "b") == PresenceDiff(added=("b",))
+    assert presence.rename("room", "t2", "b") == PresenceDiff()
+    assert presence.join("room", "t3", "b") == PresenceDiff()
+    assert presence.usernames("room") == ["a", "b"]
+    assert presence.rename("room", "t1", "c") == PresenceDiff(added=("c",), removed=("a",))
+    # Still used by t3
+    assert presence.leave("room", "t2") == PresenceDiff()
+    assert presence.leave("room", "t3") == PresenceDiff(removed=("b",))
+    assert presence.leave("room", "t3") == PresenceDiff()
+    assert presence.usernames("room") == ["c"]
+    assert presence.usernames("other") == []
+
+
+async def rename(app, token: str, username: str) -> None:
+    async with app.state_manager.modify_state(token) as root:
+        await chat_substate(root).username_change(username)
+
+
+async def test_presence_diffs_broadcast_once(app):
+    tokens = await join_sessions(app, 3)
+    await rename(app, tokens[0], "a")
+    await rename(app, tokens[1], "b")
+    await rename(app, tokens[2], "a")
+
+    # Only the renames that changed the usernames in the room were broadcast, each as a single room emit
+    assert app.event_namespace.emit.await_count == 2
+    update = app.event_namespace.emit.call_args.args[1]
+    assert update.delta[ChatroomState.get_full_name()]["all_usernames"] == ["a", "b"]
+    app.event_namespace.emit_update.assert_not_awaited()
+
+    broadcaster.disconnected("sid-1")
+    await broadcaster.join_tasks()
+    assert app.event_namespace.emit.await_count == 3
+    update = app.event_namespace.emit.call_args.args[1]
+    assert update.delta[ChatroomState.get_full_name()]["all_usernames"] == ["a"]
+
+    # New sessions get the current usernames when they join
+    (token,) = await join_sessions(app, 1)
+    root = await app.state_manager.get_state(token)
+    assert chat_substate(root).all_usernames == ["a"]
+
+
+def test_presence_from_other_workers():
+    presence = PresenceIndex()
+    presence.join("room", "t1", "a")
+    presence.apply("room", "worker-2", PresenceDiff(added=("a", "b")))
+    presence.apply("room", "worker-3", PresenceDiff(added=("c",)))
+    assert presence.usernames("room") == ["a", "b", "c"]
+    assert presence.local_usernames("room") == ["a"]
+    presence.apply("room", "worker-2", PresenceDiff(removed=("a", "b")))
+    presence.leave("room", "t1")
+    assert presence.usernames("room") == ["c"]
+
+
+def worker_app() -> SimpleNamespace:
+    return SimpleNamespace(state_manager=StateManagerMemory(state=rx.State), event_namespace=mock.AsyncMock())
+
+
+async def join_worker_sessions(worker: Broadcaster, count: int) -> list[str]:
+    tokens = []
+    for i in range(count):
+        token = str(uuid.uuid4())
+        async with worker.app.state_manager.modify_state(token) as root:
+            root.router_data = {"token": token, "sid": f"{worker.worker_id}-{i}"}
+            root.router = RouterData(root.router_data)
+        await worker.join(chatroom.ROOM, token, f"{worker.worker_id}-{i}")
+        tokens.append(token)
+    return tokens
+
+
+async def test_redis_transport_handles_messages_concurrently(monkeypatch):
+    monkeypatch.setattr(backend, "redis", backend.create_clients()[0])
+    transport = RedisTransport(channel="test-broadcast-concurrent")
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(message: BroadcastMessage):
+        if message.name == "slow":
+            await release.wait()
+        handled.append(message.name)
+
+    ready = asyncio.Event()
+
+    async def on_ready():
+        ready.set()
+
+    listener = asyncio.create_task(transport.listen(handler, on_ready))
+    await asyncio.wait_for(ready.wait(), timeout=1)
+    await transport.publish(BroadcastMessage(origin="worker", room="room", name="slow"))
+    await transport.publish(BroadcastMessage(origin="worker", room="room", name="fast"))
+    for _ in range(100):
+        if handled:
+            break
+        await asyncio.sleep(0.01)
+    # Not held up by the slow handler
+    assert handled == ["fast"]
+    release.set()
+    await transport.join()
+    assert handled == ["fast", "slow"]
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+
+
+async def test_received_broadcasts_delivered_in_order_per_room(monkeypatch):
+    monkeypatch.setattr(chatroom, "message_log", MemoryLog(max_entries=100))
+    monkeypatch.setattr(chatroom, "paging_tokens", set())
+    worker = Broadcaster(worker_app())
+    monkeypatch.setattr(chatroom, "broadcaster", worker)
+    await join_worker_sessions(worker, 1)
+    latest = chatroom.message_log.latest
+    slow_reads = [0.05]
+
+    async def first_read_slow(*args, **kwargs):
+        entries = await latest(*args, **kwargs)
+        if slow_reads:
+            await asyncio.sleep(slow_reads.pop())
+        return entries
+
+    monkeypatch.setattr(chatroom.message_log, "latest", first_read_slow)
+    name = f"{ChatroomState.get_full_name()}.incoming_message"
+    received = []
+    for text in ["1", "2"]:
+        message = chatroom.Message(username="a", sent=time.time(), message=text)
+        await chatroom.message_log.append(message)
+        received.append(
+            asyncio.create_task(
+                worker.receive(
+                    BroadcastMessage(origin="other", room=chatroom.ROOM, name=name, payload=dict(message=message))
+                )
+            )
+        )
+        await asyncio.sleep(0)
+    await asyncio.gather(*received)
+
+    windows = [
+        [m.message for m in call.args[1].delta[ChatroomState.get_full_name()]["messages"]]
+        for call in worker.app.event_namespace.emit.call_args_list
+    ]
+    # The newer window isn't overwritten by the older one that took longer to read
+    assert windows == [["1"], ["1", "2"]]
+
+
+@pytest.mark.parametrize("transport_type", ["local", "redis"])
+async def test_broadcast_across_workers(transport_type, monkeypatch):
+    monkeypatch.setattr(chatroom, "message_log", MemoryLog(max_entries=100))
+    if transport_type == "local":
+        transport = LocalTransport()
+    else:
+        monkeypatch.setattr(backend, "redis", backend.create_clients()[0])
+        transport = RedisTransport(channel="test-broadcast")
+    workers = [Broadcaster(worker_app(), transport=transport) for _ in range(3)]
+    listeners = [asyncio.create_task(worker.listen()) for worker in workers]
+    started = mock.AsyncMock()
+    workers[0].on_worker_started(started)
+    await asyncio.sleep(0.1)
+    tokens = {worker.worker_id: await join_worker_sessions(worker, 2) for worker in workers[:2]}
+
+    async def delivered(check):
+        for _ in range(100):
+            if check():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("Broadcast not delivered")
+
+    message = chatroom.Message(username="a", sent=time.time(), message="hi")
+    await chatroom.message_log.append(message)
+    await workers[0].broadcast_event(
+        chatroom.ROOM, f"{ChatroomState.get_full_name()}.incoming_message", payload=dict(message=message)
+    )
+    await delivered(lambda: workers[1].app.event_namespace.emit.await_count == 1)
+    # One emit to the room on each worker (the one without sessions in the room emits to an empty room)
+    for worker in workers:
+        worker.app.event_namespace.emit.assert_awaited_once()
+        update = worker.app.event_namespace.emit.call_args.args[1]
+        assert update.delta[ChatroomState.get_full_name()]["messages"] == [message]
+
+    # Per session events are processed by the worker each session is connected to
+    await workers[1].broadcast_event(
+        chatroom.ROOM, f"{ChatroomState.get_full_name()}.set_usernames", payload=dict(usernames=["a"])
+    )
+    await delivered(lambda: workers[0].app.event_namespace.emit_update.await_count == 2)
+    for worker in workers[:2]:
+        assert worker.app.event_namespace.emit_update.await_count == 2
+        for token in tokens[worker.worker_id]:
+            root = await worker.app.state_manager.get_state(token)
+            assert chat_substate(root).all_usernames == ["a"]
+
+    # Started after workers 1 and 2 (once the transport was listening)
+    if transport_type == "local":
+        assert started.await_count == 2
+    else:
+        assert started.await_count >= 1
+    for listener in listeners:
+        listener.cancel()
+
+
+class Client:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.received: list[StateUpdate] = []
+
+    async def receive(self, update: StateUpdate) -> None:
+        await asyncio.sleep(self.delay)
+        self.received.append(update)
+
+
+def update(i: int, state: str = "state") -> StateUpdate:
+    return StateUpdate(delta={state: {"value": i, f"var_{i % 2}": i}})
+
+
+async def test_slow_client_does_not_stall_others():
+    clients = {"fast": Client(), "slow": Client(delay=0.5)}
+
+    async def send(sid: str, update: StateUpdate):
+        await clients[sid].receive(update)
+
+    queues = SendQueues(send, depth=5)
+    for i in range(20):
+        for sid in clients:
+            queues.put(sid, update(i))
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.05)
+    assert len(clients["fast"].received) == 20
+    assert clients["slow"].received == []
+    # Bounded, the oldest updates were dropped
+    assert queues.depth_of("slow") == 5
+    assert queues.dropped == 14
+    assert queues.max_depth == 5
+    queues.close("slow")
+    await queues.join()
+    assert queues.stats()["sessions"] == 0
+
+
+async def test_coalesce_by_state():
+    sent = []
+
+    async def send(sid: str, outgoing: Outgoing):
+        sent.append(outgoing.update)
+
+    queues = SendQueues(send, depth=3, policy="coalesce")
+    queues.put("sid", StateUpdate(delta={"chat": {"messages": "M1"}}))
+    queues.put("sid", StateUpdate(delta={"chat": {"messages": "M2"}, "root": {"value": 2}}))
+    queues.put("sid", StateUpdate(delta={"chat": {"messages": "M3"}}))
+    # Full, merged into the last queued update (for the same states)
+    queues.put("sid", StateUpdate(delta={"chat": {"messages": "M4"}}))
+    # Full, and not for the same states as the last queued update, so the oldest is dropped
+    queues.put("sid", StateUpdate(delta={"root": {"value": 5}}))
+    await queues.join()
+    # Only merged into the last queued update, so the newest values are sent last
+    assert [u.delta for u in sent] == [
+        {"chat": {"messages": "M2"}, "root": {"value": 2}},
+        {"chat": {"messages": "M4"}},
+        {"root": {"value": 5}},
+    ]
+    assert (queues.coalesced, queues.dropped) == (1, 1)
+
+    # Nothing is merged until the queue is full
+    sent.clear()
+    for i in range(5):
+        queues.put("sid", update(i))
+    await queues.join()
+    assert [u.delta for u in sent] == [
+        {"state": {"value": 0, "var_0": 0}},
+        {"state": {"value": 1, "var_1": 1}},
+        {"state": {"value": 4, "var_0": 4, "var_1": 3}},
+    ]
+
+
+async def test_backlog_backpressure():
+    backlog = {"sid": 10}
+    sent = []
+
+    async def send(sid: str, update: StateUpdate):
+        sent.append(update)
+
+    queues = SendQueues(send, depth=3, backlog=backlog.get, max_backlog=10, backlog_poll_interval=0.01)
+    for i in range(5):
+        queues.put("sid", update(i))
+    await asyncio.sleep(0.05)
+    assert sent == [] and queues.depth_of("sid") == 3 and queues.backlog_waits > 0
+    backlog["sid"] = 0
+    await queues.join()
+    assert [outgoing.update.delta["state"]["value"] for outgoing in sent] == [2, 3, 4]
+
+
+async def test_broadcast_via_send_queues(app, monkeypatch):
+    monkeypatch.setattr(broadcaster, "send_queues", None)
+    queues = broadcaster.use_send_queues(depth=10)
+    # No socket.io server (so no backlog)
+    app.event_namespace.server = None
+    await join_sessions(app, 2)
+    release = asyncio.Event()
+
+    async def emit_update(update, sid):
+        if sid == "sid-0":
+            await release.wait()
+
+    app.event_namespace.emit_update.side_effect = emit_update
+    message = chatroom.Message(username="a", sent=time.time(), message="hi")
+    await chatroom.message_log.append(message)
+    # Doesn't wait for the (blocked) first session
+    await asyncio.wait_for(
+        chatroom.broadcast_event(f"{ChatroomState.get_full_name()}.incoming_message", payload=dict(message=message)),
+        timeout=1,
+    )
+    app.event_namespace.emit.assert_not_awaited()
+    await asyncio.sleep(0.01)
+    assert [call.kwargs["sid"] for call in app.event_namespace.emit_update.call_args_list] == ["sid-0", "sid-1"]
+    assert queues.stats()["sent"] == 1
+    release.set()
+    await queues.join()
+    assert queues.stats()["sent"] == 2
+
+
+async def test_shared_update_encoded_once_for_send_queues(app, monkeypatch):
+    monkeypatch.setattr(broadcaster, "send_queues", None)
+    queues = broadcaster.use_send_queues(depth=10)
+    sio = socketio.AsyncServer(
+        async_mode="asgi", json=SimpleNamespace(dumps=staticmethod(json_dumps), loads=staticmethod(json.loads))
+    )
+    sio.manager.eio_sid_from_sid = lambda sid, namespace: f"eio-{sid}"
+    sio._send_eio_packet = mock.AsyncMock()
+    sio.eio.sockets = {}
+    app.event_namespace.server = sio
+    app.event_namespace.namespace = "/_event"
+    await join_sessions(app, 3)
+    message = chatroom.Message(username="a", sent=time.time(), message="hi")
+    await chatroom.message_log.append(message)
+
+    with mock.patch.object(broadcaster, "_encode_packets", wraps=broadcaster._encode_packets) as encode:
+        await chatroom.broadcast_event(
+            f"{ChatroomState.get_full_name()}.incoming_message", payload=dict(message=message)
+        )
+        await queues.join()
+    encode.assert_called_once()
+    assert [call.args[0] for call in sio._send_eio_packet.call_args_list] == ["eio-sid-0", "eio-sid-1", "eio-sid-2"]
+    (pkt,) = {call.args[1] for call in sio._send_eio_packet.call_args_list}
+    assert '"hi"' in pkt.data
+
+
+async def test_send_queues_fall_back_without_socketio_internals(app, monkeypatch):
+    monkeypatch.setattr(broadcaster, "send_queues", None)
+    queues = broadcaster.use_send_queues(depth=10)
+    # e.g. a python-socketio version without the private attributes
+    app.event_namespace.server = SimpleNamespace(manager=mock.Mock())
+    app.event_namespace.namespace = "/_event"
+    await join_sessions(app, 2)
+    assert broadcaster._socket_backlog("sid-0") == 0
+
+    await broadcaster.broadcast_event(
+        chatroom.ROOM, f"{ChatroomState.get_full_name()}.set_usernames", payload=dict(usernames=["a"])
+    )
+    await queues.join()
+    assert app.event_namespace.emit_update.await_count == 2
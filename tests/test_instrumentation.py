@@ -0,0 +1,119 @@
+import asyncio
+import importlib
+import json
+import logging
+import sys
+
+import pytest
+
+from reflex_test.instrumentation import LockMetrics, lock_metrics
+
+importlib.import_module("reflex_test.pages.separation_of_display_from_processing")
+# Note: `reflex_test.pages.separation_of_display_from_processing` is shadowed by the page function of the same name
+separation = sys.modules["reflex_test.pages.separation_of_display_from_processing"]
+
+
+class FakeState:
+    """Stand in for the StateProxy of a background task (`async with` takes the lock)"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.fetched = []
+
+    @classmethod
+    def get_full_name(cls) -> str:
+        return "fake_state"
+
+    async def __aenter__(self):
+        await self.lock.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.lock.release()
+
+    async def get_state(self, state_cls):
+        self.fetched.append(state_cls)
+        return FakeFrontendVars()
+
+
+class FakeFrontendVars:
+    def update(self, **kwargs) -> separation.UpdateCounts:
+        return separation.UpdateCounts(applied=len(kwargs))
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    lock_metrics.reset()
+    yield
+    lock_metrics.reset()
+
+
+async def test_controller_blocks_and_methods(monkeypatch):
+    monkeypatch.setattr(separation.ControllerBase, "dependency_graph", separation.DependencyGraph())
+    separation.ABController.register_dependent_state(separation.FrontendVarsAState1, separation.FrontendVarBState1)
+    state = FakeState()
+    controller = separation.ABController(
+        self_state=state, frontend_state_class=separation.FrontendVarsAState1, background=True
+    )
+
+    await controller.change_background_color()
+
+    assert len(state.fetched) == 2
+    assert lock_metrics.hold.count == 1
+    # Attributed to the (timed) controller method the lock was taken in
+    stats = lock_metrics.blocks["ABController.change_background_color"]
+    assert (stats.count, stats.get_state_calls) == (1, 2)
+    assert lock_metrics.methods["ABController.change_background_color"].count == 1
+    # Nested with_self blocks don't take (or count) the lock again
+    assert lock_metrics.wait.count == 1
+
+
+async def test_wait_time_recorded():
+    state = FakeState()
+    metrics = LockMetrics()
+
+    async def hold():
+        async with metrics.locked(state, "test"):
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(hold(), hold())
+    assert metrics.hold.count == 2
+    assert metrics.wait.max >= 0.04
+    assert metrics.hold.max >= 0.04
+
+
+async def test_slow_hold_warning(caplog):
+    metrics = LockMetrics(slow_hold_threshold=0.01)
+    with caplog.at_level(logging.WARNING, logger="reflex_test.instrumentation"):
+        async with metrics.locked(FakeState(), "test"):
+            await asyncio.sleep(0.02)
+        async with metrics.locked(FakeState(), "test"):
+            pass
+    assert metrics.slow_holds == 1
+    (record,) = caplog.records
+    assert record.lock_block["call_site"].endswith("in test_slow_hold_warning")
+    assert "test_instrumentation.py" in record.lock_block["call_site"]
+    assert record.lock_block["hold_ms"] >= 20
+
+
+async def test_timed_generator_and_export(caplog):
+    metrics = LockMetrics()
+    state = FakeState()
+
+    class Counter:
+        @metrics.timed
+        async def count(self):
+            for i in range(3):
+                async with metrics.locked(state, "test"):
+                    pass
+                yield i
+
+    assert [i async for i in Counter().count()] == [0, 1, 2]
+    assert metrics.methods["test_timed_generator_and_export.<locals>.Counter.count"].count == 1
+    assert metrics.blocks["test_timed_generator_and_export.<locals>.Counter.count"].count == 3
+
+    with caplog.at_level(logging.INFO, logger="reflex_test.instrumentation"):
+        metrics.log_metrics()
+    (record,) = caplog.records
+    assert record.lock_metrics["hold"]["count"] == 3
+    assert json.loads(record.getMessage().split(": ", 1)[1]) == record.lock_metrics
@@ -0,0 +1,235 @@
+import asyncio
+import importlib
+import sqlite3
+import sys
+import threading
+import uuid
+from unittest import mock
+
+import pytest
+import reflex as rx
+from pydantic import BaseModel
+from reflex.istate.data import RouterData
+from reflex.state import _resolve_delta
+
+from reflex_test import db
+from reflex_test.db.ids import BlockIdAllocator
+
+importlib.import_module("reflex_test.pages.async_cached_var_issue")
+# Note: `reflex_test.pages.async_cached_var_issue` is shadowed by the page function of the same name
+async_cached_var_issue = sys.modules["reflex_test.pages.async_cached_var_issue"]
+
+
+class Item(BaseModel):
+    name: str
+    count: int = 0
+
+
+@pytest.fixture(autouse=True)
+def clear_record_cache():
+    async_cached_var_issue.record_cache.clear()
+
+
+async def test_save_and_load(repository):
+    first_id = await repository.save(Item(name="a", count=1))
+    second_id = await repository.save(Item(name="b"))
+    assert first_id != second_id
+    assert await repository.load(first_id) == Item(name="a", count=1)
+    assert await repository.load(second_id) == Item(name="b")
+    assert await repository.load(123) is None
+
+
+async def test_concurrent_saves_get_unique_ids(repository):
+    items = [Item(name=str(i), count=i) for i in range(50)]
+    ids = await asyncio.gather(*(repository.save(item) for item in items))
+    assert len(set(ids)) == len(items)
+    assert await repository.load_many(ids) == dict(zip(ids, items))
+
+
+async def test_save_many(repository):
+    await repository.save(Item(name="before"))
+    items = [Item(name=str(i)) for i in range(1200)]
+    ids = await repository.save_many(items)
+    assert ids == sorted(ids) and len(set(ids)) == len(items)
+    loaded = await repository.load_many([*ids, 999_999])
+    assert [loaded[record_id] for record_id in ids] == items
+    assert await repository.save_many([]) == []
+
+
+async def test_ids_not_reused_after_delete(repository):
+    record_id = await repository.save(Item(name="a"))
+    assert await repository.delete(record_id)
+    assert not await repository.delete(record_id)
+    assert await repository.save(Item(name="b")) > record_id
+
+
+async def test_wal_mode_and_event_loop_unblocked(repository, monkeypatch):
+    await repository.save(Item(name="a"))
+    connection = sqlite3.connect(repository.path)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    connection.close()
+
+    # Queries run on the pool threads, not the event loop thread
+    loop_thread = threading.get_ident()
+    query_threads = set()
+    select = db.SQLiteRepository._select
+
+    def recording_select(record_id, connection):
+        query_threads.add(threading.get_ident())
+        return select(record_id, connection)
+
+    monkeypatch.setattr(db.SQLiteRepository, "_select", staticmethod(recording_select))
+    await asyncio.gather(*(repository.load(1) for _ in range(20)))
+    assert query_threads and loop_thread not in query_threads
+    assert len(query_threads) <= repository.pool_size
+    assert repository.stats()["load"]["count"] == 20
+
+
+async def test_missing_schema(tmp_path):
+    repository = db.SQLiteRepository(tmp_path / "empty.db")
+    with pytest.raises(db.SchemaMissingError):
+        await repository.load(1)
+    await repository.close()
+
+
+async def test_async_cached_var_issue_process(repository):
+    data_id = await async_cached_var_issue.process("hello world")
+    assert await async_cached_var_issue.load_data(data_id) == async_cached_var_issue.Data(
+        attr_a="Hello World", attr_b="HELLO WORLD"
+    )
+    assert await async_cached_var_issue.load_data(data_id + 1) == async_cached_var_issue.Data(attr_a="", attr_b="")
+
+
+async def test_ids_allocated_in_blocks(repository):
+    repository.ids.block_size = 10
+    ids = await asyncio.gather(*(repository.save(Item(name=str(i))) for i in range(25)))
+    assert sorted(ids) == list(range(1, 26))
+    # A round trip per block rather than per id (concurrent tasks share a reservation)
+    assert repository.ids.reservations == 3
+
+    # A bulk save reserves everything it needs at once
+    ids = await repository.save_many([Item(name=str(i)) for i in range(100)])
+    assert len(set(ids)) == 100
+    assert repository.ids.reservations == 4
+
+
+async def test_ids_run_out_while_reservation_finishes():
+    release = asyncio.Event()
+    next_id = 1
+
+    async def reserve(name: str, count: int) -> int:
+        nonlocal next_id
+        await release.wait()
+        start, next_id = next_id, next_id + count
+        return start
+
+    allocator = BlockIdAllocator(reserve, block_size=10)
+
+    async def run_out_of_ids():
+        # Wakes up right after the reservation finished (before its done callbacks ran) and needs more than the block
+        await release.wait()
+        return await allocator.allocate_many(25)
+
+    first = asyncio.create_task(allocator.allocate_many(10))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(run_out_of_ids())
+    await asyncio.sleep(0)
+    release.set()
+    ids = await asyncio.wait_for(asyncio.gather(first, second), timeout=5)
+    all_ids = [new_id for task_ids in ids for new_id in task_ids]
+    assert sorted(all_ids) == list(range(1, 36))
+
+
+async def test_ids_unique_across_workers_and_restarts(repository):
+    workers = [db.SQLiteRepository(repository.path, id_block_size=7) for _ in range(3)]
+    ids = await asyncio.gather(*(worker.save(Item(name=str(i))) for i in range(30) for worker in workers))
+    bulk_ids = await asyncio.gather(*(worker.save_many([Item(name="bulk")] * 20) for worker in workers))
+    all_ids = [*ids, *(new_id for worker_ids in bulk_ids for new_id in worker_ids)]
+    assert len(set(all_ids)) == len(all_ids) == 150
+    for worker in workers:
+        await worker.close()
+
+    # Blocks are persisted, so a restarted worker continues after any ids handed out before
+    restarted = db.SQLiteRepository(repository.path)
+    assert await restarted.save(Item(name="after")) > max(all_ids)
+    await restarted.close()
+
+
+async def test_sequence_starts_after_existing_records(repository):
+    record_id = await repository.save(Item(name="a"))
+    connection = sqlite3.connect(repository.path)
+    with connection:
+        connection.execute("DELETE FROM id_blocks")
+    connection.close()
+    worker = db.SQLiteRepository(repository.path)
+    assert await worker.reserve_ids("records", 1) == record_id + 1
+    await worker.close()
+
+
+async def test_record_cache_single_flight_and_negative_entries():
+    records = {1: Item(name="a")}
+    loads = []
+
+    async def load(record_id):
+        loads.append(record_id)
+        await asyncio.sleep(0.01)
+        return records.get(record_id)
+
+    cache = db.RecordCache(load)
+    assert await asyncio.gather(cache.get(1), cache.get(1), cache.get(1)) == [Item(name="a")] * 3
+    assert await cache.get(1) is records[1]
+    # Misses are cached too
+    assert await asyncio.gather(cache.get(2), cache.get(2)) == [None, None]
+    assert await cache.get(2) is None
+    assert loads == [1, 2]
+    assert cache.stats()["shared_loads"] == 3
+
+    records[2] = Item(name="b")
+    cache.invalidate(2)
+    assert await cache.get(2) == Item(name="b")
+    assert loads == [1, 2, 2]
+
+
+async def test_record_cache_expiry_and_invalidation_during_load():
+    records = {1: Item(name="old")}
+    release = asyncio.Event()
+
+    async def load(record_id):
+        await release.wait()
+        return records.get(record_id)
+
+    cache = db.RecordCache(load, ttl=60, negative_ttl=0)
+    pending = asyncio.ensure_future(cache.get(1))
+    await asyncio.sleep(0)
+    records[1] = Item(name="new")
+    cache.invalidate(1)
+    release.set()
+    await pending
+    # The load that was in progress when invalidated isn't cached
+    assert await cache.get(1) == Item(name="new")
+
+    # Negative entries expire (immediately here)
+    assert await cache.get(3) is None
+    records[3] = Item(name="created")
+    assert await cache.get(3) == Item(name="created")
+
+
+async def test_cached_vars_share_one_load(repository):
+    data_id = await async_cached_var_issue.process("hello")
+    root = rx.State()
+    router_data = {"token": str(uuid.uuid4()), "sid": "sid"}
+    root.router_data = router_data
+    root.router = RouterData(router_data)
+    display = root.get_substate(async_cached_var_issue.DisplayState.get_full_name().split(".")[1:])
+
+    with mock.patch.object(repository, "load", wraps=repository.load) as load:
+        display.data_id = data_id
+        delta = await _resolve_delta(root.get_delta())
+        assert delta[display.get_full_name()]["data_a_cached"] == "Hello"
+        assert delta[display.get_full_name()]["data_b_cached"] == "HELLO"
+        assert load.call_count == 1
+
+        # Repeated misses don't load again
+        for _ in range(3):
+            assert await async_cached_var_issue.load_data(data_id + 100) == async_cached_var_issue.EMPTY_DATA
+        assert load.call_count == 2
@@ -0,0 +1,327 @@
+import asyncio
+import importlib
+import sys
+import uuid
+from unittest import mock
+
+import pytest
+import reflex as rx
+from reflex.istate.data import RouterData
+
+importlib.import_module("reflex_test.pages.separation_of_display_from_processing")
+# Note: `reflex_test.pages.separation_of_display_from_processing` is shadowed by the page function of the same name
+separation = sys.modules["reflex_test.pages.separation_of_display_from_processing"]
+ABController, ControllerBase = separation.ABController, separation.ControllerBase
+BackendVarsState1, FrontendVarsAState1, FrontendVarBState1 = (
+    separation.BackendVarsState1,
+    separation.FrontendVarsAState1,
+    separation.FrontendVarBState1,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_links(monkeypatch, repository):
+    """Don't share registered dependent states (or data) between tests"""
+    monkeypatch.setattr(ControllerBase, "dependency_graph", separation.DependencyGraph())
+
+
+@pytest.fixture
+def root_state() -> rx.State:
+    root = rx.State()
+    router_data = {"token": str(uuid.uuid4()), "sid": "sid"}
+    root.router_data = router_data
+    root.router = RouterData(router_data)
+    return root
+
+
+def get_substate(root: rx.State, state_cls: type[rx.State]) -> rx.State:
+    return root.get_substate(state_cls.get_full_name().split(".")[1:])
+
+
+async def test_update_frontend_updates_all_dependents(root_state):
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarsAState1)
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarBState1)
+    controller = ABController(
+        self_state=get_substate(root_state, BackendVarsState1), backend_state_class=BackendVarsState1
+    )
+
+    await controller.change_a()
+    bvars = get_substate(root_state, BackendVarsState1)
+    data_a = await separation.load_data(bvars.a_id)
+    assert get_substate(root_state, FrontendVarsAState1).a_repr == str(data_a)
+    assert get_substate(root_state, FrontendVarBState1).combined_as == f"<{data_a.foo}, {data_a.bar}, {data_a.baz}>"
+
+
+async def test_dependent_states_fetched_concurrently_and_once(root_state):
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarsAState1)
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarBState1)
+    self_state = get_substate(root_state, BackendVarsState1)
+    controller = ABController(
+        self_state=self_state, backend_state_class=BackendVarsState1, frontend_state_class=FrontendVarsAState1
+    )
+
+    in_flight, max_in_flight = 0, 0
+    get_state = BackendVarsState1.get_state
+
+    async def slow_get_state(state, state_cls):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return await get_state(state, state_cls)
+
+    with (
+        mock.patch.object(BackendVarsState1, "get_state", autospec=True, side_effect=slow_get_state) as patched,
+        mock.patch.object(separation.FrontendVarsA, "update", autospec=True) as update,
+    ):
+        await controller.update_frontend(a_id=5)
+    assert patched.call_count == 2
+    assert max_in_flight == 2
+    # FrontendVarsAState1 (the frontend state of the controller, and dependent on the backend state) is only updated once
+    assert update.call_count == 1
+    assert get_substate(root_state, FrontendVarBState1).a_id_copy == 5
+
+
+async def test_update_skips_unchanged_fields(root_state):
+    fvars_a = get_substate(root_state, FrontendVarsAState1)
+    fvars_b = get_substate(root_state, FrontendVarBState1)
+    data_a = separation.DataA(foo=1)
+    assert fvars_a.update(data_a=data_a, a_id=1) == separation.UpdateCounts(applied=2, skipped=0)
+    assert fvars_b.update(data_a=data_a, counting=False) == separation.UpdateCounts(applied=1, skipped=1)
+    root_state._clean()
+
+    assert fvars_a.update(data_a=separation.DataA(foo=1), a_id=1) == separation.UpdateCounts(applied=0, skipped=2)
+    assert fvars_a.dirty_vars == set()
+    assert fvars_a.update(data_a=separation.DataA(foo=2), a_id=1).applied == 1
+    assert fvars_a.dirty_vars == {"a_repr"}
+
+
+async def test_update_frontend_reports_counts(root_state):
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarsAState1)
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarBState1)
+    controller = ABController(
+        self_state=get_substate(root_state, BackendVarsState1), backend_state_class=BackendVarsState1
+    )
+    assert await controller.update_frontend(a_id=3) == separation.UpdateCounts(applied=2, skipped=0)
+    assert await controller.update_frontend(a_id=3) == separation.UpdateCounts(applied=0, skipped=2)
+
+
+class FrontendVarsAState3(separation.FrontendVarsA, rx.State):
+    pass
+
+
+def test_dependency_graph_plan():
+    graph = separation.DependencyGraph()
+    assert graph.register(BackendVarsState1, FrontendVarsAState1)
+    assert not graph.register(BackendVarsState1, FrontendVarsAState1)
+    graph.register(FrontendVarsAState1, FrontendVarBState1)
+    graph.register(BackendVarsState1, FrontendVarsAState3)
+    graph.register(FrontendVarsAState3, FrontendVarBState1)
+
+    plan = graph.plan(BackendVarsState1)
+    assert plan == (FrontendVarsAState1, FrontendVarsAState3, FrontendVarBState1)
+    assert graph.plan(BackendVarsState1) is plan
+    assert graph.plan(FrontendVarsAState1) == (FrontendVarBState1,)
+    # Sources are left out (they are updated directly)
+    assert graph.plan(BackendVarsState1, FrontendVarsAState1) == (FrontendVarsAState3, FrontendVarBState1)
+
+    with pytest.raises(ValueError, match="cycle"):
+        graph.register(FrontendVarBState1, BackendVarsState1)
+    with pytest.raises(ValueError, match="cycle"):
+        graph.register(FrontendVarsAState1, FrontendVarsAState1)
+
+
+async def test_update_frontend_propagates_transitively(root_state):
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarsAState1)
+    ABController.register_dependent_state(FrontendVarsAState1, FrontendVarBState1)
+    controller = ABController(
+        self_state=get_substate(root_state, BackendVarsState1), backend_state_class=BackendVarsState1
+    )
+    await controller.update_frontend(b_id=4)
+    assert get_substate(root_state, FrontendVarBState1).b_id_copy == 4
+
+
+async def test_coalesced_updates(root_state):
+    controller = ABController(
+        self_state=get_substate(root_state, FrontendVarBState1), frontend_state_class=FrontendVarBState1
+    )
+    with mock.patch.object(controller, "update_frontend", wraps=controller.update_frontend) as update_frontend:
+        async with separation.CoalescedUpdates(controller, frame_interval=60) as updates:
+            for i in range(1, 101):
+                await updates.update(count=i, a_id=i % 2)
+    # First update is sent immediately, the rest are merged and sent on exit
+    assert update_frontend.call_count == 2
+    assert update_frontend.call_args.kwargs == {"count": 100, "a_id": 0}
+    assert updates.flushes == 2
+    assert get_substate(root_state, FrontendVarBState1).count == 100
+
+
+async def test_coalesced_updates_trailing_flush(root_state):
+    controller = ABController(
+        self_state=get_substate(root_state, FrontendVarBState1), frontend_state_class=FrontendVarBState1
+    )
+    async with separation.CoalescedUpdates(controller, frame_interval=0.05) as updates:
+        assert await updates.update(count=1)
+        assert not await updates.update(count=2)
+        # Sent at the end of the frame without waiting for another update (or the exit)
+        await asyncio.sleep(0.1)
+        assert updates.flushes == 2
+        assert get_substate(root_state, FrontendVarBState1).count == 2
+
+
+async def test_coalesced_updates_slow_flushes_dont_overlap(root_state):
+    controller = ABController(
+        self_state=get_substate(root_state, FrontendVarBState1),
+        frontend_state_class=FrontendVarBState1,
+        background=True,
+    )
+    in_flight, max_in_flight = 0, 0
+
+    async def slow_update_frontend(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.08)
+        in_flight -= 1
+        return separation.UpdateCounts()
+
+    with (
+        mock.patch.object(controller, "update_frontend", side_effect=slow_update_frontend) as update_frontend,
+        mock.patch.object(rx.State, "__aenter__", autospec=True, side_effect=lambda state: state),
+        mock.patch.object(rx.State, "__aexit__", autospec=True),
+    ):
+        async with separation.CoalescedUpdates(controller, frame_interval=0.05) as updates:
+            # Updates keep arriving (from other tasks) while a flush is applying
+            producers = []
+            for i in range(100):
+                producers.append(asyncio.create_task(updates.update(count=i)))
+                await asyncio.sleep(0.003)
+            await asyncio.gather(*producers)
+    assert update_frontend.call_count > 2
+    assert max_in_flight == 1
+    assert update_frontend.call_args.kwargs == {"count": 99}
+
+
+async def test_counting_coalesced_and_stops(root_state):
+    fvars = get_substate(root_state, FrontendVarBState1)
+    controller = ABController(self_state=fvars, frontend_state_class=FrontendVarBState1)
+    flushes = 0
+    with mock.patch.object(controller, "get_fvars") as get_fvars:
+        async for _ in controller.start_counting_background(step_interval=0.001, frame_interval=0.02):
+            flushes += 1
+            if flushes == 3:
+                # Any controller for the same states can stop it
+                await ABController(self_state=fvars, frontend_state_class=FrontendVarBState1).stop_counting()
+    assert not fvars.counting
+    # Many more steps than flushes
+    assert fvars.count > flushes * 3
+    # Stop signal is awaited rather than polling the state
+    assert get_fvars.call_count == 0
+    assert separation.stop_signals._events == {}
+
+
+async def test_stop_waits_are_interrupted(root_state):
+    fvars = get_substate(root_state, FrontendVarBState1)
+    controller = ABController(self_state=fvars, frontend_state_class=FrontendVarBState1)
+    counting = controller.start_counting_background(step_interval=60)
+    await anext(counting)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    loop.call_soon(lambda: asyncio.ensure_future(controller.stop_counting()))
+    async for _ in counting:
+        pass
+    assert loop.time() - start < 1
+
+
+async def test_stop_signal_shared_by_loops_with_same_key():
+    signals = separation.StopSignals()
+    first, second = signals.event("token", "name"), signals.event("token", "name")
+    assert first is second
+    # The first loop ending (e.g. cancelled) doesn't stop the second from receiving the stop
+    signals.discard("token", "name")
+    await signals.stop("token", "name")
+    assert second.is_set()
+    signals.discard("token", "name")
+    assert signals._events == {}
+
+
+async def test_stop_signals_relayed_between_workers():
+    worker_1, worker_2 = separation.StopSignals(), separation.StopSignals()
+    relays = [asyncio.create_task(worker.relay_via_redis()) for worker in (worker_1, worker_2)]
+    while not (worker_1._relaying and worker_2._relaying):
+        await asyncio.sleep(0.01)
+    stop = worker_2.event("token", "name")
+    await worker_1.stop("token", "name")
+    await asyncio.wait_for(stop.wait(), timeout=1)
+    for relay in relays:
+        relay.cancel()
+
+
+async def test_identity_map_within_event(root_state, repository):
+    bvars = get_substate(root_state, BackendVarsState1)
+    await bvars.store(data_a=separation.DataA(foo=1), data_b=separation.DataB(fe="x"))
+
+    with mock.patch.object(repository, "load", wraps=repository.load) as load:
+        with separation.IdentityMap.scope() as identity_map:
+            loaded = await asyncio.gather(*(bvars.load(separation.DataA) for _ in range(3)))
+            assert loaded[0] == separation.DataA(foo=1)
+            assert all(data is loaded[0] for data in loaded)
+            assert await bvars.load(separation.DataB) is await bvars.load(separation.DataB)
+            with separation.IdentityMap.scope() as nested:
+                assert nested is identity_map
+                assert await bvars.load(separation.DataA) is loaded[0]
+            # Stores write through
+            new_a = separation.DataA(foo=2)
+            await bvars.store(data_a=new_a)
+            assert await bvars.load(separation.DataA) is new_a
+        assert load.call_count == 2
+        assert (identity_map.misses, identity_map.hits) == (2, 5)
+
+        # Discarded at the end of the event
+        assert separation.IdentityMap.current() is None
+        assert await bvars.load(separation.DataA) == new_a
+        assert load.call_count == 3
+
+
+async def test_controller_methods_event_scoped(root_state):
+    controller = ABController(
+        self_state=get_substate(root_state, BackendVarsState1), backend_state_class=BackendVarsState1
+    )
+    identity_maps = []
+
+    async def update_frontend(**kwargs):
+        identity_maps.append(separation.IdentityMap.current())
+        bvars = await controller.get_bvars()
+        assert await bvars.load(separation.DataA) is kwargs["data_a"]
+
+    with mock.patch.object(controller, "update_frontend", side_effect=update_frontend):
+        await controller.change_a()
+        await controller.change_a()
+    assert None not in identity_maps and identity_maps[0] is not identity_maps[1]
+    assert separation.IdentityMap.current() is None
+
+
+async def test_update_reloads_via_identity_map(root_state, repository, monkeypatch):
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarsAState1)
+    ABController.register_dependent_state(BackendVarsState1, FrontendVarBState1)
+    controller = ABController(
+        self_state=get_substate(root_state, BackendVarsState1), backend_state_class=BackendVarsState1
+    )
+    await get_substate(root_state, BackendVarsState1).store(
+        data_a=separation.DataA(foo=1), data_b=separation.DataB(fe="x")
+    )
+
+    # Looked up when loading, so replacing load_data applies to the identity map too
+    load_data = mock.AsyncMock(wraps=separation.load_data)
+    monkeypatch.setattr(separation, "load_data", load_data)
+    await controller.update_a()
+    # A is loaded to change it, and shown from the identity map after it was stored (only B is loaded again)
+    assert load_data.await_count == 2
+    bvars = get_substate(root_state, BackendVarsState1)
+    assert await separation.load_data(bvars.a_id) == separation.DataA(foo=2)
+    assert get_substate(root_state, FrontendVarsAState1).a_repr == str(separation.DataA(foo=2))
+    assert get_substate(root_state, FrontendVarBState1).combined_bs == "<x, , >"
+
+    await controller.update_b()
+    assert get_substate(root_state, FrontendVarBState1).combined_bs == "<x+, , >"
@@ -0,0 +1,519 @@
+import asyncio
+import importlib
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import dill
+import pytest
+import reflex as rx
+from reflex.istate.data import RouterData
+from reflex.state import StateManagerMemory, _resolve_delta
+from reflex.vars.base import AsyncComputedVar
+
+from reflex_test.storage import (
+    LRUCache,
+    StorageBase,
+    backend,
+    compression,
+    invalidation,
+    list_keys,
+    purge_group,
+    purge_tabs_on_disconnect,
+    serialization,
+    storage_cache,
+)
+
+importlib.import_module("reflex_test.pages.redis_mixin_testing")
+# Note: `reflex_test.pages.redis_mixin_testing` is shadowed by the page function of the same name
+redis_mixin_testing = sys.modules["reflex_test.pages.redis_mixin_testing"]
+A, B, A1, B1 = redis_mixin_testing.A, redis_mixin_testing.B, redis_mixin_testing.A1, redis_mixin_testing.B1
+
+
+@pytest.fixture(autouse=True)
+def fresh_redis():
+    """Use a new fakeredis server for each test"""
+    old_clients = backend.get_redis(), backend.get_sync_redis()
+    clients = backend.create_clients()
+    backend.set_clients(*clients)
+    storage_cache.clear()
+    storage_cache.reset_stats()
+    yield clients
+    backend.set_clients(*old_clients)
+    storage_cache.clear()
+
+
+@pytest.fixture
+def root_state() -> rx.State:
+    root = rx.State()
+    router_data = {"token": str(uuid.uuid4()), "sid": "sid"}
+    root.router_data = router_data
+    root.router = RouterData(router_data)
+    return root
+
+
+def get_substate(root: rx.State, state_cls: type[rx.State]) -> rx.State:
+    return root.get_substate(state_cls.get_full_name().split(".")[1:])
+
+
+def test_storage_var_is_async_cached():
+    a_var = A1.computed_vars["a"]
+    assert isinstance(a_var, AsyncComputedVar)
+    assert a_var._cache
+
+
+async def test_store_load(root_state):
+    state = get_substate(root_state, A1)
+    await state.store("key_a", 5, A(foo=5))
+    assert await state.load("key_a", 5, A) == A(foo=5)
+    assert await state.load("key_a", 6, A) is None
+    with pytest.raises(ValueError):
+        await state.load("key_a", 5, B)
+
+
+async def test_storage_var_prefetches_without_blocking(root_state, fresh_redis):
+    """Cached vars should be recomputed from the async prefetched values (never touching the sync client)"""
+    _, sync_client = fresh_redis
+    sync_client.get = mock.Mock(side_effect=AssertionError("Blocking read"))
+    a1 = get_substate(root_state, A1)
+    await _resolve_delta(root_state.get_delta())
+    root_state._clean()
+
+    await a1.handle_change_a()
+    delta = await _resolve_delta(root_state.get_delta())
+    root_state._clean()
+
+    stored = await a1.load("key_a", a1.key_a, A)
+    assert delta[A1.get_full_name()]["a"] == stored.model_dump_json(indent=2)
+    assert delta[B1.get_full_name()]["a"] == stored.model_dump_json(indent=2).upper()
+
+
+async def test_update_a(root_state):
+    b1 = get_substate(root_state, B1)
+    await b1.store("key_a", b1.key_a, A(foo=1, bar=2, baz=3))
+    await b1.update_a()
+    assert await b1.load("key_a", b1.key_a, A) == A(foo=11, bar=-8, baz=6)
+
+
+async def test_load_prefetched_falls_back_to_sync(root_state):
+    a1 = get_substate(root_state, A1)
+    await a1.store("key_b", 2, B(fe="x"))
+    assert a1.load_prefetched("key_b", 2, B) == B(fe="x")
+
+
+async def test_store_many_load_many(root_state):
+    a1 = get_substate(root_state, A1)
+    await a1.store_many([("key_a", 1, A(foo=1)), ("key_b", 1, B(fe="x"))])
+    assert await a1.load_many([("key_a", 1), ("key_b", 1), ("key_a", 2)]) == [A(foo=1), B(fe="x"), None]
+
+
+async def test_storage_vars_batched_into_one_round_trip(root_state, fresh_redis, monkeypatch):
+    """All storage vars recomputing in one event should be loaded with a single MGET"""
+    async_client, _ = fresh_redis
+    monkeypatch.setattr(StorageBase, "local_cache", False)
+    a1, a2 = get_substate(root_state, A1), get_substate(root_state, redis_mixin_testing.A2)
+    await _resolve_delta(root_state.get_delta())
+    root_state._clean()
+
+    await a1.handle_change_both()
+    await a2.handle_change_both()
+    with mock.patch.object(async_client, "mget", wraps=async_client.mget) as mget:
+        delta = await _resolve_delta(root_state.get_delta())
+    assert mget.call_count == 1
+    # A1.a, A1.b, B1.a, B1.b, A2.a, A2.b (B1 shares the keys of A1), each with its version
+    assert len(mget.call_args.args[0]) == 4 * 2
+    assert delta[A1.get_full_name()]["b"] == (await a1.load("key_b", a1.key_b, B)).model_dump_json(indent=2)
+
+
+async def test_local_cache_avoids_round_trips(root_state, fresh_redis):
+    async_client, _ = fresh_redis
+    b1 = get_substate(root_state, B1)
+    await b1.store("key_a", 1, A(foo=1))
+    storage_cache.clear()
+
+    with mock.patch.object(async_client, "mget", wraps=async_client.mget) as mget:
+        assert list((await b1.prefetch("key_a")).values()) == [None]
+        b1.key_a = 1
+        for _ in range(3):
+            assert list((await b1.prefetch("key_a")).values()) == [A(foo=1)]
+    # The missing key_a=0 is not cached, key_a=1 is loaded once and then only its version is fetched
+    assert mget.call_count == 4
+    assert storage_cache.hits == 2
+    (unique_key,) = await b1.prefetch("key_a")
+    assert mget.call_args.args[0] == [f"{unique_key}:version"]
+
+    # Loaded values are copies (modifying them doesn't change the cached value until stored)
+    loaded = await b1.load("key_a", 1, A)
+    loaded.foo = 100
+    assert list((await b1.prefetch("key_a")).values()) == [A(foo=1)]
+    await b1.update_a()
+    assert list((await b1.prefetch("key_a")).values()) == [A(foo=11, bar=0, baz=40)]
+
+
+async def test_local_cache_checks_current_version(root_state):
+    b1 = get_substate(root_state, B1)
+    b1.key_a = 1
+    await b1.store("key_a", 1, A(foo=1))
+    (unique_key,) = await b1.prefetch("key_a")
+    # Another worker stores a newer value (this worker's cache still has the old one)
+    await b1.store("key_a", 1, A(foo=2))
+    storage_cache.invalidate(unique_key)
+    storage_cache.put(unique_key, A(foo=1), version=1, nbytes=10, ttl=60)
+
+    assert list((await b1.prefetch("key_a")).values()) == [A(foo=2)]
+    assert storage_cache.version(unique_key) == 2
+    storage_cache.invalidate(unique_key)
+    storage_cache.put(unique_key, A(foo=1), version=1, nbytes=10, ttl=60)
+    assert b1.load_prefetched("key_a", 1, A) == A(foo=2)
+    storage_cache.invalidate(unique_key)
+    storage_cache.put(unique_key, A(foo=1), version=1, nbytes=10, ttl=60)
+    assert await b1.load_fields("key_a", 1, ["foo"]) == {"foo": 2}
+
+
+def test_lru_cache_limits_and_versions():
+    cache = LRUCache(max_items=2, max_bytes=100)
+    cache.put("a", "a", version=1, nbytes=10, ttl=60)
+    cache.put("b", "b", version=1, nbytes=10, ttl=60)
+    assert cache.get("a") == "a"
+    cache.put("c", "c", version=1, nbytes=10, ttl=60)
+    # "b" was least recently used
+    assert cache.get("b") is None
+    cache.put("d", "d", version=1, nbytes=90, ttl=60)
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 2, "items": 2, "bytes": 100}
+
+    # Older versions don't replace newer ones
+    cache.put("d", "old d", version=0, nbytes=10, ttl=60)
+    assert cache.get("d") == "d"
+
+    cache.put("e", "e", version=1, nbytes=10, ttl=0)
+    assert cache.get("e") is None
+
+
+@pytest.mark.parametrize("serializer_name", list(serialization.serializers))
+def test_serializers_round_trip(serializer_name):
+    for value in [A(foo=1), B(fe="x"), {"not": "a model"}]:
+        assert serialization.loads(serialization.dumps(value, serializer_name)) == value
+
+
+def test_legacy_dill_payloads_readable():
+    assert serialization.loads(dill.dumps(A(foo=3), byref=True)) == A(foo=3)
+
+
+def test_schema_version_migration(monkeypatch):
+    data = serialization.dumps(B(fe="old"), "json")
+    monkeypatch.setattr(B, "schema_version", 2, raising=False)
+    monkeypatch.setattr(
+        B,
+        "migrate_schema",
+        classmethod(lambda cls, d, from_version: {**d, "fi": f"from v{from_version}"}),
+        raising=False,
+    )
+    assert serialization.loads(data) == B(fe="old", fi="from v0")
+
+
+class DillForBStorage(redis_mixin_testing.ABStorageMixin, rx.State):
+    def serializer(self, attr: str) -> str:
+        return "dill" if attr == "key_b" else "json"
+
+
+async def test_serializer_per_attr(root_state, fresh_redis):
+    _, sync_client = fresh_redis
+    state = get_substate(root_state, DillForBStorage)
+    await state.store_many([("key_a", 1, A()), ("key_b", 1, B())])
+    storage_cache.clear()
+    assert sync_client.get(state._generate_key("key_a", 1))[:1] == b"J"
+    assert sync_client.get(state._generate_key("key_b", 1))[:1] == b"\x80"
+    assert await state.load_many([("key_a", 1), ("key_b", 1)]) == [A(), B()]
+
+
+@pytest.mark.parametrize("compressor_name", list(compression.compressors))
+def test_compression_round_trip(compressor_name):
+    data = b"some repetitive data " * 1000
+    payload, ratio = compression.compress(data, compressor_name, threshold=1024)
+    assert payload[:1] == compression.compressors[compressor_name].codec_id
+    assert ratio > 10
+    assert compression.decompress(payload) == data
+
+    small = b"small"
+    assert compression.compress(small, compressor_name, threshold=1024) == (small, None)
+    assert compression.decompress(small) == small
+
+
+async def test_large_values_compressed(root_state, fresh_redis):
+    _, sync_client = fresh_redis
+    state = get_substate(root_state, DillForBStorage)
+    large_b = B(fe="fe" * 50_000)
+    await state.store_many([("key_a", 1, A()), ("key_b", 1, large_b)])
+    storage_cache.clear()
+
+    assert await state.compression_ratio("key_a", 1) is None
+    assert await state.compression_ratio("key_b", 1) > 100
+    assert len(sync_client.get(state._generate_key("key_b", 1))) < 10_000
+    assert await state.load_many([("key_a", 1), ("key_b", 1)]) == [A(), large_b]
+
+    # Ratio is cleared if the value is no longer compressed
+    await state.store("key_b", 1, B())
+    assert await state.compression_ratio("key_b", 1) is None
+
+
+class UserGroupStorage(redis_mixin_testing.ABStorageMixin, rx.State):
+    def group_key(self, attr: str) -> str | None:
+        return "user-1" if attr == "key_a" else None
+
+
+async def test_group_index_list_and_purge(root_state):
+    state = get_substate(root_state, UserGroupStorage)
+    token = root_state.router.session.client_token
+    await state.store_many([("key_a", 1, A()), ("key_a", 2, A()), ("key_b", 1, B())])
+    assert sorted(await list_keys("user-1")) == [state._generate_key("key_a", 1), state._generate_key("key_a", 2)]
+    assert await list_keys(token) == [state._generate_key("key_b", 1)]
+
+    assert await purge_group(token) == 1
+    assert await list_keys(token) == []
+    assert await state.load("key_b", 1) is None
+    # Other groups are untouched
+    assert await state.load("key_a", 1) == A()
+    assert await purge_group("user-1") == 2
+    assert await purge_group("user-1") == 0
+
+
+async def test_expired_keys_dropped_from_index(root_state, monkeypatch):
+    state = get_substate(root_state, UserGroupStorage)
+    await state.store("key_a", 1, A())
+    monkeypatch.setattr(time, "time", lambda: float("inf"))
+    assert await list_keys("user-1") == []
+
+
+def tab_worker(grace_period: float) -> SimpleNamespace:
+    """Event namespace of a worker that purges tab data on disconnect"""
+    namespace = SimpleNamespace(sid_to_token={}, token_to_sid={})
+
+    async def on_event(sid, data):
+        namespace.sid_to_token[sid], namespace.token_to_sid[data["token"]] = data["token"], sid
+
+    namespace.on_event = on_event
+    namespace.on_disconnect = lambda sid: namespace.token_to_sid.pop(namespace.sid_to_token.pop(sid))
+    lifespan_tasks = []
+    app = SimpleNamespace(event_namespace=namespace, register_lifespan_task=lifespan_tasks.append)
+    purge_tabs_on_disconnect(app, grace_period=grace_period)
+    for task in lifespan_tasks:
+        task()
+    return namespace
+
+
+async def test_purge_tabs_on_disconnect(root_state, monkeypatch):
+    monkeypatch.setattr(invalidation.invalidator, "app", SimpleNamespace())
+    state = get_substate(root_state, UserGroupStorage)
+    token = root_state.router.session.client_token
+    await state.store("key_b", 1, B())
+    namespace = tab_worker(grace_period=0)
+    await namespace.on_event("sid", {"token": token})
+    invalidation.invalidator.watch(token, "state", "var", ["key"])
+
+    namespace.on_disconnect("sid")
+    await asyncio.sleep(0.01)
+    assert await state.load("key_b", 1) is None
+    assert invalidation.invalidator.watchers("key") == set()
+
+
+async def test_tab_reconnected_to_other_worker_not_purged(root_state, monkeypatch):
+    monkeypatch.setattr(invalidation.invalidator, "app", SimpleNamespace())
+    state = get_substate(root_state, UserGroupStorage)
+    token = root_state.router.session.client_token
+    await state.store("key_b", 1, B())
+    worker_1, worker_2 = tab_worker(grace_period=0.05), tab_worker(grace_period=0.05)
+    await worker_1.on_event("sid-1", {"token": token})
+    invalidation.invalidator.watch(token, "state", "var", ["key"])
+
+    worker_1.on_disconnect("sid-1")
+    await worker_2.on_event("sid-2", {"token": token})
+    await asyncio.sleep(0.1)
+    assert await state.load("key_b", 1) == B()
+    # Not watched by the worker it disconnected from anymore
+    assert invalidation.invalidator.watchers("key") == set()
+
+    # Purged once it disconnected from the other worker too
+    worker_2.on_disconnect("sid-2")
+    await asyncio.sleep(0.1)
+    assert await state.load("key_b", 1) is None
+
+
+class HashStorage(redis_mixin_testing.ABStorageMixin, rx.State):
+    def storage_mode(self, attr: str) -> str:
+        return "hash" if attr == "key_a" else "value"
+
+
+async def test_hash_storage_round_trip(root_state, fresh_redis):
+    _, sync_client = fresh_redis
+    state = get_substate(root_state, HashStorage)
+    await state.store_many([("key_a", 1, A(foo=1)), ("key_b", 1, B(fe="x"))])
+    assert sync_client.hget(state._generate_key("key_a", 1), "foo") == b"1"
+    storage_cache.clear()
+    assert await state.load_many([("key_a", 1), ("key_b", 1), ("key_a", 2)]) == [A(foo=1), B(fe="x"), None]
+    storage_cache.clear()
+    assert state.load_prefetched("key_a", 1, A) == A(foo=1)
+
+
+async def test_update_and_load_fields(root_state, fresh_redis):
+    async_client, _ = fresh_redis
+    state = get_substate(root_state, HashStorage)
+    await state.store("key_a", 1, A(foo=1))
+
+    with mock.patch.object(async_client, "hgetall", wraps=async_client.hgetall) as hgetall:
+        assert await state.update_fields("key_a", 1, foo=5, baz=7)
+        # Cached value is updated along with the stored fields
+        assert await state.load("key_a", 1) == A(foo=5, baz=7)
+    assert hgetall.call_count == 0
+
+    storage_cache.clear()
+    assert await state.load_fields("key_a", 1, ["foo", "bar"]) == {"foo": 5, "bar": 10}
+    assert await state.load("key_a", 1) == A(foo=5, baz=7)
+
+    assert not await state.update_fields("key_a", 2, foo=5)
+    assert await state.load("key_a", 2) is None
+    assert await state.load_fields("key_a", 2, ["foo"]) == {}
+    # Value mode attrs can still be partially loaded (the whole value is loaded)
+    await state.store("key_b", 1, B(fe="x"))
+    assert await state.load_fields("key_b", 1, ["fe"]) == {"fe": "x"}
+    with pytest.raises(ValueError):
+        await state.update_fields("key_b", 1, fe="y")
+
+
+@pytest.fixture
+def invalidation_app():
+    """App with an in-memory invalidation bus (and a memory state manager)"""
+    token = str(uuid.uuid4())
+    app = SimpleNamespace(
+        state_manager=StateManagerMemory(state=rx.State),
+        event_namespace=SimpleNamespace(token_to_sid={token: "sid"}, emit_update=mock.AsyncMock()),
+        register_lifespan_task=mock.Mock(),
+    )
+    bus = invalidation.enable_invalidation(app, invalidation.LocalBus())
+    yield app, bus, token
+    invalidation.disable_invalidation()
+
+
+async def test_store_refreshes_storage_vars_of_other_states(invalidation_app):
+    app, bus, token = invalidation_app
+    await bus.listen(invalidation.invalidator.handle)
+    async with app.state_manager.modify_state(token) as root:
+        root.router = RouterData({"token": token, "sid": "sid"})
+        await _resolve_delta(root.get_delta())
+        root._clean()
+        b1 = get_substate(root, B1)
+        b1.key_a = 1
+        await b1.store("key_a", 1, A(foo=1))
+        await _resolve_delta(root.get_delta())
+        root._clean()
+
+    # Stores the same key (so no key var changes), the displayed values should still be refreshed
+    await b1.update_a()
+    await bus.join()
+    update = app.event_namespace.emit_update.call_args.kwargs["update"]
+    expected = A(foo=11, bar=0, baz=40).model_dump_json(indent=2)
+    assert update.delta[A1.get_full_name()]["a"] == expected
+    assert update.delta[B1.get_full_name()]["a"] == expected.upper()
+
+
+async def test_invalidation_drops_stale_cache_entries():
+    storage_cache.put("key", "old", version=1, nbytes=1, ttl=60)
+    await invalidation.invalidator.handle(invalidation.Invalidation({"key": 1}))
+    assert storage_cache.get("key") == "old"
+    await invalidation.invalidator.handle(invalidation.Invalidation({"key": 2}, origin="other worker"))
+    assert storage_cache.get("key") is None
+    assert invalidation.Invalidation.decode(invalidation.Invalidation({"key": None}).encode()).versions == {"key": None}
+
+
+async def test_redis_bus_handles_invalidations_concurrently():
+    bus = invalidation.RedisBus(channel="test-invalidation")
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(received: invalidation.Invalidation):
+        if "slow" in received.versions:
+            await release.wait()
+        handled.append(received.versions)
+
+    listener = asyncio.create_task(bus.listen(handler))
+    await asyncio.sleep(0.05)
+    await bus.publish(invalidation.Invalidation({"slow": 1}))
+    await bus.publish(invalidation.Invalidation({"fast": 1}))
+    for _ in range(100):
+        if handled:
+            break
+        await asyncio.sleep(0.01)
+    # Not held up by the slow handler
+    assert handled == [{"fast": 1}]
+    release.set()
+    await bus.join()
+    assert handled == [{"fast": 1}, {"slow": 1}]
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+
+
+class ContentStorage(redis_mixin_testing.ABStorageMixin, rx.State):
+    def storage_mode(self, attr: str) -> str:
+        return "content"
+
+
+async def test_content_addressed_storage(fresh_redis):
+    async_client, sync_client = fresh_redis
+    states = []
+    for _ in range(3):
+        root = rx.State()
+        root.router = RouterData({"token": str(uuid.uuid4()), "sid": "sid"})
+        states.append(get_substate(root, ContentStorage))
+    large_b = B(fe="fe" * 50_000)
+    for state in states:
+        await state.store_many([("key_a", 1, A()), ("key_b", 1, large_b)])
+    # One blob per distinct value
+    blob_keys = sync_client.keys("storage-blob:*[^s]")
+    assert len(blob_keys) == 2
+    assert all(int(sync_client.get(blob_key + b":refs")) == 3 for blob_key in blob_keys)
+
+    storage_cache.clear()
+    with mock.patch.object(async_client, "mget", wraps=async_client.mget) as mget:
+        assert await states[0].load_many([("key_a", 1), ("key_b", 1), ("key_a", 2)]) == [A(), large_b, None]
+    # Pointers (and versions), then both blobs
+    assert mget.call_count == 2
+    storage_cache.clear()
+    assert states[1].load_prefetched("key_b", 1, B) == large_b
+
+    # Re-storing the same value doesn't change the reference count
+    await states[0].store("key_a", 1, A())
+    assert int(sync_client.get(blob_keys[0] + b":refs")) == 3
+
+    # Blobs are deleted once nothing points to them
+    for state in states[:2]:
+        await state.store("key_a", 1, A(foo=1))
+    await purge_group(states[2].router.session.client_token)
+    assert await states[0].load("key_a", 1) == A(foo=1)
+    assert len(sync_client.keys("storage-blob:*[^s]")) == 2
+
+
+class ShortLivedContentStorage(ContentStorage):
+    def timeout(self, attr: str) -> int:
+        return 60
+
+
+async def test_blobs_expire_with_longest_lived_pointer(root_state, fresh_redis):
+    _, sync_client = fresh_redis
+    await get_substate(root_state, ContentStorage).store("key_a", 1, A(foo=1))
+    (blob_key,) = sync_client.keys("storage-blob:*[^s]")
+    assert sync_client.ttl(blob_key) == 3600
+    # A shorter lived pointer doesn't shorten it, a longer lived one extends it
+    await get_substate(root_state, ShortLivedContentStorage).store("key_a", 1, A(foo=1))
+    assert sync_client.ttl(blob_key) == sync_client.ttl(blob_key + b":refs") == 3600
+
+
+async def test_check_server_version():
+    client = mock.AsyncMock()
+    client.info.return_value = {"redis_version": "6.2.14"}
+    with pytest.raises(RuntimeError, match="7.0"):
+        await backend.check_server_version(client)
+    client.info.return_value = {"redis_version": "7.2.4"}
+    await backend.check_server_version(client)
+    # fakeredis
+    await backend.check_server_version()